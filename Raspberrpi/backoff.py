@@ -0,0 +1,27 @@
+import random
+
+class ReconnectBackoff:
+    """Exponential backoff with jitter between reconnect attempts.
+
+    The n-th consecutive failure waits base * factor**n seconds, capped at `maximum`, minus a
+    random share of up to `jitter` of it, so several clients that lost the same link do not
+    retry in lockstep. reset() after a successful connection starts again from `base`.
+    """
+    __slots__ = ("base", "maximum", "factor", "jitter", "attempts", "_random")
+
+    def __init__(self, base=1.0, maximum=60.0, factor=2.0, jitter=0.5, rng=None):
+        self.base = base
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempts = 0  # Consecutive failures since the last reset()
+        self._random = rng if rng is not None else random.random
+
+    def next_delay(self):
+        """Seconds to wait before the next attempt; counts one more failure."""
+        delay = min(self.maximum, self.base * self.factor ** min(self.attempts, 64))
+        self.attempts += 1
+        return delay * (1.0 - self.jitter * self._random())
+
+    def reset(self):
+        self.attempts = 0
@@ -0,0 +1,104 @@
+import threading
+import time
+from collections import deque
+
+class BatchWorker:
+    """Bounded queue drained in batches by a background thread.
+
+    Producers call `_enqueue()`, which only appends to an in-memory deque (the newest item
+    is dropped and counted when `max_queued` are waiting). The worker takes everything
+    queued when `batch_size` items are waiting or every `flush_interval` seconds and passes
+    it to `_handle_batch(batch, final)`, which subclasses implement; `final` is True for the
+    last call from close(), even with an empty batch. Errors are reported through
+    `on_error(message)`, or printed when none is given. Subclasses set their own attributes
+    before calling __init__, which starts the thread.
+    """
+    def __init__(self, max_queued, batch_size, flush_interval, counters=(), on_error=None, name="BatchWorker"):
+        self.max_queued = max_queued
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_error = on_error
+        self.counters = dict.fromkeys(("queued", "dropped", "batches", *counters), 0)
+        self._items = deque()
+        self._cond = threading.Condition()
+        self._running = True
+        self._handled = 0  # Queued items taken through _handle_batch (for flush())
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def _enqueue(self, item):
+        """Queues one item. Returns False if it was dropped."""
+        with self._cond:
+            if not self._running or len(self._items) >= self.max_queued:
+                self.counters["dropped"] += 1
+                return False
+            self._items.append(item)
+            self.counters["queued"] += 1
+            if len(self._items) >= self.batch_size:
+                self._cond.notify()
+            return True
+
+    def queue_depth(self):
+        return len(self._items)
+
+    def stats(self):
+        with self._cond:
+            return {"queue_depth": len(self._items), **self.counters}
+
+    def flush(self, timeout=5.0):
+        """Blocks until everything queued so far has been handled."""
+        deadline = time.time() + timeout
+        with self._cond:
+            target = self.counters["queued"]
+            self._cond.notify_all()
+            while self._handled < target and time.time() < deadline:
+                self._cond.wait(0.05)
+
+    def close(self, timeout=5.0):
+        """Handles what is still queued, then releases the subclass's resources (_close())."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join(timeout)
+        try:
+            self._drain(final=True)  # In case the worker did not finish in time
+        finally:
+            self._close()
+
+    def _handle_batch(self, batch, final):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+    def _error(self, message):
+        if self.on_error:
+            try:
+                self.on_error(message)
+                return
+            except Exception:
+                pass
+        print(message)
+
+    def _drain(self, final=False):
+        with self._cond:
+            if not self._items and not final:
+                return
+            batch = list(self._items)
+            self._items.clear()
+        try:
+            self._handle_batch(batch, final)
+        finally:
+            with self._cond:
+                self._handled += len(batch)
+                self._cond.notify_all()  # Wake flush() waiters
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and len(self._items) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                running = self._running
+            self._drain()
+            if not running:
+                return
@@ -0,0 +1,136 @@
+"""
+bench_nodestats.py - Memory benchmark for set_client.NodeStats
+
+Usage:
+  python bench_nodestats.py [nodes] [packets_per_node]
+
+Drives simulated nodes through set_client.on_receive (telemetry, position and text packets,
+as on a busy public mesh) and reports the memory NODE_STATS holds afterwards, per node, for
+the slotted array-backed NodeStats and for the dict/list version it replaced (copied below
+as the baseline). Without arguments it runs 200, 2000 and 10000 nodes: a small and a large
+public mesh as heard by one radio, and the 10k-node scale the reduction is quoted at (the
+whole run takes about 30 s and 140 MB of RAM on a desktop CPU, longer on a Pi). Logging
+is off, so only the per-node state is measured, and us/packet comes from a separate run
+without tracemalloc (which slows allocation). The current NodeStats also carries the
+channelUtilization/airUtilTx percentile histograms, which the baseline has no equivalent
+for. The shared NODE_DISTANCES matrix and NODE_INDEX grid are swapped for no-op stand-ins
+while measuring, so only NODE_STATS is counted.
+"""
+import sys
+import gc
+import time
+import datetime
+import tracemalloc
+import set_client
+
+# --- Baseline: the previous NodeStats ---
+class LegacyNodeStats:
+    def __init__(self):
+        self.records = []
+        self.lat = None
+        self.lon = None
+        self.altitude = None
+        self.temp = None
+        self.last_seen = None
+        self.messages = []
+        self.extra_fields = {}
+        self.wio_reading = None
+
+    def add_metrics(self, ts, metrics: dict):
+        self.records.append({'ts': ts, **metrics})
+        self.last_seen = ts
+        cutoff = ts - datetime.timedelta(minutes=5)
+        self.records = [r for r in self.records if r['ts'] >= cutoff]
+        temp = metrics.get('temperature')
+        if temp is not None:
+            self.temp = temp
+
+    def update_position(self, lat, lon, altitude):
+        self.lat, self.lon, self.altitude = lat, lon, altitude
+
+    def add_message(self, ts, from_id, text):
+        self.messages.append((ts, from_id, text))
+        if len(self.messages) > 20:
+            self.messages = self.messages[-20:]
+
+    def set_extra_fields(self, decoded, exclude_keys=None):
+        if exclude_keys is None:
+            exclude_keys = set()
+        self.extra_fields = {k: v for k, v in decoded.items() if k not in exclude_keys}
+
+class UntrackedPositions:
+    """Stand-in for NODE_DISTANCES / NODE_INDEX: accepts position updates and keeps nothing."""
+    def update(self, node_id, lat, lon):
+        return True
+
+    def remove(self, node_id):
+        pass
+
+# --- Simulated traffic ---
+def simulated_packet(node_num, seq):
+    """One packet shaped like meshtastic's pubsub dicts; the kind rotates with seq."""
+    from_id = f"!{node_num:08x}"  # Built fresh per packet, like the decoder does
+    packet = {'from': node_num, 'to': 4294967295, 'fromId': from_id, 'toId': '^all', 'id': seq,
+              'rxTime': int(time.time()), 'rxSnr': 6.25, 'rxRssi': -90, 'hopLimit': 3}
+    kind = seq % 4
+    if kind == 3:
+        text = f"hello from {from_id} #{seq}"
+        packet['decoded'] = {'portnum': 'TEXT_MESSAGE_APP', 'payload': text.encode(), 'text': text, 'bitfield': 1}
+    elif kind == 2:
+        packet['decoded'] = {'portnum': 'POSITION_APP', 'payload': bytes(24), 'bitfield': 1,
+                             'position': {'latitudeI': 47316992 + node_num, 'longitudeI': -740425728,
+                                          'latitude': 4.7316992 + node_num / 1e7, 'longitude': -74.0425728, 'altitude': 2600}}
+    else:
+        packet['decoded'] = {'portnum': 'TELEMETRY_APP', 'payload': bytes(30), 'bitfield': 1,
+                             'telemetry': {'time': int(time.time()),
+                                           'deviceMetrics': {'batteryLevel': 80 + seq % 20, 'voltage': 4.01,
+                                                             'channelUtilization': 12.5, 'airUtilTx': 1.5,
+                                                             'uptimeSeconds': 3600 + seq}}}
+    return packet
+
+def measure(label, node_cls, nodes, packets_per_node):
+    set_client.NodeStats = node_cls
+    # Speed: packets built up front, nothing traced
+    packets = [simulated_packet(node_num, seq) for seq in range(packets_per_node) for node_num in range(nodes)]
+    set_client.NODE_STATS.clear()
+    gc.collect()
+    start = time.perf_counter()
+    for packet in packets:
+        set_client.on_receive(packet, None)
+    elapsed = time.perf_counter() - start
+    del packets
+    # Memory: a fresh run under tracemalloc; packets are built inside it so whatever NodeStats keeps of them counts
+    set_client.NODE_STATS.clear()
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for seq in range(packets_per_node):
+        for node_num in range(nodes):
+            set_client.on_receive(simulated_packet(node_num, seq), None)
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f"  {label:<28} {held / nodes:8.0f} bytes/node  ({held / 1e6:.1f} MB total, "
+          f"{elapsed / (nodes * packets_per_node) * 1e6:.1f} us/packet)")
+    set_client.NODE_STATS.clear()
+    return held
+
+def main():
+    node_counts = [int(sys.argv[1])] if len(sys.argv) > 1 else [200, 2000, 10000]
+    packets_per_node = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    set_client.LOG_FILE = None
+    current_cls = set_client.NodeStats
+    distances, index = set_client.NODE_DISTANCES, set_client.NODE_INDEX
+    set_client.NODE_DISTANCES = set_client.NODE_INDEX = UntrackedPositions()
+    try:
+        for nodes in node_counts:
+            print(f"NODE_STATS memory after {nodes} nodes x {packets_per_node} packets through on_receive")
+            before = measure("before: dict/list NodeStats", LegacyNodeStats, nodes, packets_per_node)
+            after = measure("after:  slotted NodeStats", current_cls, nodes, packets_per_node)
+            print(f"  reduction: {before / after:.2f}x")
+    finally:
+        set_client.NodeStats = current_cls
+        set_client.NODE_DISTANCES, set_client.NODE_INDEX = distances, index
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+bench_serializer.py - Micro-benchmark for serialization.make_serializable
+
+Usage:
+  python bench_serializer.py [iterations]
+
+Times the per-packet cost of turning a typical received Meshtastic packet (and a bridge
+log_activity entry) into JSON, comparing the shared type-dispatch serializer with the
+recursive isinstance-chain versions that used to live in set_client.py and
+wio_to_meshtastic.py (copied below as the baseline). The packet is built the way the
+meshtastic library delivers it, with real MeshPacket and Telemetry protobuf messages under
+'raw', and every version serializes the same objects. Needs meshtastic and protobuf.
+The old code turned those messages into text-format strings. set_client now logs the
+decoded dicts as typed JSON and each 'raw' as its message type (without_raw_protobufs);
+the third packet row converts the full 'raw' messages too, for comparison.
+"""
+import sys
+import json
+import time
+import datetime
+from google.protobuf.json_format import MessageToDict
+try:
+    from meshtastic.protobuf import mesh_pb2, portnums_pb2, telemetry_pb2
+except ImportError:  # meshtastic < 2.3 ships the generated modules at the package root
+    from meshtastic import mesh_pb2, portnums_pb2, telemetry_pb2
+from serialization import make_serializable, without_raw_protobufs
+
+# --- Baselines: the previous per-script implementations ---
+def legacy_set_client_make_serializable(obj):
+    if isinstance(obj, dict):
+        return {k: legacy_set_client_make_serializable(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [legacy_set_client_make_serializable(item) for item in obj]
+    elif isinstance(obj, tuple):
+        return tuple(legacy_set_client_make_serializable(item) for item in obj)
+    elif isinstance(obj, bytes):
+        return obj.hex()
+    elif hasattr(obj, '__dict__'):
+        return legacy_set_client_make_serializable(obj.__dict__)
+    else:
+        try:
+            return str(obj)
+        except:
+            return "UNSERIALIZABLE"
+
+def legacy_bridge_make_serializable(obj):
+    if isinstance(obj, dict):
+        return {k: legacy_bridge_make_serializable(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [legacy_bridge_make_serializable(item) for item in obj]
+    elif isinstance(obj, tuple):
+        return tuple(legacy_bridge_make_serializable(item) for item in obj)
+    elif isinstance(obj, bytes):
+        return obj.hex()
+    elif isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    elif hasattr(obj, '__dict__'):
+        try:
+            return legacy_bridge_make_serializable(obj.__dict__)
+        except RecursionError:
+            return f"UNSERIALIZABLE_OBJECT_RECURSION:{str(type(obj))}"
+        except Exception:
+            return f"UNSERIALIZABLE_OBJECT:{str(type(obj))}"
+    else:
+        try:
+            if isinstance(obj, (str, int, float, bool, type(None))):
+                return obj
+            return str(obj)
+        except Exception:
+            return f"UNSERIALIZABLE_TYPE:{str(type(obj))}"
+
+# --- Sample data ---
+def sample_packet():
+    """A TELEMETRY_APP packet as meshtastic's pubsub callback delivers it: the MeshPacket as a
+    dict with the decoded Telemetry alongside, each keeping its protobuf message under 'raw'."""
+    telemetry = telemetry_pb2.Telemetry(time=1718000000)
+    telemetry.device_metrics.battery_level = 92
+    telemetry.device_metrics.voltage = 4.07
+    telemetry.device_metrics.channel_utilization = 11.5
+    telemetry.device_metrics.air_util_tx = 2.1
+    telemetry.device_metrics.uptime_seconds = 86400
+    raw = mesh_pb2.MeshPacket(to=4294967295, channel=0, id=2093170203, rx_time=1718000000,
+                              rx_snr=6.25, hop_limit=3, rx_rssi=-42, hop_start=3)
+    setattr(raw, 'from', 1494824058)  # 'from' is a Python keyword
+    raw.decoded.portnum = portnums_pb2.TELEMETRY_APP
+    raw.decoded.payload = telemetry.SerializeToString()
+
+    # Same steps as MeshInterface._handlePacketFromRadio
+    packet = MessageToDict(raw)
+    packet['raw'] = raw
+    packet['fromId'] = '!5919307a'
+    packet['toId'] = '^all'
+    packet['decoded']['payload'] = raw.decoded.payload
+    decoded_telemetry = MessageToDict(telemetry)
+    decoded_telemetry['raw'] = telemetry
+    packet['decoded']['telemetry'] = decoded_telemetry
+    return packet
+
+def sample_log_details():
+    return {"topic": "wio/environmental_station/data", "payload_keys": ["rpi_timestamp", "temp", "humidity"],
+            "qos": 1, "queued": True, "when": datetime.datetime(2024, 6, 10, 12, 0, 0)}
+
+def log_packet(packet):
+    """What set_client.format_packet_log_entry serializes."""
+    return make_serializable(without_raw_protobufs(packet))
+
+def bench(label, func, obj, iterations):
+    func(obj)  # Warm up (fills the dispatch cache for the new serializer)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        json.dumps(func(obj))
+    elapsed = time.perf_counter() - start
+    per_item_us = elapsed / iterations * 1e6
+    print(f"  {label:<38} {per_item_us:8.2f} us/packet")
+    return per_item_us
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"Serializer benchmark ({iterations} iterations, make_serializable + json.dumps)")
+
+    packet = sample_packet()
+    print("Received Meshtastic packet (set_client.on_receive):")
+    before = bench("before: set_client.make_serializable", legacy_set_client_make_serializable, packet, iterations)
+    after = bench("after:  set_client packet log", log_packet, packet, iterations)
+    full = bench("full 'raw' protobufs as dicts", make_serializable, packet, iterations)
+    print(f"  speedup: {before / after:.2f}x (full 'raw' conversion: {before / full:.2f}x)")
+
+    details = sample_log_details()
+    print("Bridge log entry (wio_to_meshtastic.log_activity):")
+    before = bench("before: bridge make_serializable", legacy_bridge_make_serializable, details, iterations)
+    after = bench("after:  serialization.make_serializable", make_serializable, details, iterations)
+    print(f"  speedup: {before / after:.2f}x")
+
+if __name__ == "__main__":
+    main()
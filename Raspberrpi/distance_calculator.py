@@ -1,8 +1,12 @@
 import math
+import threading
+import numpy as np
+
+EARTH_RADIUS_M = 6371000
 
 def haversine(lat1, lon1, lat2, lon2):
     # Earth radius in meters
-    R = 6371000
+    R = EARTH_RADIUS_M
     phi1 = math.radians(lat1)
     phi2 = math.radians(lat2)
     dphi = math.radians(lat2 - lat1)
@@ -12,6 +16,114 @@ def haversine(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return R * c
 
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Vectorized haversine in meters. Arguments are degrees and broadcast like NumPy arrays."""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.subtract(lon2, lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+class DistanceMatrix:
+    """Cached all-pairs distances (meters) between node positions.
+
+    Each node owns one row and column of a preallocated square float32 matrix (meter
+    resolution is plenty for mesh links). update() recomputes only that row/column against
+    every other node in one vectorized pass (O(n)), instead of rebuilding all n^2 pairs;
+    storage doubles when full. Memory is quadratic, so at most `max_nodes` nodes are tracked
+    (2048 nodes = 16 MB); positions of further nodes are ignored and counted in `rejected`.
+    Safe to update from the meshtastic receive thread while other threads query.
+    """
+    def __init__(self, initial_capacity=64, max_nodes=2048):
+        self.max_nodes = max_nodes
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._ids = []      # row -> node id
+        self._rows = {}     # node id -> row
+        capacity = min(initial_capacity, max_nodes)
+        self._lat = np.zeros(capacity)
+        self._lon = np.zeros(capacity)
+        self._matrix = np.zeros((capacity, capacity), dtype=np.float32)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, node_id):
+        return node_id in self._rows
+
+    def _grow(self):
+        capacity = min(2 * len(self._lat), self.max_nodes)
+        n = len(self._ids)
+        for name in ("_lat", "_lon"):
+            grown = np.zeros(capacity)
+            grown[:n] = getattr(self, name)[:n]
+            setattr(self, name, grown)
+        matrix = np.zeros((capacity, capacity), dtype=np.float32)
+        matrix[:n, :n] = self._matrix[:n, :n]
+        self._matrix = matrix
+
+    def update(self, node_id, lat, lon):
+        """Adds or moves a node and refreshes its row and column. Returns False if the matrix is full."""
+        with self._lock:
+            row = self._rows.get(node_id)
+            if row is None:
+                if len(self._ids) >= self.max_nodes:
+                    self.rejected += 1
+                    return False
+                if len(self._ids) == len(self._lat):
+                    self._grow()
+                row = len(self._ids)
+                self._ids.append(node_id)
+                self._rows[node_id] = row
+            n = len(self._ids)
+            self._lat[row] = lat
+            self._lon[row] = lon
+            distances = haversine_np(lat, lon, self._lat[:n], self._lon[:n])
+            distances[row] = 0.0
+            self._matrix[row, :n] = distances
+            self._matrix[:n, row] = distances
+            return True
+
+    def remove(self, node_id):
+        """Drops a node; the last node takes over its row and column."""
+        with self._lock:
+            row = self._rows.pop(node_id, None)
+            if row is None:
+                return
+            last = len(self._ids) - 1
+            if row != last:
+                moved = self._ids[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+                self._lat[row] = self._lat[last]
+                self._lon[row] = self._lon[last]
+                self._matrix[row, :] = self._matrix[last, :]
+                self._matrix[:, row] = self._matrix[:, last]
+                self._matrix[row, row] = 0.0
+            self._ids.pop()
+
+    def distance(self, node_a, node_b):
+        """Meters between two nodes, or None if either has no position."""
+        with self._lock:
+            a, b = self._rows.get(node_a), self._rows.get(node_b)
+            return None if a is None or b is None else float(self._matrix[a, b])
+
+    def distances_from(self, node_id):
+        """{other node id: meters} for every other positioned node."""
+        with self._lock:
+            row = self._rows.get(node_id)
+            if row is None:
+                return {}
+            distances = self._matrix[row, :len(self._ids)].tolist()
+            return {other: d for other, d in zip(self._ids, distances) if other != node_id}
+
+    def snapshot(self):
+        """(node ids, n x n distance array) as copies, for analysis or display."""
+        with self._lock:
+            n = len(self._ids)
+            return list(self._ids), self._matrix[:n, :n].copy()
+
 if __name__ == "__main__":
     # Coordinates from Meshtastic logs
     lat_ed48, lon_ed48 = 4.7316992, -74.0425728
@@ -19,4 +131,3 @@ if __name__ == "__main__":
 
     distance = haversine(lat_ed48, lon_ed48, lat_badbite, lon_badbite)
     print(f"Distance between !938bed48 and !5919307a: {distance:.2f} meters")
-
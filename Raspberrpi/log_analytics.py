@@ -0,0 +1,243 @@
+"""
+log_analytics.py - Offline summaries of archived set_client and bridge logs
+
+Usage:
+  python log_analytics.py [--workers N] [--gap SECONDS] [--json OUT.json] [LOG_FILE_OR_GLOB ...]
+
+Streams each JSONL log line by line and spreads the files across a process pool (one file
+per task). Workers only pull out timestamps, senders and numeric metrics into flat arrays;
+all statistics are NumPy reductions over those arrays in the parent:
+  - per node: message count, portnum breakdown, first/last seen, message rate, gaps
+    (intervals longer than --gap), median interval
+  - per node and metric (telemetry device/environment metrics, rxSnr/rxRssi, decoded Wio
+    readings): count, min, p5, median, p95, max, mean, stddev
+  - per bridge event type: count, rate and gaps (e.g. missing Wio data blocks)
+"""
+import os
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from log_index import resolve_log_paths
+
+DEFAULT_GAP_S = 600  # Silence longer than this counts as a gap
+TELEMETRY_GROUPS = ("deviceMetrics", "environmentMetrics", "airQualityMetrics", "powerMetrics")
+PACKET_METRICS = ("rxSnr", "rxRssi")
+PERCENTILES = (5, 50, 95)
+
+def iter_log_records(path):
+    """Yields each line of a JSONL log as a dict (None for lines that do not decode)."""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield None
+                continue
+            yield record if isinstance(record, dict) else None
+
+def _numeric_items(mapping):
+    for key, value in mapping.items():
+        if type(value) in (int, float):  # Excludes bools
+            yield key, value
+
+def packet_metrics(packet):
+    """Numeric metrics carried by one logged Meshtastic packet, as (name, value) pairs."""
+    for key in PACKET_METRICS:
+        value = packet.get(key)
+        if type(value) in (int, float):
+            yield key, value
+    decoded = packet.get("decoded")
+    if not isinstance(decoded, dict):
+        return
+    telemetry = decoded.get("telemetry")
+    if isinstance(telemetry, dict):
+        for group in TELEMETRY_GROUPS:
+            if isinstance(telemetry.get(group), dict):
+                yield from _numeric_items(telemetry[group])
+    wio = decoded.get("wioReading")
+    if isinstance(wio, dict):
+        for key, value in _numeric_items(wio):
+            if key != "stationId":
+                yield f"wio.{key}", value
+
+def _to_epoch(ts_strings):
+    """Log timestamps ('YYYY-mm-dd HH:MM:SS', or ISO with fractions) to float epoch seconds (NaN if unparseable)."""
+    trimmed = [s[:19] if isinstance(s, str) else "NaT" for s in ts_strings]
+    try:
+        stamps = np.array(trimmed, dtype="datetime64[s]")
+    except ValueError:
+        stamps = np.array([_parse_one(s) for s in trimmed], dtype="datetime64[s]")
+    epoch = stamps.astype("int64").astype("float64")
+    epoch[np.isnat(stamps)] = np.nan
+    return epoch
+
+def _parse_one(value):
+    try:
+        return np.datetime64(value, "s")
+    except ValueError:
+        return np.datetime64("NaT")
+
+def analyze_file(path):
+    """Reduces one log to flat arrays. Runs in a worker process; the result must be picklable."""
+    ts_strings = []
+    node_rows = {}      # node id -> row indexes into ts_strings
+    portnums = {}       # node id -> {portnum: count}
+    metrics = {}        # (node id, metric) -> values
+    event_rows = {}     # bridge event type -> row indexes
+    records = bad = 0
+    for record in iter_log_records(path):
+        if record is None:
+            bad += 1
+            continue
+        records += 1
+        row = len(ts_strings)
+        if "event_type" in record:  # Bridge activity log
+            ts_strings.append(record.get("timestamp"))
+            event_rows.setdefault(record["event_type"], []).append(row)
+            continue
+        ts_strings.append(record.get("ts"))
+        packet = record.get("packet")
+        if isinstance(packet, dict):
+            node = packet.get("fromId") or str(packet.get("from", "unknown"))
+            decoded = packet.get("decoded")
+            portnum = decoded.get("portnum") if isinstance(decoded, dict) else None
+            for name, value in packet_metrics(packet):
+                metrics.setdefault((node, name), []).append(value)
+        else:  # set_client's serialization_failed fallback record
+            node = record.get("packet_from") or "unknown"
+            portnum = record.get("packet_type")
+        node_rows.setdefault(node, []).append(row)
+        counts = portnums.setdefault(node, {})
+        counts[str(portnum)] = counts.get(str(portnum), 0) + 1
+
+    epoch = _to_epoch(ts_strings)
+    return {
+        "path": path,
+        "records": records,
+        "bad_lines": bad,
+        "nodes": {node: epoch[np.array(rows)] for node, rows in node_rows.items()},
+        "portnums": portnums,
+        "metrics": {key: np.array(values, dtype="float64") for key, values in metrics.items()},
+        "events": {event: epoch[np.array(rows)] for event, rows in event_rows.items()},
+    }
+
+def timing_summary(epoch, gap_s):
+    """Count, first/last, rate and gap statistics for one series of timestamps."""
+    ts = np.sort(epoch[~np.isnan(epoch)])
+    summary = {"count": int(epoch.size)}
+    if not ts.size:
+        return summary
+    span = float(ts[-1] - ts[0])
+    intervals = np.diff(ts)
+    gaps = intervals[intervals > gap_s]
+    summary.update({
+        "first": str(np.datetime64(int(ts[0]), "s")),
+        "last": str(np.datetime64(int(ts[-1]), "s")),
+        "per_hour": round(ts.size / (span / 3600), 2) if span > 0 else None,
+        "median_interval_s": float(np.median(intervals)) if intervals.size else None,
+        "gaps": int(gaps.size),
+        "longest_gap_s": float(gaps.max()) if gaps.size else 0.0,
+        "gap_time_s": float(gaps.sum()),
+    })
+    return summary
+
+def distribution_summary(values):
+    values = values[~np.isnan(values)]
+    if not values.size:
+        return {"count": 0}
+    p_low, p_mid, p_high = np.percentile(values, PERCENTILES)
+    return {
+        "count": int(values.size),
+        "min": float(values.min()),
+        "p5": float(p_low),
+        "median": float(p_mid),
+        "p95": float(p_high),
+        "max": float(values.max()),
+        "mean": float(values.mean()),
+        "std": float(values.std()),
+    }
+
+def merge_partials(partials):
+    """Concatenates the per-file arrays into one array per node, metric and event."""
+    nodes, portnums, metrics, events = {}, {}, {}, {}
+    totals = {"files": 0, "records": 0, "bad_lines": 0}
+    for partial in partials:
+        totals["files"] += 1
+        totals["records"] += partial["records"]
+        totals["bad_lines"] += partial["bad_lines"]
+        for target, source in ((nodes, partial["nodes"]), (metrics, partial["metrics"]), (events, partial["events"])):
+            for key, array in source.items():
+                target.setdefault(key, []).append(array)
+        for node, counts in partial["portnums"].items():
+            merged = portnums.setdefault(node, {})
+            for portnum, n in counts.items():
+                merged[portnum] = merged.get(portnum, 0) + n
+    concat = lambda groups: {key: np.concatenate(arrays) for key, arrays in groups.items()}
+    return totals, concat(nodes), portnums, concat(metrics), concat(events)
+
+def analyze_logs(paths, workers=None, gap_s=DEFAULT_GAP_S):
+    """Runs analyze_file over all logs (in parallel with workers > 1) and returns the summaries."""
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            partials = list(pool.map(analyze_file, paths))
+    else:
+        partials = [analyze_file(path) for path in paths]
+    totals, nodes, portnums, metrics, events = merge_partials(partials)
+    return {
+        "totals": totals,
+        "nodes": {node: {**timing_summary(epoch, gap_s), "portnums": portnums.get(node, {})}
+                  for node, epoch in sorted(nodes.items())},
+        "metrics": {f"{node} {name}": distribution_summary(values)
+                    for (node, name), values in sorted(metrics.items())},
+        "events": {event: timing_summary(epoch, gap_s) for event, epoch in sorted(events.items())},
+    }
+
+def _fmt(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return f"{value:.2f}"
+    return str(value)
+
+def print_table(title, rows, columns):
+    if not rows:
+        return
+    header = ["name"] + list(columns)
+    table = [[name] + [_fmt(row.get(col)) for col in columns] for name, row in rows.items()]
+    widths = [max(len(str(cell)) for cell in column) for column in zip(header, *table)]
+    print(f"\n{title}")
+    for line in [header] + table:
+        print("  ".join(str(cell).ljust(width) for cell, width in zip(line, widths)))
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-node and per-sensor summaries of archived set_client and bridge logs.")
+    parser.add_argument('logs', nargs='*', help='Log files or globs (default: all logs/meshtastic_log_*.jsonl and logs/wio_meshtastic_bridge_log_*.jsonl)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: one per CPU)')
+    parser.add_argument('--gap', type=float, default=DEFAULT_GAP_S, help='Seconds of silence counted as a gap')
+    parser.add_argument('--json', dest='json_out', help='Also write the full summaries to this JSON file')
+    args = parser.parse_args()
+
+    paths = resolve_log_paths(args.logs)
+    if not paths:
+        print("No log files found.", file=sys.stderr)
+        return 1
+    result = analyze_logs(paths, args.workers, args.gap)
+    totals = result["totals"]
+    print(f"{totals['records']} records from {totals['files']} files ({totals['bad_lines']} undecodable lines)")
+    timing_columns = ("count", "first", "last", "per_hour", "median_interval_s", "gaps", "longest_gap_s")
+    print_table("Nodes", result["nodes"], timing_columns)
+    print_table("Metrics", result["metrics"], ("count", "min", "p5", "median", "p95", "max", "mean", "std"))
+    print_table("Bridge events", result["events"], timing_columns)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nWrote {args.json_out}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""
+log_index.py - Indexed queries over the JSONL logs in logs/
+
+Usage:
+  python log_index.py [--from !5919307a] [--portnum TELEMETRY_APP] [--since "2024-06-04"]
+                      [--until "2024-06-05"] [--limit N] [--count] [--rebuild] [LOG_FILE_OR_GLOB ...]
+
+Each log file gets a sidecar SQLite index (<log>.idx.sqlite3) with the byte offset and length
+of every record, keyed by timestamp, sender (`fromId`) and kind (the packet's `portnum` for
+set_client logs, the `event_type` for bridge logs). The index is brought up to date
+incrementally on every query: only bytes appended since the last run are scanned, and only the
+three key fields are pulled out of each line. Matching records are then read straight from a
+memory map of the log, so nothing irrelevant is decoded. Matches are printed as the original
+JSON lines.
+
+Timestamps are the logs' own local times ("YYYY-mm-dd HH:MM:SS"); --since is inclusive,
+--until exclusive, and either may be given as just a date.
+"""
+import os
+import re
+import sys
+import glob
+import json
+import mmap
+import sqlite3
+import argparse
+
+DEFAULT_LOG_GLOBS = (os.path.join("logs", "meshtastic_log_*.jsonl"),
+                     os.path.join("logs", "wio_meshtastic_bridge_log_*.jsonl"))
+INDEX_SUFFIX = ".idx.sqlite3"
+INDEX_VERSION = 1
+FINGERPRINT_BYTES = 256  # Start of the log stored in the index to notice a replaced file
+
+# Key fields are found with byte regexes; both writers emit json.dumps' default '": "' spacing.
+# A field quoted inside a string value is escaped (\"fromId\") and so never matches.
+_TS_RE = re.compile(rb'^\{"(?:ts|timestamp)": "([^"]{10,32})"')
+_FROM_RE = re.compile(rb'"(?:fromId|packet_from)": "([^"]*)"')
+_KIND_RE = re.compile(rb'"(?:portnum|packet_type|event_type)": "([^"]*)"')
+
+def normalize_ts(value):
+    """'2024-06-04T12:00:00.123' and '2024-06-04 12:00:00' both become '2024-06-04 12:00:00'.
+    Fixed-width strings like these compare in time order."""
+    return value.replace("T", " ")[:19] if value else None
+
+def extract_keys(line):
+    """Returns (ts, from_id, kind) for one raw log line (bytes), any of them possibly None."""
+    ts_match = _TS_RE.match(line)
+    if ts_match:
+        from_match = _FROM_RE.search(line)
+        kind_match = _KIND_RE.search(line)
+        return (normalize_ts(ts_match.group(1).decode("ascii", "replace")),
+                from_match.group(1).decode("utf-8", "replace") if from_match else None,
+                kind_match.group(1).decode("utf-8", "replace") if kind_match else None)
+    # Unusual formatting: fall back to decoding this one line
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None, None, None
+    if not isinstance(record, dict):
+        return None, None, None
+    packet = record.get("packet") if isinstance(record.get("packet"), dict) else {}
+    decoded = packet.get("decoded") if isinstance(packet.get("decoded"), dict) else {}
+    ts = record.get("ts") or record.get("timestamp")
+    return (normalize_ts(ts) if isinstance(ts, str) else None,
+            packet.get("fromId") or record.get("packet_from"),
+            decoded.get("portnum") or record.get("packet_type") or record.get("event_type"))
+
+def _open_map(f):
+    # mmap refuses empty files
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else None
+
+class LogIndex:
+    """Sidecar index for one JSONL log file."""
+    def __init__(self, log_path, index_path=None):
+        self.log_path = log_path
+        self.index_path = index_path or log_path + INDEX_SUFFIX
+        self._conn = sqlite3.connect(self.index_path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " offset INTEGER PRIMARY KEY, length INTEGER NOT NULL, ts TEXT, from_id TEXT, kind TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_ts ON records (ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_from_ts ON records (from_id, ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS records_kind_ts ON records (kind, ts)")
+        self._conn.commit()
+        if self._meta("version") != INDEX_VERSION:
+            self.clear()
+
+    def _meta(self, key, default=None):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, **values):
+        self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", values.items())
+
+    def clear(self):
+        with self._conn:
+            self._conn.execute("DELETE FROM records")
+            self._conn.execute("DELETE FROM meta")
+            self._set_meta(version=INDEX_VERSION, indexed_bytes=0, fingerprint=b"")
+
+    def update(self):
+        """Indexes complete lines appended since the last update. Returns the number of new records.
+
+        The whole index is rebuilt if the log shrank or its first bytes changed (file replaced).
+        """
+        with open(self.log_path, "rb") as f:
+            mm = _open_map(f)
+            if mm is None:
+                return 0
+            with mm:
+                size = len(mm)
+                fingerprint = mm[:FINGERPRINT_BYTES]
+                start = self._meta("indexed_bytes", 0)
+                stored_fingerprint = self._meta("fingerprint", b"")
+                if start > size or fingerprint[:len(stored_fingerprint)] != stored_fingerprint:
+                    self.clear()
+                    start = 0
+                end = mm.rfind(b"\n", start) + 1  # A trailing partial line waits for the next update
+                if end <= start:
+                    return 0
+                rows = []
+                pos = start
+                while pos < end:
+                    nl = mm.find(b"\n", pos, end)
+                    line = mm[pos:nl]
+                    if line.strip():
+                        rows.append((pos, nl - pos, *extract_keys(line)))
+                    pos = nl + 1
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO records (offset, length, ts, from_id, kind) VALUES (?, ?, ?, ?, ?)", rows)
+            self._set_meta(indexed_bytes=end, fingerprint=fingerprint)
+        return len(rows)
+
+    def _where(self, since, until, from_id, kind):
+        clauses, params = [], []
+        for clause, value in (("ts >= ?", normalize_ts(since)), ("ts < ?", normalize_ts(until)),
+                              ("from_id = ?", from_id), ("kind = ?", kind)):
+            if value is not None:
+                clauses.append(clause)
+                params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def offsets(self, since=None, until=None, from_id=None, kind=None, limit=None):
+        """(offset, length) of matching records in file order."""
+        where, params = self._where(since, until, from_id, kind)
+        sql = "SELECT offset, length FROM records" + where + " ORDER BY offset"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._conn.execute(sql, params).fetchall()
+
+    def count(self, since=None, until=None, from_id=None, kind=None):
+        where, params = self._where(since, until, from_id, kind)
+        return self._conn.execute("SELECT COUNT(*) FROM records" + where, params).fetchone()[0]
+
+    def raw_records(self, since=None, until=None, from_id=None, kind=None, limit=None):
+        """Yields the matching lines as bytes, read from a memory map of the log."""
+        matches = self.offsets(since, until, from_id, kind, limit)
+        if not matches:
+            return
+        with open(self.log_path, "rb") as f:
+            mm = _open_map(f)
+            if mm is None:
+                return
+            with mm:
+                for offset, length in matches:
+                    yield mm[offset:offset + length]
+
+    def records(self, since=None, until=None, from_id=None, kind=None, limit=None):
+        """Yields the matching records as dicts."""
+        for line in self.raw_records(since, until, from_id, kind, limit):
+            yield json.loads(line)
+
+    def close(self):
+        self._conn.close()
+
+def resolve_log_paths(patterns=None):
+    """Log files matching the given paths/globs (default: all set_client and bridge logs), oldest first."""
+    paths = set()
+    for pattern in patterns or DEFAULT_LOG_GLOBS:
+        paths.update(p for p in glob.glob(pattern) if not p.endswith(INDEX_SUFFIX) and os.path.isfile(p))
+    # Names carry the start time, so sorting by name is chronological within each log type
+    return sorted(paths, key=lambda p: (os.path.basename(p).split("_log_")[-1], p))
+
+def query_logs(paths=None, since=None, until=None, from_id=None, kind=None, limit=None, raw=False):
+    """Updates the index of each log file and yields matching records (dicts, or bytes with raw=True)."""
+    remaining = limit
+    for path in resolve_log_paths(paths):
+        index = LogIndex(path)
+        try:
+            index.update()
+            fetch = index.raw_records if raw else index.records
+            for record in fetch(since, until, from_id, kind, remaining):
+                yield record
+                if remaining is not None:
+                    remaining -= 1
+            if remaining is not None and remaining <= 0:
+                return
+        finally:
+            index.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Query set_client and bridge JSONL logs through incremental sidecar indexes.")
+    parser.add_argument('logs', nargs='*', help='Log files or globs (default: logs/meshtastic_log_*.jsonl and logs/wio_meshtastic_bridge_log_*.jsonl)')
+    parser.add_argument('--from', dest='from_id', help='Sender node id, e.g. !5919307a')
+    parser.add_argument('--portnum', '--event', dest='kind', help='Packet portnum (e.g. TELEMETRY_APP) or bridge event_type')
+    parser.add_argument('--since', help='Earliest timestamp, inclusive (e.g. "2024-06-04" or "2024-06-04 12:00:00")')
+    parser.add_argument('--until', help='Latest timestamp, exclusive')
+    parser.add_argument('--limit', type=int, help='Stop after this many records')
+    parser.add_argument('--count', action='store_true', help='Print the number of matches per file instead of the records')
+    parser.add_argument('--rebuild', action='store_true', help='Discard the existing indexes and rebuild them; records are printed only if a filter is also given')
+    args = parser.parse_args()
+
+    paths = resolve_log_paths(args.logs)
+    if not paths:
+        print("No log files found.", file=sys.stderr)
+        return 1
+    if args.rebuild or args.count:
+        total = 0
+        for path in paths:
+            index = LogIndex(path)
+            try:
+                if args.rebuild:
+                    index.clear()
+                added = index.update()
+                if args.count:
+                    n = index.count(args.since, args.until, args.from_id, args.kind)
+                    total += n
+                    print(f"{path}: {n}")
+                else:
+                    print(f"{path}: indexed {added} records", file=sys.stderr)
+            finally:
+                index.close()
+        if args.count:
+            print(f"Total: {total}")
+            return 0
+        if not any((args.from_id, args.kind, args.since, args.until, args.limit)):
+            return 0  # Plain --rebuild only refreshes the indexes
+
+    out = sys.stdout.buffer
+    try:
+        for line in query_logs(paths, args.since, args.until, args.from_id, args.kind, args.limit, raw=True):
+            out.write(line + b"\n")
+        out.flush()
+    except BrokenPipeError:  # e.g. piped into head
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import os
+import time
+from batch_worker import BatchWorker
+
+FSYNC_NEVER = "never"        # Leave it to the OS page cache (fastest, may lose the last seconds on power loss)
+FSYNC_INTERVAL = "interval"  # fsync at most every `fsync_interval` seconds
+FSYNC_ALWAYS = "always"      # fsync after every batch write
+FSYNC_POLICIES = (FSYNC_NEVER, FSYNC_INTERVAL, FSYNC_ALWAYS)
+
+class BackgroundLogWriter(BatchWorker):
+    """Writes log records to a file from a background thread.
+
+    `write_line()` only appends to a bounded in-memory queue, so hot-path callers never touch
+    the disk. If a `formatter` is given, queued items are raw records and the formatter turns
+    each into its text line on the worker thread (e.g. json.dumps). The worker (BatchWorker)
+    writes everything queued as one batch when `flush_size` lines are waiting or
+    `flush_interval` seconds have passed, then flushes (and fsyncs per `fsync_policy`). When
+    the queue is full the newest line is dropped and counted.
+    """
+    def __init__(self, file_obj, max_queued=10000, flush_interval=1.0, flush_size=200,
+                 fsync_policy=FSYNC_INTERVAL, fsync_interval=30.0, formatter=None, on_error=None, name="BackgroundLogWriter"):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy: {fsync_policy}")
+        self.file = file_obj
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+        self.formatter = formatter
+        self._last_fsync = time.time()
+        super().__init__(max_queued, flush_size, flush_interval, on_error=on_error, name=name,
+                         counters=("written", "fsyncs", "write_errors", "format_errors"))
+
+    @property
+    def name(self):
+        return getattr(self.file, "name", None)
+
+    def write_line(self, line):
+        """Queues one line (without the trailing newline), or one record when a formatter is set.
+        Returns False if it was dropped."""
+        return self._enqueue(line)
+
+    def close(self, timeout=5.0):
+        """Writes out the queue, fsyncs and closes the file."""
+        super().close(timeout)
+
+    def _close(self):
+        self.file.close()
+
+    def _handle_batch(self, batch, final):
+        if self.formatter and batch:
+            lines = []
+            for item in batch:
+                try:
+                    lines.append(self.formatter(item))
+                except Exception as e:
+                    self.counters["format_errors"] += 1
+                    self._error(f"[LOG WRITER ERROR] Could not format log record: {e}")
+            batch = lines
+        try:
+            if batch:
+                self.file.write("\n".join(batch) + "\n")
+                self.file.flush()
+            now = time.time()
+            if final or self.fsync_policy == FSYNC_ALWAYS or \
+               (self.fsync_policy == FSYNC_INTERVAL and now - self._last_fsync >= self.fsync_interval):
+                os.fsync(self.file.fileno())
+                self._last_fsync = now
+                self.counters["fsyncs"] += 1
+            self.counters["written"] += len(batch)
+            self.counters["batches"] += 1
+        except (OSError, ValueError) as e:
+            self.counters["write_errors"] += 1
+            self._error(f"[LOG WRITER ERROR] Failed to write {len(batch)} log lines to {self.name}: {e}")
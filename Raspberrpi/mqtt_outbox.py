@@ -0,0 +1,366 @@
+import threading
+import time
+import sqlite3
+from collections import deque
+
+DEBUG = False  # Set to True for verbose debug output
+
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_BLOCK = "block"
+
+# paho.mqtt.client result codes (kept local so this module does not import paho)
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+
+class DurableOutbox:
+    """SQLite store for MQTT messages that could not be published yet.
+
+    Rows are kept in timestamp order until the broker acknowledges them. The store is bounded
+    by `max_rows` (oldest rows are discarded first) and by `retention_seconds`.
+    Rows have a state: 0 = waiting, 1 = handed to the MQTT client and awaiting PUBACK.
+    """
+    def __init__(self, path, max_rows=50000, retention_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_rows = max_rows
+        self.retention_seconds = retention_seconds
+        self.discarded = 0  # Rows removed by the size or retention limits
+        self._lock = threading.Lock()
+        self._inserts_since_prune = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # Durable across process crashes, cheap on SD cards
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL NOT NULL, topic TEXT NOT NULL,"
+            " payload BLOB NOT NULL, qos INTEGER NOT NULL, state INTEGER NOT NULL DEFAULT 0)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_state_ts ON outbox (state, ts, id)")
+        # Anything sent by a previous run but never acknowledged has to go out again
+        self._conn.execute("UPDATE outbox SET state = 0 WHERE state = 1")
+        self._pending = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self.prune()
+
+    def pending_count(self):
+        """Rows not yet acknowledged by the broker (waiting or in flight)."""
+        return self._pending
+
+    def store(self, topic, payload, qos=1, ts=None):
+        with self._lock:
+            self._conn.execute("INSERT INTO outbox (ts, topic, payload, qos) VALUES (?, ?, ?, ?)",
+                               (ts if ts is not None else time.time(), topic, payload, qos))
+            self._pending += 1
+            self._inserts_since_prune += 1
+            if self._pending > self.max_rows or self._inserts_since_prune >= 100:
+                self._prune_locked()
+
+    def prune(self):
+        with self._lock:
+            self._prune_locked()
+
+    def _prune_locked(self):
+        self._inserts_since_prune = 0
+        removed = self._conn.execute("DELETE FROM outbox WHERE ts < ?", (time.time() - self.retention_seconds,)).rowcount
+        excess = self._pending - removed - self.max_rows
+        if excess > 0:
+            removed += self._conn.execute(
+                "DELETE FROM outbox WHERE id IN (SELECT id FROM outbox ORDER BY ts, id LIMIT ?)", (excess,)).rowcount
+        if removed:
+            self.discarded += removed
+            self._pending = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def claim_batch(self, limit):
+        """Returns up to `limit` waiting rows, oldest first, and marks them in flight."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, ts, topic, payload, qos FROM outbox WHERE state = 0 ORDER BY ts, id LIMIT ?", (limit,)).fetchall()
+            if rows:
+                self._conn.executemany("UPDATE outbox SET state = 1 WHERE id = ?", [(row[0],) for row in rows])
+            return rows
+
+    def release(self, row_ids):
+        """Puts in-flight rows back into the waiting state (e.g. when no PUBACK arrived)."""
+        if not row_ids:
+            return
+        with self._lock:
+            self._conn.executemany("UPDATE outbox SET state = 0 WHERE id = ?", [(row_id,) for row_id in row_ids])
+
+    def delete(self, row_ids):
+        """Removes acknowledged rows."""
+        if not row_ids:
+            return
+        with self._lock:
+            deleted = 0
+            for row_id in row_ids:
+                deleted += self._conn.execute("DELETE FROM outbox WHERE id = ?", (row_id,)).rowcount
+            self._pending -= deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+class MqttPublishPipeline:
+    """Bounded outbox that publishes MQTT messages from a worker thread.
+
+    Callers `submit()` payloads and return immediately. The worker keeps up to
+    `max_in_flight` QoS1 messages outstanding at once (pipelined rather than waiting for
+    each PUBACK) and the client's on_publish callback must forward acks to `on_publish(mid)`.
+    When `max_queued` messages are waiting, `overflow` selects between dropping the oldest
+    queued message and blocking the caller for up to `block_timeout` seconds.
+
+    With a DurableOutbox as `store`, messages submitted while disconnected (or while older
+    stored messages are still waiting) are written to disk instead, as are messages that would
+    be dropped on overflow or are still queued at stop(). Once connected, the worker drains the
+    store oldest first in batches of `drain_batch_size` at most every `drain_interval` seconds,
+    and deletes each row when its PUBACK arrives (at-least-once delivery).
+    """
+    def __init__(self, client, max_queued=100, max_in_flight=20, overflow=OVERFLOW_DROP_OLDEST,
+                 block_timeout=5.0, ack_timeout=60.0, is_connected=None, on_event=None,
+                 store=None, drain_batch_size=20, drain_interval=1.0):
+        if overflow not in (OVERFLOW_DROP_OLDEST, OVERFLOW_BLOCK):
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self.client = client
+        self.max_queued = max_queued
+        self.max_in_flight = max_in_flight
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.ack_timeout = ack_timeout
+        self.is_connected = is_connected if is_connected is not None else client.is_connected
+        self.on_event = on_event   # Optional callback(event_type, details) for logging
+        self.store = store
+        self.drain_batch_size = drain_batch_size
+        self.drain_interval = drain_interval
+        self._queue = deque()      # (topic, payload, qos, submitted_at)
+        self._in_flight = {}       # mid -> (sent_at, topic, store row id or None)
+        self._early_acks = set()   # mids acked before publish() returned
+        self._acked_rows = []      # Store rows acknowledged by the broker, deleted by the worker
+        self._released_rows = []   # Store rows to put back into the waiting state
+        self._next_drain_at = 0.0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self.counters = {"submitted": 0, "published": 0, "acked": 0, "dropped_overflow": 0,
+                         "publish_errors": 0, "ack_timeouts": 0, "stored": 0, "drained": 0}
+        self._ack_latency_last = None
+        self._ack_latency_max = 0.0
+        self._ack_latency_total = 0.0
+
+    def _emit(self, event_type, details):
+        if self.on_event:
+            try:
+                self.on_event(event_type, details)
+            except Exception:
+                pass
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        # paho queues QoS>0 messages internally too; keep its window in line with ours
+        try:
+            self.client.max_inflight_messages_set(self.max_in_flight)
+        except Exception:
+            pass
+        self._thread = threading.Thread(target=self._run, name="MqttPublishPipeline", daemon=True)
+        self._thread.start()
+
+    def stop(self, flush_timeout=5.0):
+        """Stops the worker, first giving queued and in-flight messages up to flush_timeout to drain."""
+        deadline = time.time() + flush_timeout
+        with self._cond:
+            while (self._queue or self._in_flight) and time.time() < deadline and self.is_connected():
+                self._cond.wait(0.1)
+            self._running = False
+            self._cond.notify_all()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(2.0)
+        if self.store is not None:
+            with self._cond:
+                leftovers = list(self._queue)
+                self._queue.clear()
+            for topic, payload, qos, submitted_at in leftovers:
+                self._store_message(topic, payload, qos, submitted_at)
+            self._flush_store_updates()
+
+    def _store_message(self, topic, payload, qos, ts):
+        try:
+            self.store.store(topic, payload, qos, ts)
+        except sqlite3.Error as e:
+            self._emit("mqtt_outbox_store_error", {"topic": topic, "error": str(e)})
+            return False
+        with self._cond:
+            self.counters["stored"] += 1
+            self._cond.notify_all()
+        return True
+
+    def submit(self, topic, payload, qos=1):
+        """Queues a message for publishing. Returns False if it could not be queued."""
+        now = time.time()
+        if self.store is not None and (self.store.pending_count() or not self.is_connected()):
+            # Keep timestamp order: nothing overtakes messages already waiting on disk
+            return self._store_message(topic, payload, qos, now)
+        spilled = None
+        with self._cond:
+            if len(self._queue) >= self.max_queued:
+                if self.overflow == OVERFLOW_BLOCK:
+                    deadline = time.time() + self.block_timeout
+                    while len(self._queue) >= self.max_queued and self._running:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self.counters["dropped_overflow"] += 1
+                            self._emit("mqtt_outbox_drop", {"policy": self.overflow, "reason": "block timeout", "topic": topic})
+                            return False
+                        self._cond.wait(remaining)
+                elif self.store is not None:
+                    spilled = self._queue.popleft()
+                else:
+                    dropped_topic = self._queue.popleft()[0]
+                    self.counters["dropped_overflow"] += 1
+                    self._emit("mqtt_outbox_drop", {"policy": self.overflow, "reason": "queue full", "topic": dropped_topic})
+            self._queue.append((topic, payload, qos, now))
+            self.counters["submitted"] += 1
+            self._cond.notify_all()
+        if spilled is not None:
+            self._store_message(*spilled)
+        return True
+
+    def on_publish(self, mid):
+        """Forward paho's on_publish here; records the PUBACK and frees an in-flight slot."""
+        now = time.time()
+        with self._cond:
+            entry = self._in_flight.pop(mid, None)
+            if entry is not None and entry[2] is not None:
+                self._acked_rows.append(entry[2])
+            if entry is None:
+                if len(self._early_acks) > 1000:  # Acks for messages published outside the pipeline
+                    self._early_acks.clear()
+                self._early_acks.add(mid)
+                return
+            self._record_ack(now - entry[0])
+            self._cond.notify_all()
+
+    def _record_ack(self, latency):
+        self.counters["acked"] += 1
+        self._ack_latency_last = latency
+        self._ack_latency_total += latency
+        if latency > self._ack_latency_max:
+            self._ack_latency_max = latency
+
+    def stats(self):
+        """Queue depth, in-flight count, counters and PUBACK latency (seconds)."""
+        with self._cond:
+            acked = self.counters["acked"]
+            return {
+                "queue_depth": len(self._queue),
+                "max_queued": self.max_queued,
+                "in_flight": len(self._in_flight),
+                "max_in_flight": self.max_in_flight,
+                **self.counters,
+                "ack_latency_last": self._ack_latency_last,
+                "ack_latency_avg": (self._ack_latency_total / acked) if acked else None,
+                "ack_latency_max": self._ack_latency_max if acked else None,
+                "store_pending": self.store.pending_count() if self.store is not None else None,
+                "store_discarded": self.store.discarded if self.store is not None else None,
+            }
+
+    def _expire_in_flight(self, now):
+        expired = [mid for mid, (sent_at, _topic, _row_id) in self._in_flight.items() if now - sent_at > self.ack_timeout]
+        for mid in expired:
+            # paho keeps retrying the message itself; we just stop counting it against the window.
+            # A stored row goes back to waiting so it is sent again if paho never delivers it.
+            _sent_at, topic, row_id = self._in_flight.pop(mid)
+            if row_id is not None:
+                self._released_rows.append(row_id)
+            self.counters["ack_timeouts"] += 1
+            self._emit("mqtt_outbox_ack_timeout", {"message_id": mid, "topic": topic})
+
+    def _flush_store_updates(self):
+        with self._cond:
+            acked, self._acked_rows = self._acked_rows, []
+            released, self._released_rows = self._released_rows, []
+        if not acked and not released:
+            return
+        try:
+            self.store.delete(acked)
+            self.store.release(released)
+        except sqlite3.Error as e:
+            self._emit("mqtt_outbox_store_error", {"error": str(e)})
+
+    def _next_batch(self, now):
+        """Picks the next messages to publish (called with the lock held).
+
+        Returns a list of (topic, payload, qos, submitted_at, row_id); empty if there is nothing
+        to do right now. Stored rows are only claimed when the memory queue is empty.
+        """
+        free_slots = self.max_in_flight - len(self._in_flight)
+        if free_slots <= 0 or not self.is_connected():
+            return []
+        if self._queue:
+            topic, payload, qos, submitted_at = self._queue.popleft()
+            self._cond.notify_all()  # Wake submitters blocked on a full queue
+            return [(topic, payload, qos, submitted_at, None)]
+        if self.store is None or not self.store.pending_count() or now < self._next_drain_at:
+            return []
+        self._next_drain_at = now + self.drain_interval
+        rows = self.store.claim_batch(min(free_slots, self.drain_batch_size))
+        return [(topic, payload, qos, ts, row_id) for row_id, ts, topic, payload, qos in rows]
+
+    def _run(self):
+        while True:
+            if self.store is not None:
+                self._flush_store_updates()
+            with self._cond:
+                if not self._running:
+                    return
+                now = time.time()
+                self._expire_in_flight(now)
+                batch = self._next_batch(now)
+                if not batch:
+                    timeout = 1.0
+                    if self.store is not None and self.store.pending_count() and self._next_drain_at > now:
+                        timeout = min(timeout, self._next_drain_at - now)
+                    self._cond.wait(timeout)
+                    continue
+            for item in batch:
+                self._publish(item)
+
+    def _publish(self, item):
+        topic, payload, qos, submitted_at, row_id = item
+        # publish() runs without our lock: paho calls on_publish while holding its own mutexes
+        try:
+            info = self.client.publish(topic, payload, qos=qos)
+        except Exception as e:
+            with self._cond:
+                self.counters["publish_errors"] += 1
+                if row_id is not None:
+                    self._released_rows.append(row_id)
+            self._emit("mqtt_publish_exception", {"topic": topic, "error": str(e)})
+            return
+        with self._cond:
+            if info.rc == MQTT_ERR_NO_CONN and qos > 0:
+                # paho already holds the QoS>0 message and resends it after reconnecting
+                self._emit("mqtt_publish_deferred", {"topic": topic, "message_id": info.mid})
+            elif info.rc != MQTT_ERR_SUCCESS:
+                # e.g. MQTT_ERR_QUEUE_SIZE: put it back and retry shortly
+                if row_id is None:
+                    self._queue.appendleft((topic, payload, qos, submitted_at))
+                else:
+                    self._released_rows.append(row_id)
+                self.counters["publish_errors"] += 1
+                self._emit("mqtt_publish_failed", {"topic": topic, "result_code": info.rc})
+                self._cond.wait(1.0)
+                return
+            self.counters["published"] += 1
+            if row_id is not None:
+                self.counters["drained"] += 1
+            if DEBUG: print(f"MQTT Outbox: Published mid {info.mid} to {topic} (queue={len(self._queue)}, in_flight={len(self._in_flight) + 1})")
+            if qos == 0:
+                if row_id is not None:
+                    self._acked_rows.append(row_id)
+                return
+            if info.mid in self._early_acks:
+                self._early_acks.discard(info.mid)
+                self._record_ack(0.0)
+                if row_id is not None:
+                    self._acked_rows.append(row_id)
+            else:
+                self._in_flight[info.mid] = (time.time(), topic, row_id)
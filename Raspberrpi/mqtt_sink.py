@@ -0,0 +1,182 @@
+import os
+import gzip
+import json
+import time
+import sqlite3
+import datetime
+from batch_worker import BatchWorker
+from wio_frame_parser import FIELDS
+
+SINK_KINDS = ("sqlite", "jsonl")
+READING_COLUMNS = tuple(key.lower() for key in FIELDS)  # Sensor keys as published by wio_to_meshtastic.py
+
+def _epoch(rpi_timestamp):
+    try:
+        return datetime.datetime.fromisoformat(rpi_timestamp).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def expand_payload(message):
+    """Flat reading dicts in one decoded MQTT message.
+
+    Handles a single reading or window summary (one dict), and the full-resolution batches
+    from build_batch_payload(): "array" ({"readings": [...]}) and "columnar" (one list per
+    field plus "rpi_ts" epoch seconds). Every reading gets "rpi_ts" as epoch seconds.
+    """
+    if not isinstance(message, dict):
+        raise ValueError(f"Expected a JSON object, got {type(message).__name__}")
+    batch_format = message.get("format")
+    if batch_format == "array":
+        readings = message.get("readings") or []
+        for reading in readings:
+            reading["rpi_ts"] = _epoch(reading.get("rpi_timestamp"))
+        return readings
+    if batch_format == "columnar":
+        timestamps = message.get("rpi_ts") or []
+        columns = [(key, message[key]) for key in READING_COLUMNS if key in message]
+        readings = []
+        for i, ts in enumerate(timestamps):
+            reading = {"rpi_ts": ts}
+            for key, column in columns:
+                if i < len(column) and column[i] is not None:
+                    reading[key] = column[i]
+            readings.append(reading)
+        return readings
+    message["rpi_ts"] = _epoch(message.get("rpi_timestamp"))
+    return [message]
+
+class SqliteReadingStore:
+    """Readings in one SQLite table: receive time, topic, epoch rpi_ts, one REAL column per sensor,
+    and any other keys (window stats, unknown fields) as JSON in `extra`. One transaction per batch."""
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        columns = ", ".join(f"{key} REAL" for key in READING_COLUMNS)
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS readings (received_ts REAL NOT NULL, topic TEXT, rpi_ts REAL, {columns}, extra TEXT)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS readings_rpi_ts ON readings (rpi_ts)")
+        self.conn.commit()
+        placeholders = ", ".join("?" * (len(READING_COLUMNS) + 4))
+        self._insert = f"INSERT INTO readings (received_ts, topic, rpi_ts, {', '.join(READING_COLUMNS)}, extra) VALUES ({placeholders})"
+        self._known = frozenset(READING_COLUMNS) | {"rpi_ts", "rpi_timestamp"}
+
+    def write(self, rows):
+        """rows: [(received_ts, topic, reading dict), ...]"""
+        params = []
+        for received_ts, topic, reading in rows:
+            extra = {k: v for k, v in reading.items() if k not in self._known}
+            params.append((received_ts, topic, reading.get("rpi_ts"), *(reading.get(key) for key in READING_COLUMNS),
+                           json.dumps(extra) if extra else None))
+        with self.conn:
+            self.conn.executemany(self._insert, params)
+
+    def close(self):
+        self.conn.close()
+
+class RotatingJsonlStore:
+    """Readings as gzip-compressed JSON lines in `directory`, one file per `max_bytes` of
+    uncompressed output (or per `max_age_s`), named mqtt_readings_<start time>.jsonl.gz."""
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_age_s=24 * 3600, compresslevel=6):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.compresslevel = compresslevel
+        os.makedirs(directory, exist_ok=True)
+        self.file = None
+        self.path = None
+        self._bytes = 0
+        self._opened = 0.0
+
+    def _rotate(self):
+        if self.file:
+            self.file.close()
+        self._opened = time.time()
+        stamp = datetime.datetime.fromtimestamp(self._opened).strftime('%Y-%m-%d_%H-%M-%S')
+        self.path = os.path.join(self.directory, f"mqtt_readings_{stamp}.jsonl.gz")
+        self.file = gzip.open(self.path, "at", encoding="utf-8", compresslevel=self.compresslevel)
+        self._bytes = 0
+
+    def write(self, rows):
+        if self.file is None or self._bytes >= self.max_bytes or time.time() - self._opened >= self.max_age_s:
+            self._rotate()
+        text = "".join(json.dumps({"received_ts": round(received_ts, 3), "topic": topic, **reading}) + "\n"
+                       for received_ts, topic, reading in rows)
+        self.file.write(text)
+        self.file.flush()  # Ends the gzip member's pending block so a crash loses at most this batch
+        self._bytes += len(text)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def open_store(kind, path):
+    if kind == "sqlite":
+        return SqliteReadingStore(path)
+    if kind == "jsonl":
+        return RotatingJsonlStore(path)
+    raise ValueError(f"Unknown sink kind: {kind}")
+
+class MessageSink(BatchWorker):
+    """Stores MQTT messages from a worker thread so paho's network thread only enqueues.
+
+    submit() appends the raw payload bytes to a bounded queue (newest dropped and counted when
+    full). The worker (BatchWorker) takes everything queued when `batch_size` messages are
+    waiting or every `flush_interval` seconds, decodes each payload once, expands batch
+    payloads into readings and writes the whole batch to `store` in one call. Counters:
+    received, stored (messages), readings, dropped, decode_errors, write_errors, batches.
+    `on_readings(rows)`, if given, is called on the worker with each batch's
+    [(received_ts, topic, reading), ...] so consumers such as a live display reuse the decoded
+    readings. Decode and write errors go to `on_error(message)` (printed when not given).
+    """
+    def __init__(self, store, max_queued=50000, batch_size=500, flush_interval=1.0, on_readings=None,
+                 on_error=None, name="MqttSinkWriter"):
+        self.store = store
+        self.on_readings = on_readings
+        super().__init__(max_queued, batch_size, flush_interval, on_error=on_error, name=name,
+                         counters=("stored", "readings", "decode_errors", "write_errors"))
+
+    def submit(self, topic, payload):
+        """Queues one raw message. Returns False if it was dropped."""
+        return self._enqueue((time.time(), topic, payload))
+
+    def stats(self):
+        stats = super().stats()
+        stats["received"] = stats["queued"] + stats["dropped"]
+        return stats
+
+    def close(self, timeout=10.0):
+        """Stores what is queued, then closes the store."""
+        super().close(timeout)
+
+    def _close(self):
+        self.store.close()
+
+    def _handle_batch(self, batch, final):
+        if not batch:
+            return
+        rows = []
+        decoded = 0
+        for received_ts, topic, payload in batch:
+            try:
+                for reading in expand_payload(json.loads(payload)):
+                    rows.append((received_ts, topic, reading))
+                decoded += 1
+            except (ValueError, TypeError, AttributeError) as e:  # json.JSONDecodeError is a ValueError
+                self.counters["decode_errors"] += 1
+                self._error(f"[MQTT SINK ERROR] Could not decode message on {topic}: {e}")
+        if self.on_readings and rows:
+            try:
+                self.on_readings(rows)
+            except Exception as e:
+                self._error(f"[MQTT SINK ERROR] on_readings callback failed: {e}")
+        try:
+            if rows:
+                self.store.write(rows)
+            self.counters["stored"] += decoded
+            self.counters["readings"] += len(rows)
+            self.counters["batches"] += 1
+        except (OSError, sqlite3.Error) as e:
+            self.counters["write_errors"] += 1
+            self._error(f"[MQTT SINK ERROR] Failed to store {len(rows)} readings: {e}")
@@ -2,110 +2,207 @@ print("DEBUG: Script started.")
 
 import paho.mqtt.client as paho
 from paho import mqtt
+from paho.mqtt.properties import Properties
+from paho.mqtt.packettypes import PacketTypes
 import os
+import socket
+import argparse
 from dotenv import load_dotenv
+import sys
 import json
 import time
+import threading
 from collections import deque
 from datetime import datetime
+from mqtt_sink import MessageSink, open_store, expand_payload, SINK_KINDS, READING_COLUMNS
+from wio_aggregates import ChannelStats
+from wio_frame_parser import FIELD_SPECS
 
-# Rich imports will be removed or commented out
-# try:
-#     from rich.live import Live
-#     from rich.table import Table
-#     from rich.panel import Panel
-#     from rich.layout import Layout
-#     from rich.text import Text
-#     from rich.console import Console, Group
-#     from rich.columns import Columns
-#     from rich import box
-#     print("DEBUG: Rich library imports successful.")
-# except ImportError as e:
-#     print(f"DEBUG: FAILED to import Rich library components: {e}")
-#     # import sys # No longer exiting if Rich fails, as it's not essential
-#     # sys.exit(1)
+try:
+    from rich.live import Live
+    from rich.table import Table
+    from rich.panel import Panel
+    from rich.layout import Layout
+    from rich.text import Text
+    from rich import box
+    RICH_AVAILABLE = True
+    print("DEBUG: Rich library imports successful.")
+except ImportError as e:
+    print(f"DEBUG: FAILED to import Rich library components: {e}. Printing messages instead of the dashboard.")
+    RICH_AVAILABLE = False # Not essential; falls back to one printed line per message
 
 # --- Configuration ---
 MQTT_BROKER_TOPIC = "wio/environmental_station/data"
-# MAX_LOG_MESSAGES = 10  # No longer needed for Rich log
-# MAX_DATA_POINTS = 20   # No longer needed for Rich stats
-
-# --- Global state for dashboard (simplified or removed) ---
-# dashboard_data = { # Simplified, as Rich UI is removed
-#     "connected": False,
-#     "last_message_time": None,
-#     "message_count": 0,
-#     # "latest_readings": {}, # Will print directly
-#     # "log_messages": deque(maxlen=MAX_LOG_MESSAGES),
-#     # "recent_temps": deque(maxlen=MAX_DATA_POINTS),
-#     # "recent_humidity": deque(maxlen=MAX_DATA_POINTS),
-#     "connection_status_text": "Disconnected", # Still useful for basic logging
-#     "broker_url": ""
-# }
-connection_status = {"connected": False, "status_text": "Disconnected", "broker_url": ""}
+MQTT_SESSION_EXPIRY_S = 24 * 3600 # Broker keeps the subscription and queues QoS1 messages this long while we are offline
+MQTT_RECONNECT_MIN_DELAY_S = 1 # paho reconnect backoff: first wait, doubled after each failed attempt
+MQTT_RECONNECT_MAX_DELAY_S = 120 # paho reconnect backoff: longest wait between attempts
+SINK_DEFAULT_PATHS = {"sqlite": os.path.join("logs", "mqtt_readings.sqlite3"), "jsonl": os.path.join("logs", "mqtt_readings")}
+SINK_MAX_QUEUED = 50000 # Sink mode: messages waiting for the writer thread before new ones are dropped
+SINK_BATCH_SIZE = 500 # Sink mode: store as soon as this many messages are queued
+SINK_FLUSH_INTERVAL_S = 1.0 # Sink mode: or at least this often
+SINK_STATS_INTERVAL_S = 30 # Sink mode: print received/stored/dropped counters this often
+SINK = None # MessageSink in sink mode; None prints every message instead
+MAX_LOG_MESSAGES = 10 # Lines kept in the dashboard's log panel
+DASHBOARD_MAX_FPS = 4 # Dashboard redraws per second at most, however fast messages arrive
+DASHBOARD_IDLE_REFRESH_S = 1.0 # Redraw this often without new data (keeps "last message" ages current)
 
+# --- Global state for dashboard ---
+class DashboardState:
+    """What the dashboard shows, updated in O(1) per field by whichever thread receives data.
 
-expected_keys = ["rpi_timestamp", "temp", "humidity", "pressure", "uv", "no2", "c2h5oh", "voc", "co", "cpm", "usvh"]
+    Each field keeps a ChannelStats (running min/max/mean/stddev/last over the session), so a
+    message costs the same however long the subscriber has been running. `version` increases
+    on every change; the render loop redraws only when it moved.
+    """
+    __slots__ = ("lock", "version", "message_count", "reading_count", "last_message_time", "latest",
+                 "field_stats", "log_messages")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0
+        self.message_count = 0
+        self.reading_count = 0
+        self.last_message_time = None
+        self.latest = {} # field -> (value, rpi_timestamp of the reading it came from)
+        self.field_stats = {key: ChannelStats() for key in READING_COLUMNS}
+        self.log_messages = deque(maxlen=MAX_LOG_MESSAGES)
+
+    def add_readings(self, readings, messages=1):
+        """readings: flat reading dicts as returned by mqtt_sink.expand_payload()."""
+        with self.lock:
+            self.message_count += messages
+            self.reading_count += len(readings)
+            self.last_message_time = time.time()
+            for reading in readings:
+                stamp = reading.get("rpi_timestamp") or reading.get("rpi_ts")
+                for key in READING_COLUMNS:
+                    value = reading.get(key)
+                    if isinstance(value, (int, float)) and not isinstance(value, bool):
+                        self.field_stats[key].add(value)
+                        self.latest[key] = (value, stamp)
+            self.version += 1
+
+    def add_log(self, line):
+        with self.lock:
+            self.log_messages.append(line)
+            self.version += 1
+
+DASHBOARD = None # DashboardState while the Rich dashboard is running
+
+connection_status = {"connected": False, "status_text": "Disconnected", "broker_url": "", "connects": 0, "session_present": False, "disconnected_since": None}
 
-# Initialize console for occasional prints if needed outside Live
-# console = Console() # Rich console removed
+
+expected_keys = ["rpi_timestamp", "temp", "humidity", "pressure", "uv", "no2", "c2h5oh", "voc", "co", "cpm", "usvh"]
 
 def add_log_message(message: str, level: str = "INFO"):
     # print(f"DEBUG: add_log_message CALLED with: '{message}', level: '{level}'") # Original debug
     timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"LOG [{timestamp} {level}] {message}") # Simplified logging
+    if DASHBOARD:
+        DASHBOARD.add_log(f"[{timestamp} {level}] {message}") # Shown in the log panel; printing would tear the live display
+    else:
+        print(f"LOG [{timestamp} {level}] {message}") # No dashboard: plain log lines
 
-# def update_dashboard_data(payload_json: dict): # This function was for Rich UI state
-    # dashboard_data["last_message_time"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    # dashboard_data["message_count"] += 1
-    
-    # current_readings = {}
-    # for key in expected_keys:
-    #     current_readings[key] = payload_json.get(key, "N/A")
-    # dashboard_data["latest_readings"] = current_readings
-
-    # if "temp" in payload_json and isinstance(payload_json["temp"], (int, float)):
-    #     dashboard_data["recent_temps"].append(payload_json["temp"])
-    # if "humidity" in payload_json and isinstance(payload_json["humidity"], (int, float)):
-    #     dashboard_data["recent_humidity"].append(payload_json["humidity"])
-    
-    # add_log_message(f"Data received (for Rich). Temp: {current_readings.get('temp', 'N/A')}", "DATA")
-
-# def calculate_stats(data_deque: deque): # This was for Rich UI
-#     if not data_deque:
-#         return {"min": "N/A", "max": "N/A", "avg": "N/A"}
-#     valid_data = [x for x in data_deque if isinstance(x, (int, float))]
-#     if not valid_data:
-#         return {"min": "N/A", "max": "N/A", "avg": "N/A"}
-#     return {
-#         "min": f"{min(valid_data):.2f}",
-#         "max": f"{max(valid_data):.2f}",
-#         "avg": f"{sum(valid_data) / len(valid_data):.2f}"
-#     }
-
-# def generate_dashboard_layout() -> Panel: # This was for Rich UI
-#     print("DEBUG: generate_dashboard_layout() CALLED (but Rich is disabled)")
-#     return None # Placeholder
+def report_sink_error(message):
+    """MessageSink on_error callback: decode and store errors go to the log panel, not stdout."""
+    add_log_message(message, "ERROR")
+
+def update_dashboard_data(rows):
+    """MessageSink on_readings callback: [(received_ts, topic, reading), ...] from one stored batch."""
+    if DASHBOARD:
+        DASHBOARD.add_readings([reading for _received_ts, _topic, reading in rows], messages=0)
+
+def calculate_stats(stats: ChannelStats, decimals=2):
+    if not stats.count:
+        return {"min": "N/A", "max": "N/A", "avg": "N/A", "std": "N/A"}
+    return {
+        "min": f"{stats.min:.{decimals}f}",
+        "max": f"{stats.max:.{decimals}f}",
+        "avg": f"{stats.mean:.{decimals}f}",
+        "std": f"{stats.stddev:.{decimals}f}",
+    }
+
+def generate_dashboard_layout() -> Layout:
+    """One frame of the dashboard from a consistent snapshot of DASHBOARD (taken under its lock)."""
+    with DASHBOARD.lock:
+        message_count, reading_count = DASHBOARD.message_count, DASHBOARD.reading_count
+        last_message_time = DASHBOARD.last_message_time
+        latest = dict(DASHBOARD.latest)
+        stats = {key: (s.count, calculate_stats(s, FIELD_SPECS[key.upper()][2])) for key, s in DASHBOARD.field_stats.items()}
+        log_lines = list(DASHBOARD.log_messages)
+
+    status_style = "green" if connection_status["connected"] else "red"
+    header = Text.assemble(
+        ("MQTT ", "bold"), (connection_status["status_text"], status_style),
+        f"  |  {connection_status['broker_url']}  |  topic {MQTT_BROKER_TOPIC}\n",
+        f"Messages: {message_count}  Readings: {reading_count}  Last message: ",
+        f"{time.time() - last_message_time:.0f}s ago" if last_message_time else "never",
+    )
+    if SINK:
+        sink_stats = SINK.stats()
+        header.append(f"\nSink: received {sink_stats['received']}  stored {sink_stats['stored']}  "
+                      f"dropped {sink_stats['dropped']}  decode errors {sink_stats['decode_errors']}  queue {sink_stats['queue_depth']}")
+
+    table = Table(box=box.SIMPLE_HEAVY, expand=True)
+    for column, justify in (("Sensor", "left"), ("Latest", "right"), ("Min", "right"), ("Max", "right"),
+                            ("Avg", "right"), ("Std", "right"), ("N", "right")):
+        table.add_column(column, justify=justify)
+    for key in READING_COLUMNS:
+        label, unit, decimals = FIELD_SPECS[key.upper()]
+        count, field_stats = stats[key]
+        value = latest.get(key)
+        latest_text = f"{value[0]:.{decimals}f} {unit}".strip() if value else "N/A"
+        table.add_row(label, latest_text, field_stats["min"], field_stats["max"], field_stats["avg"], field_stats["std"], str(count))
+
+    layout = Layout()
+    layout.split_column(
+        Layout(Panel(header, title="Wio Environmental Station"), name="header", size=5 if SINK else 4),
+        Layout(Panel(table, title="Readings (session stats)"), name="readings"),
+        Layout(Panel(Text("\n".join(log_lines)), title="Log"), name="log", size=MAX_LOG_MESSAGES + 2),
+    )
+    return layout
 
 # --- MQTT Callbacks ---
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
+        session_present = bool(flags.get("session present")) if isinstance(flags, dict) else bool(getattr(flags, "session_present", False))
+        outage = time.time() - connection_status["disconnected_since"] if connection_status["disconnected_since"] else None
         connection_status["connected"] = True
         connection_status["status_text"] = "Connected"
-        add_log_message(f"Connected to MQTT Broker (rc: {rc})", "INFO")
-        client.subscribe(MQTT_BROKER_TOPIC, qos=1)
-        add_log_message(f"Subscribed to {MQTT_BROKER_TOPIC}", "INFO")
+        connection_status["connects"] += 1
+        connection_status["session_present"] = session_present
+        connection_status["disconnected_since"] = None
+        add_log_message(f"Connected to MQTT Broker (rc: {rc}, session present: {session_present}"
+                        + (f", offline {outage:.0f}s)" if outage is not None else ")"), "INFO")
+        if session_present:
+            # The broker kept our subscription and has been queueing QoS1 messages for us
+            add_log_message(f"Resumed session; subscription to {MQTT_BROKER_TOPIC} still active", "INFO")
+        else:
+            client.subscribe(MQTT_BROKER_TOPIC, qos=1)
+            add_log_message(f"Subscribed to {MQTT_BROKER_TOPIC}", "INFO")
     else:
         connection_status["connected"] = False
         connection_status["status_text"] = f"Connection Failed (rc: {rc})"
         add_log_message(f"Failed to connect to MQTT Broker, code {rc}", "ERROR")
 
 def on_message(client, userdata, msg):
+    if SINK:
+        SINK.submit(msg.topic, msg.payload) # Decoding, storage and dashboard updates happen on the sink's writer thread
+        if DASHBOARD:
+            with DASHBOARD.lock:
+                DASHBOARD.message_count += 1
+        return
+    if DASHBOARD:
+        try:
+            DASHBOARD.add_readings(expand_payload(json.loads(msg.payload)))
+        except (ValueError, TypeError, AttributeError) as e:
+            add_log_message(f"Could not decode message: {e}", "ERROR")
+        return
     try:
-        payload_json = json.loads(msg.payload.decode())
+        payload_text = msg.payload.decode()
+        json.loads(payload_text) # Validate only; the text is printed as received
         # update_dashboard_data(payload_json) # No longer updating Rich dashboard state
         timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        print(f"DATA [{timestamp}] Received: {json.dumps(payload_json)}") # Print raw data
+        print(f"DATA [{timestamp}] Received: {payload_text}") # Print raw data
         # Optional: Print specific fields
         # temp = payload_json.get("temp", "N/A")
         # humidity = payload_json.get("humidity", "N/A")
@@ -118,12 +215,19 @@ def on_message(client, userdata, msg):
 
 def on_disconnect(client, userdata, rc, properties=None):
     connection_status["connected"] = False
-    connection_status["status_text"] = f"Disconnected (rc: {rc})"
-    add_log_message(f"Disconnected from MQTT Broker (rc: {rc})", "WARN")
+    connection_status["status_text"] = f"Disconnected (rc: {rc}), reconnecting"
+    if connection_status["disconnected_since"] is None:
+        connection_status["disconnected_since"] = time.time()
+    add_log_message(f"Disconnected from MQTT Broker (rc: {rc}). Reconnecting with backoff (up to {MQTT_RECONNECT_MAX_DELAY_S}s between attempts).", "WARN")
 
 
 def main_mqtt_client_loop():
-    print("DEBUG: main_mqtt_client_loop started (Simplified - No Rich UI).")
+    global SINK, DASHBOARD
+    parser = argparse.ArgumentParser(description="Subscribes to the Wio environmental station MQTT topic.")
+    parser.add_argument('--sink', choices=SINK_KINDS, help='Store readings instead of printing them: SQLite table or rotating gzip JSONL files')
+    parser.add_argument('--sink_path', help='SQLite file (sqlite) or directory (jsonl); defaults to logs/mqtt_readings.sqlite3 or logs/mqtt_readings/')
+    parser.add_argument('--no_dashboard', action='store_true', help='Print each message (or, with --sink, only counters) instead of the Rich dashboard')
+    args = parser.parse_args()
     dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
     add_log_message(f"Calculated .env path: {dotenv_path}", "DEBUG")
 
@@ -138,6 +242,9 @@ def main_mqtt_client_loop():
     cluster_url = os.getenv("HIVEMQ_CLUSTER_URL")
     username = os.getenv("HIVEMQ_USERNAME")
     password = os.getenv("HIVEMQ_PASSWORD")
+    # Stable across restarts so the broker can resume the session; set MQTT_SUBSCRIBER_CLIENT_ID (here or
+    # in .env) when running more than one subscriber on the same host (the same id would disconnect the other one)
+    client_id = os.getenv("MQTT_SUBSCRIBER_CLIENT_ID") or f"cli_dashboard_subscriber_{socket.gethostname()}"
     connection_status["broker_url"] = cluster_url or "Not Set"
 
     add_log_message(f"Credentials after attempting load: URL set: {bool(cluster_url)}, User set: {bool(username)}, Pass set: {bool(password)}", "DEBUG")
@@ -147,37 +254,63 @@ def main_mqtt_client_loop():
         print("[CRITICAL] MQTT Error: Missing credentials. Script cannot connect. Check logs.")
         return
 
-    client = paho.Client(client_id=f"cli_dashboard_subscriber_{os.getpid()}", userdata=None, protocol=paho.MQTTv5)
+    if args.sink:
+        sink_path = args.sink_path or SINK_DEFAULT_PATHS[args.sink]
+        os.makedirs(os.path.dirname(sink_path) or ".", exist_ok=True)
+        SINK = MessageSink(open_store(args.sink, sink_path), max_queued=SINK_MAX_QUEUED,
+                           batch_size=SINK_BATCH_SIZE, flush_interval=SINK_FLUSH_INTERVAL_S,
+                           on_readings=update_dashboard_data, on_error=report_sink_error)
+        add_log_message(f"Sink mode: storing readings in {sink_path} ({args.sink}); messages are not printed", "INFO")
+
+    # The dashboard needs Rich and a terminal; under nohup/redirected output keep plain log lines
+    use_dashboard = RICH_AVAILABLE and sys.stdout.isatty() and not args.no_dashboard
+    if use_dashboard:
+        DASHBOARD = DashboardState()
+
+    client = paho.Client(client_id=client_id, userdata=None, protocol=paho.MQTTv5)
     client.on_connect = on_connect
     client.on_message = on_message
     client.on_disconnect = on_disconnect
 
     client.tls_set(tls_version=mqtt.client.ssl.PROTOCOL_TLS)
     client.username_pw_set(username, password)
+    # paho's network thread retries failed connects and dropped connections itself, waiting
+    # MIN, 2*MIN, ... up to MAX seconds between attempts (reset after a successful connect)
+    client.reconnect_delay_set(min_delay=MQTT_RECONNECT_MIN_DELAY_S, max_delay=MQTT_RECONNECT_MAX_DELAY_S)
+
+    # Persistent session: never start clean, and ask the broker to keep the session while we are away
+    connect_properties = Properties(PacketTypes.CONNECT)
+    connect_properties.SessionExpiryInterval = MQTT_SESSION_EXPIRY_S
 
-    add_log_message(f"Attempting to connect to broker: {cluster_url}:8883...", "INFO")
+    live = None # rich.live.Live while the dashboard is on screen
+    add_log_message(f"Attempting to connect to broker: {cluster_url}:8883 as {client_id} (session expiry {MQTT_SESSION_EXPIRY_S}s)...", "INFO")
     try:
-        client.connect(cluster_url, 8883, keepalive=60)
+        # connect_async: the first connection is retried with the same backoff instead of raising
+        client.connect_async(cluster_url, 8883, keepalive=60, clean_start=False, properties=connect_properties)
+        connection_status["disconnected_since"] = time.time()
         client.loop_start()
         
         add_log_message("MQTT client loop started. Waiting for messages...", "INFO")
+        if DASHBOARD:
+            # Messages only update DASHBOARD; this loop redraws at most DASHBOARD_MAX_FPS times a second
+            live = Live(generate_dashboard_layout(), auto_refresh=False, screen=False, redirect_stderr=False)
+            live.start()
+        frame_interval = 1.0 / DASHBOARD_MAX_FPS if live else 1.0
+        rendered_version = -1
+        last_render_time = 0.0
+        last_stats_time = time.time()
         while True:
-            # You can add checks here, e.g., to reconnect if connection_status["connected"] is false
-            # For now, just keep the main thread alive.
-            if not connection_status["connected"] and connection_status["status_text"] != "Connecting...": # Basic reconnect logic placeholder
-                add_log_message("Attempting to reconnect...", "WARN")
-                connection_status["status_text"] = "Connecting..."
-                try:
-                    # client.reconnect() # paho has automatic reconnect, but can be managed explicitly
-                    # For simplicity, we rely on paho's auto-reconnect or restart script if persistent issues.
-                    # If manual reconnect is needed, one might call client.connect() again,
-                    # but ensure loop is stopped/started correctly.
-                    # This simple loop doesn't implement full robust reconnection.
-                    pass # Rely on paho's built-in mechanisms for now or manual restart.
-                except Exception as recon_e:
-                    add_log_message(f"Error during manual reconnect attempt: {recon_e}", "ERROR")
-
-            time.sleep(1)
+            # Reconnects happen on paho's network thread; the main thread only renders and reports.
+            time.sleep(frame_interval)
+            if live and (DASHBOARD.version != rendered_version or time.time() - last_render_time >= DASHBOARD_IDLE_REFRESH_S):
+                rendered_version = DASHBOARD.version
+                last_render_time = time.time()
+                live.update(generate_dashboard_layout(), refresh=True)
+            if SINK and time.time() - last_stats_time >= SINK_STATS_INTERVAL_S:
+                last_stats_time = time.time()
+                stats = SINK.stats()
+                add_log_message(f"Sink: received={stats['received']} stored={stats['stored']} readings={stats['readings']} "
+                                f"dropped={stats['dropped']} decode_errors={stats['decode_errors']} queue={stats['queue_depth']}", "INFO")
 
     except KeyboardInterrupt:
         add_log_message("Script stopped by user (KeyboardInterrupt).", "INFO")
@@ -186,16 +319,21 @@ def main_mqtt_client_loop():
         add_log_message(f"MQTT connection/loop error: {e}", "CRITICAL")
         print(f"[CRITICAL] MQTT error: {e}")
     finally:
+        if live:
+            live.stop()
+            DASHBOARD = None # Back to printed log lines
         add_log_message("Disconnecting MQTT client...", "INFO")
-        if client.is_connected(): # Check if connected before stopping loop/disconnecting
-             client.loop_stop()
-             client.disconnect()
+        # disconnect() first so the network thread stops retrying, then wait for it to exit.
+        # The broker keeps the session (and queues messages) for MQTT_SESSION_EXPIRY_S.
+        client.disconnect()
+        client.loop_stop()
+        if SINK:
+            SINK.close()
+            add_log_message(f"Sink closed: {SINK.stats()}", "INFO")
         print("MQTT client disconnected.")
 
 
 if __name__ == "__main__":
-    print("DEBUG: __main__ block started (Simplified - No Rich UI).")
-    # dashboard_data["latest_readings"] = {key: "N/A" for key in expected_keys} # No longer needed for Rich
     add_log_message("Script initializing...", "INFO")
     
     try:
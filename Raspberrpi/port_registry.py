@@ -0,0 +1,116 @@
+import os
+import threading
+import serial.tools.list_ports
+
+SYS_TTY_DIR = "/sys/class/tty"
+
+class PortRegistry:
+    """Cached serial port list that a background thread keeps up to date.
+
+    comports() reads several sysfs attributes per port, so it is only called at start and
+    when the set of entries in /sys/class/tty changes (a single cheap directory listing per
+    poll). Where /sys/class/tty does not exist the watcher re-enumerates every
+    `fallback_interval` seconds instead. `generation` increases on every change, so callers
+    can memoize anything derived from the port list. remember() records which USB device
+    (VID/PID/serial number) a role such as "Wio Terminal" was found on, and lookup() returns
+    that device's current path, even if it re-enumerated under a new name.
+    """
+    def __init__(self, poll_interval=1.0, fallback_interval=5.0, on_change=None):
+        self.poll_interval = poll_interval
+        self.fallback_interval = fallback_interval
+        self.on_change = on_change  # Called as on_change(added_devices, removed_devices) from the watcher thread
+        self.generation = 0
+        self._lock = threading.Condition()
+        self._ports = []
+        self._identities = {}  # role -> (vid, pid, serial_number, device)
+        self._signature = None
+        self._enumerated = False
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.refresh()
+
+    def _tty_signature(self):
+        try:
+            return frozenset(os.listdir(SYS_TTY_DIR))
+        except OSError:
+            return None
+
+    def refresh(self):
+        """Re-enumerates now. Returns True if the set of devices changed."""
+        signature = self._tty_signature()
+        ports = list(serial.tools.list_ports.comports())
+        with self._lock:
+            old = {p.device for p in self._ports}
+            new = {p.device for p in ports}
+            self._signature = signature
+            self._ports = ports
+            changed = old != new
+            if changed:
+                self.generation += 1
+                self._lock.notify_all()
+            notify = self._enumerated  # Not for the initial enumeration
+            self._enumerated = True
+        if changed and notify and self.on_change:
+            try:
+                self.on_change(sorted(new - old), sorted(old - new))
+            except Exception as e:
+                print(f"[PORT REGISTRY ERROR] on_change callback failed: {e}")
+        return changed
+
+    def ports(self):
+        with self._lock:
+            return list(self._ports)
+
+    def wait_for_change(self, generation, timeout):
+        """Blocks until `generation` is outdated or timeout passes. Returns the current generation."""
+        with self._lock:
+            if self.generation == generation:
+                self._lock.wait(timeout)
+            return self.generation
+
+    def remember(self, role, device):
+        """Records the USB identity behind `device` as the port for `role`."""
+        for port_info in self.ports():
+            if port_info.device == device:
+                self._identities[role] = (port_info.vid, port_info.pid, port_info.serial_number, device)
+                return
+
+    def lookup(self, role):
+        """Current device path of the USB device last remembered for `role`, or None if it is not plugged in."""
+        identity = self._identities.get(role)
+        if identity is None:
+            return None
+        vid, pid, serial_number, device = identity
+        for port_info in self.ports():
+            if port_info.vid == vid and port_info.pid == pid and \
+               (port_info.serial_number == serial_number if serial_number else port_info.device == device):
+                return port_info.device
+        return None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="PortRegistryWatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=2.0):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        since_refresh = 0.0
+        while not self._stop_event.wait(self.poll_interval):
+            signature = self._tty_signature()
+            since_refresh += self.poll_interval
+            try:
+                if signature is not None:
+                    if signature != self._signature:
+                        self.refresh()
+                elif since_refresh >= self.fallback_interval:
+                    since_refresh = 0.0
+                    self.refresh()
+            except Exception as e:  # Keep watching; a transient enumeration error should not end the thread
+                print(f"[PORT REGISTRY ERROR] Could not enumerate serial ports: {e}")
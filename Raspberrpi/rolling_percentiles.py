@@ -0,0 +1,136 @@
+import math
+from array import array
+
+# name -> window length in seconds
+DEFAULT_WINDOWS = (("1m", 60), ("5m", 300), ("1h", 3600), ("24h", 86400))
+SLICES_PER_WINDOW = 12  # Each window is tracked as this many time slices (its resolution)
+_SLICE_PLANS = {}  # windows -> ((window length, slice length), ...), shared by every instance
+
+def exact_summary(values, quantiles=(0.5, 0.95)):
+    """{"n", "p50", "p95", "max"} of raw values, same nearest-rank rule as RollingPercentiles. None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    total = len(ordered)
+    stats = {"n": total}
+    for q in quantiles:
+        stats[f"p{round(q * 100)}"] = round(ordered[max(0, math.ceil(q * total) - 1)], 3)
+    stats["max"] = ordered[-1]
+    return stats
+
+class RollingPercentiles:
+    """p50/p95/max of one or more metrics over several trailing time windows, in bounded memory.
+
+    Values are counted in fixed-width bins (`bin_width`, e.g. 0.5 percentage points for
+    channel utilization), so quantiles are accurate to half a bin; the max is exact. Each
+    window of each of the `series` metrics is a ring of at most SLICES_PER_WINDOW + 1 time
+    slices, and only slices that received values exist, so a window covers its length plus
+    up to one slice (1/12 of it) of older data. Memory is bounded by slices x distinct bins
+    however often the node reports.
+
+    Everything lives in one array('d'), created on the first value: a header of [end offset,
+    offset of the last slice] per ring (series-major, then window), followed by the rings
+    back to back, each oldest slice first and laid out as [slice index, max, number of
+    bins, (bin, count) x number of bins]. Only a ring's last slice ever changes, so new bins
+    and slices are inserted at the ring's end and expiry deletes the ring's prefix.
+    """
+    __slots__ = ("windows", "bin_width", "series", "_data")
+
+    def __init__(self, windows=DEFAULT_WINDOWS, bin_width=0.5, series=1):
+        self.windows = windows
+        self.bin_width = bin_width
+        self.series = series
+        self._data = None
+
+    def _plan(self):
+        plan = _SLICE_PLANS[self.windows] = tuple((length, length / SLICES_PER_WINDOW) for _, length in self.windows)
+        return plan
+
+    def add(self, ts, value, series=0):
+        plan = _SLICE_PLANS.get(self.windows) or self._plan()
+        n_header = 2 * self.series * len(plan)
+        d = self._data
+        if d is None:
+            d = self._data = array('d', [float(n_header)]) * n_header  # Every ring empty, ending at the header
+        bin_index = float(value // self.bin_width)
+        r = 2 * series * len(plan)
+        for length, slice_s in plan:
+            start = int(d[r - 2]) if r else n_header  # A ring starts where the previous one ends
+            end = int(d[r])
+            tail = int(d[r + 1])
+            slice_index = float(ts // slice_s)
+            if end > start and d[tail] == slice_index:
+                if value > d[tail + 1]:
+                    d[tail + 1] = value
+                for pos in range(tail + 3, end, 2):
+                    if d[pos] == bin_index:
+                        d[pos + 1] += 1
+                        break
+                else:
+                    d[end:end] = array('d', (bin_index, 1.0))
+                    d[tail + 2] += 1
+                    self._shift(r, 2, n_header)
+            else:
+                d[end:end] = array('d', (slice_index, value, 1.0, bin_index, 1.0))
+                # Drop slices that ended before the window start
+                oldest_kept = (ts - length) // slice_s
+                pos = start
+                while pos < end and d[pos] < oldest_kept:
+                    pos += 3 + 2 * int(d[pos + 2])
+                dropped = pos - start
+                if dropped:
+                    del d[start:pos]
+                d[r + 1] = end - dropped
+                self._shift(r, 5 - dropped, n_header)
+            r += 2
+
+    def _shift(self, r, delta, n_header):
+        """Ring r grew by delta values: move its end and every later ring's offsets."""
+        if delta:
+            d = self._data
+            d[r] += delta
+            for k in range(r + 2, n_header, 2):
+                d[k] += delta
+                d[k + 1] += delta
+
+    def summary(self, now, quantiles=(0.5, 0.95), series=0):
+        """{window name: {"n": count, "p50": ..., "p95": ..., "max": ...}} for windows with data."""
+        result = {}
+        if self._data is None:
+            return result
+        d = self._data[:]  # One C-level copy, consistent even if the receive thread is adding
+        n_windows = len(self.windows)
+        r = 2 * series * n_windows
+        start = int(d[r - 2]) if r else 2 * self.series * n_windows
+        for name, length in self.windows:
+            end = int(d[r])
+            r += 2
+            oldest_kept = (now - length) // (length / SLICES_PER_WINDOW)
+            merged = {}
+            vmax = -math.inf
+            pos = start
+            while pos < end:
+                n_bins = int(d[pos + 2])
+                if d[pos] >= oldest_kept:
+                    vmax = max(vmax, d[pos + 1])
+                    for bin_pos in range(pos + 3, pos + 3 + 2 * n_bins, 2):
+                        merged[d[bin_pos]] = merged.get(d[bin_pos], 0) + int(d[bin_pos + 1])
+                pos += 3 + 2 * n_bins
+            start = end
+            if not merged:
+                continue
+            total = sum(merged.values())
+            stats = {"n": total}
+            ordered = sorted(merged.items())
+            for q in quantiles:
+                rank = q * total
+                seen = 0
+                for bin_index, count in ordered:
+                    seen += count
+                    if seen >= rank:
+                        break
+                # Bin midpoint, never above the exact max
+                stats[f"p{round(q * 100)}"] = round(min((bin_index + 0.5) * self.bin_width, vmax), 3)
+            stats["max"] = vmax
+            result[name] = stats
+        return result
@@ -0,0 +1,160 @@
+import math
+from array import array
+from wio_frame_parser import FIELDS, FIELD_INDEX
+
+class HistoryRange:
+    """A time range of a SensorHistory, expressed as at most two contiguous slices of the ring.
+
+    Nothing is copied: `timestamps()` and `column()` return memoryviews over the history's
+    own arrays (two of them when the range wraps around the end of the ring). The views are
+    only valid until the history overwrites those slots, so use them right away.
+    """
+    __slots__ = ("_history", "_spans")
+
+    def __init__(self, history, spans):
+        self._history = history
+        self._spans = spans  # [(start, stop), ...] physical indexes, oldest first
+
+    def __len__(self):
+        return sum(stop - start for start, stop in self._spans)
+
+    def timestamps(self):
+        ts = memoryview(self._history.ts)
+        return [ts[start:stop] for start, stop in self._spans]
+
+    def column(self, field):
+        col = memoryview(self._history.column(field))
+        return [col[start:stop] for start, stop in self._spans]
+
+    def iter_rows(self, fields=None):
+        """Yields (ts, value, value, ...) tuples for `fields` (default: every kept one), oldest first."""
+        ts = self._history.ts
+        cols = [self._history.column(f) for f in (fields or self._history.fields)]
+        for start, stop in self._spans:
+            for i in range(start, stop):
+                yield (ts[i], *(c[i] for c in cols))
+
+class SensorHistory:
+    """Fixed-capacity columnar ring buffer of Wio readings.
+
+    One preallocated float64 timestamp array plus one float32 array per sensor field, so
+    memory is fixed at construction (about 48 bytes per slot with the default fields, ~4 MB
+    for 24 h at 1 Hz) no matter how long the bridge runs. Missing values are NaN. Timestamps
+    must not go backwards; a backwards clock step (e.g. NTP correcting the Pi clock after
+    boot) is clamped to the previous timestamp and counted in `clock_steps`.
+    """
+    def __init__(self, capacity=24 * 3600, fields=FIELDS):
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self.ts = array('d', [0.0]) * capacity
+        # Indexed like WioReading.values; fields that are not kept have no column
+        self.columns = [array('f', [math.nan]) * capacity if key in self.fields else None for key in FIELDS]
+        self._field_indexes = tuple(FIELD_INDEX[f] for f in self.fields)
+        self._head = 0   # Next slot to write
+        self._count = 0
+        self.clock_steps = 0
+
+    def __len__(self):
+        return self._count
+
+    def column(self, field):
+        """The ring array of one kept field. ValueError for fields this history does not keep."""
+        col = self.columns[FIELD_INDEX[field]] if field in FIELD_INDEX else None
+        if col is None:
+            raise ValueError(f"Field {field!r} is not kept by this history (fields: {', '.join(self.fields)})")
+        return col
+
+    def memory_bytes(self):
+        return self.ts.buffer_info()[1] * self.ts.itemsize + sum(c.buffer_info()[1] * c.itemsize for c in self.columns if c is not None)
+
+    def append(self, reading):
+        """Stores one WioReading, overwriting the oldest slot once the ring is full."""
+        i = self._head
+        ts = reading.rpi_ts
+        if self._count and ts < self.ts[i - 1]:  # i - 1 == -1 wraps to the last slot
+            self.clock_steps += 1
+            ts = self.ts[i - 1]
+        self.ts[i] = ts
+        values = reading.values
+        columns = self.columns
+        for idx in self._field_indexes:
+            columns[idx][i] = values[idx]
+        self._head = (i + 1) % self.capacity
+        if self._count < self.capacity:
+            self._count += 1
+
+    def _physical(self, logical):
+        """Maps a 0-based age-ordered index (0 = oldest) to its slot in the ring."""
+        return (self._head - self._count + logical) % self.capacity
+
+    def _bisect(self, target):
+        """First logical index whose timestamp is >= target."""
+        lo, hi = 0, self._count
+        ts = self.ts
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = ts[self._physical(mid)]
+            if value < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _spans(self, first, last):
+        """Physical (start, stop) spans covering logical indexes [first, last)."""
+        if first >= last:
+            return []
+        start = self._physical(first)
+        length = last - first
+        if start + length <= self.capacity:
+            return [(start, start + length)]
+        return [(start, self.capacity), (0, start + length - self.capacity)]
+
+    def query(self, start_ts=None, end_ts=None):
+        """Readings with start_ts <= ts < end_ts (either bound optional), found by binary search."""
+        first = self._bisect(start_ts) if start_ts is not None else 0
+        last = self._bisect(end_ts) if end_ts is not None else self._count
+        return HistoryRange(self, self._spans(first, last))
+
+    def latest(self, n):
+        """The n most recent readings."""
+        n = min(n, self._count)
+        return HistoryRange(self, self._spans(self._count - n, self._count))
+
+    def resample(self, start_ts, end_ts, step_s, fields=None, how="mean"):
+        """Buckets [start_ts, end_ts) into step_s intervals. Only the slots in range are visited.
+
+        Returns {"ts": [bucket start, ...], field: [value or None, ...], ...} where value is the
+        bucket's mean, min, max or last reading (`how`), ignoring missing values.
+        """
+        if how not in ("mean", "min", "max", "last"):
+            raise ValueError(f"Unknown resample aggregation: {how}")
+        fields = tuple(fields) if fields else self.fields
+        n_buckets = max(0, math.ceil((end_ts - start_ts) / step_s))
+        acc = {f: ([0.0] * n_buckets, [0] * n_buckets) for f in fields}
+        cols = [(f, self.column(f)) for f in fields]  # Validates every field before any work
+        ts = self.ts
+        for start, stop in self.query(start_ts, end_ts)._spans:
+            for i in range(start, stop):
+                bucket = int((ts[i] - start_ts) // step_s)
+                for f, col in cols:
+                    value = col[i]
+                    if value != value:  # NaN
+                        continue
+                    totals, counts = acc[f]
+                    if how == "mean" or not counts[bucket]:
+                        totals[bucket] = totals[bucket] + value if how == "mean" else value
+                    elif how == "min":
+                        totals[bucket] = min(totals[bucket], value)
+                    elif how == "max":
+                        totals[bucket] = max(totals[bucket], value)
+                    else:
+                        totals[bucket] = value
+                    counts[bucket] += 1
+        result = {"ts": [start_ts + b * step_s for b in range(n_buckets)]}
+        for f, (totals, counts) in acc.items():
+            if how == "mean":
+                result[f] = [totals[b] / counts[b] if counts[b] else None for b in range(n_buckets)]
+            else:
+                result[f] = [totals[b] if counts[b] else None for b in range(n_buckets)]
+        return result
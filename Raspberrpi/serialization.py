@@ -0,0 +1,156 @@
+"""JSON conversion shared by the bridge's activity log and set_client's packet log.
+
+make_serializable() writes protobuf messages as typed dicts (numbers stay numbers, enums are
+names), which costs json.dumps more than the str() text the scripts used to log. A received
+meshtastic packet carries each message twice, as a decoded dict and as the protobuf under
+'raw', so packet logs go through without_raw_protobufs() first: the dicts are logged and each
+'raw' is reduced to its message type. Converting a whole 'raw' MeshPacket would make the
+packet log slower than the old str() code (bench_serializer.py measures both).
+"""
+import datetime
+
+try:
+    from google.protobuf.message import Message as ProtobufMessage
+    from google.protobuf.descriptor import FieldDescriptor
+except ImportError:  # protobuf is pulled in by meshtastic; keep working without it
+    ProtobufMessage = None
+    FieldDescriptor = None
+
+# Types json.dumps handles natively. Checked by exact type, so subclasses go through dispatch.
+_JSON_SAFE = frozenset({str, int, float, bool, type(None)})
+
+# type -> converter, filled lazily the first time a type is seen
+_converters = {}
+
+# protobuf field descriptor -> converter for its value, filled lazily like _converters
+_field_converters = {}
+
+def make_serializable(obj):
+    """Converts an object tree into something json.dumps accepts.
+
+    bytes become hex strings, datetimes ISO strings, protobuf messages dicts of their set
+    fields (proto field names, enum value names), other objects their __dict__, and anything
+    else str(). The converter for each type (and protobuf field) is resolved once and cached,
+    and JSON-safe primitives are returned without any conversion.
+    """
+    cls = type(obj)
+    if cls in _JSON_SAFE:
+        return obj
+    converter = _converters.get(cls)
+    if converter is None:
+        converter = _resolve_converter(cls)
+        _converters[cls] = converter
+    return converter(obj)
+
+def without_raw_protobufs(packet):
+    """Shallow copy of a meshtastic packet dict with the protobuf under 'raw' (the packet's own
+    and each decoded sub-message's, e.g. 'telemetry') replaced by its message type name."""
+    view = dict(packet)
+    _replace_raw(view)
+    decoded = view.get('decoded')
+    if isinstance(decoded, dict):
+        decoded = view['decoded'] = dict(decoded)
+        for key, value in decoded.items():
+            if isinstance(value, dict) and 'raw' in value:
+                decoded[key] = value = dict(value)
+                _replace_raw(value)
+    return view
+
+def _replace_raw(message_dict):
+    raw = message_dict.get('raw')
+    if ProtobufMessage is not None and isinstance(raw, ProtobufMessage):
+        message_dict['raw'] = raw.DESCRIPTOR.full_name
+
+def _convert_dict(obj):
+    return {k: (v if type(v) in _JSON_SAFE else make_serializable(v)) for k, v in obj.items()}
+
+def _convert_sequence(obj):
+    return [(v if type(v) in _JSON_SAFE else make_serializable(v)) for v in obj]
+
+def _convert_bytes(obj):
+    return bytes(obj).hex()
+
+def _convert_isoformat(obj):
+    return obj.isoformat()
+
+def _convert_protobuf(obj):
+    try:
+        return _protobuf_to_dict(obj)
+    except Exception:
+        return str(obj)
+
+def _protobuf_to_dict(message):
+    # Walks only the fields that are set, like json_format.MessageToDict, but with one cached
+    # converter per field instead of json_format's per-value type checks (about 5x faster)
+    result = {}
+    for field, value in message.ListFields():
+        converter = _field_converters.get(field)
+        if converter is None:
+            converter = _resolve_field_converter(field)
+            _field_converters[field] = converter
+        result[field.name] = converter(value)
+    return result
+
+def _shortest_float(value):
+    # float fields are 32-bit: 4.07 reads back as 4.070000171661377, 7 digits round-trip it
+    return float(f"{value:.7g}")
+
+def _resolve_scalar_converter(field):
+    if field.type == FieldDescriptor.TYPE_MESSAGE:
+        return _protobuf_to_dict
+    if field.type == FieldDescriptor.TYPE_ENUM:
+        names = {value.number: value.name for value in field.enum_type.values}
+        return lambda number: names.get(number, number)
+    if field.type == FieldDescriptor.TYPE_BYTES:
+        return _convert_bytes
+    if field.type == FieldDescriptor.TYPE_FLOAT:
+        return _shortest_float
+    return _identity
+
+def _resolve_field_converter(field):
+    if field.message_type is not None and field.message_type.GetOptions().map_entry:
+        convert = _resolve_scalar_converter(field.message_type.fields_by_name['value'])
+        return lambda entries: {key: convert(value) for key, value in entries.items()}
+    convert = _resolve_scalar_converter(field)
+    is_repeated = getattr(field, 'is_repeated', None)
+    if is_repeated is None:  # Older protobuf releases only have the label
+        is_repeated = field.label == FieldDescriptor.LABEL_REPEATED
+    if is_repeated:
+        return lambda values: [convert(value) for value in values]
+    return convert
+
+def _convert_object(obj):
+    # Be cautious with this, as it might expose too much or fail for complex objects
+    try:
+        return make_serializable(vars(obj))
+    except RecursionError: # Objects that reference themselves
+        return f"UNSERIALIZABLE_OBJECT_RECURSION:{type(obj)}"
+    except Exception:
+        return f"UNSERIALIZABLE_OBJECT:{type(obj)}"
+
+def _convert_str(obj):
+    try:
+        return str(obj)
+    except Exception:
+        return f"UNSERIALIZABLE_TYPE:{type(obj)}"
+
+def _identity(obj):
+    return obj
+
+def _resolve_converter(cls):
+    if issubclass(cls, dict):
+        return _convert_dict
+    if issubclass(cls, (list, tuple, set, frozenset)):
+        return _convert_sequence
+    if issubclass(cls, (bytes, bytearray, memoryview)):
+        return _convert_bytes
+    if issubclass(cls, (datetime.datetime, datetime.date, datetime.time)):
+        return _convert_isoformat
+    if ProtobufMessage is not None and issubclass(cls, ProtobufMessage):
+        return _convert_protobuf
+    if issubclass(cls, (str, int, float)):
+        # IntEnum and friends: json.dumps already encodes these by value
+        return _identity
+    if '__dict__' in dir(cls): # Instances carry attributes in __dict__ (not __slots__-only)
+        return _convert_object
+    return _convert_str
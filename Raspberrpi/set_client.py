@@ -6,15 +6,48 @@ from pubsub import pub
 import os
 import traceback
 import datetime
+import sys
 import json
-from math import radians, cos, sin, asin, sqrt
+import threading
+import concurrent.futures
+from array import array
+from math import nan as NAN
+from serialization import make_serializable, without_raw_protobufs
+from log_writer import BackgroundLogWriter
+from wio_compact_codec import decode_reading, CompactDecodeError, COMPACT_PORTNUM_NAME
+from rolling_percentiles import RollingPercentiles, exact_summary
+from distance_calculator import DistanceMatrix
+from spatial_index import GridIndex
 
 # --- Global Settings ---
 DEBUG = False # Set to True for verbose debug output to console
 
+SUMMARY_FIELDS = ('batteryLevel', 'voltage', 'channelUtilization', 'airUtilTx', 'uptimeSeconds')
+SUMMARY_INT_FIELDS = {'batteryLevel', 'uptimeSeconds'}
+STATS_WINDOW_S = 300 # NodeStats.summarize() means cover this much history
+MIN_TELEMETRY_INTERVAL_S = 2 # Fastest telemetry rate the STATS_WINDOW_S means are sized for
+# Rows kept per node (150): a full window at that rate. A node reporting faster has its window
+# shortened to its newest MAX_METRIC_RECORDS rows, which bounds memory for misbehaving nodes.
+MAX_METRIC_RECORDS = STATS_WINDOW_S // MIN_TELEMETRY_INTERVAL_S
+METRIC_STRIDE = 1 + len(SUMMARY_FIELDS) # Row width in NodeStats._history: timestamp + one value per field
+HISTORY_HEADER = 2 * len(SUMMARY_FIELDS) # NodeStats._history starts with a running sum and count per field
+MESSAGE_HISTORY = 20 # Messages kept per node
+PERCENTILE_FIELDS = ('channelUtilization', 'airUtilTx') # p50/p95/max over 1m/5m/1h/24h for these (must be SUMMARY_FIELDS)
+PERCENTILE_HISTORY_WINDOWS = (("1m", 60), ("5m", 300)) # Exact, from the metric rows NodeStats keeps anyway (<= STATS_WINDOW_S)
+PERCENTILE_SKETCH_WINDOWS = (("1h", 3600), ("24h", 86400)) # Binned, in a RollingPercentiles per node
+PERCENTILE_SNAPSHOT_INTERVAL_S = 60 # How often logs/node_percentiles.json is rewritten
+
 # --- Global Containers ---
 NODE_STATS = {}          # For storing node statistics and messages
-LOG_FILE = None          # For the log file object
+NODE_DISTANCES = DistanceMatrix() # All-pairs distances between nodes with a known position
+NODE_INDEX = GridIndex() # Same positions, for radius / nearest-neighbour queries
+LOG_FILE = None          # BackgroundLogWriter for the packet log
+LOG_MAX_QUEUED = 10000   # Packets waiting to be written; newer packets are dropped (and counted) beyond this
+LOG_FLUSH_INTERVAL_S = 1.0 # Write queued packets at least this often
+LOG_FLUSH_SIZE = 200     # Or as soon as this many are queued
+PORT_CACHE_FILE = os.path.join("logs", "meshtastic_device_cache.json") # Last device that connected (VID/PID/serial number)
+PROBE_TIMEOUT_S = 20     # Give up on candidate ports that have not answered within this time (probed in parallel)
+MY_INFO_WAIT_S = 1.5     # Longest wait for myInfo after the interface connects
 USER_MAP = {             # Moved USER_MAP here for clarity with other globals
     '!938bed48': 'HOME',
     '!5919307a': 'BadBite',
@@ -62,8 +95,10 @@ def try_connect_meshtastic_device_internal(port_path):
         iface = meshtastic.serial_interface.SerialInterface(
             devPath=port_path, debugOut=False, noProto=False, connectNow=True)
         if DEBUG: print(f"[try_connect_internal] POST-INIT: SerialInterface for {port_path}. Waiting for info...")
-        time.sleep(1.5) # Reduced from 3s
-        if DEBUG: print(f"[try_connect_internal] POST-SLEEP: Done waiting for {port_path}.")
+        deadline = time.time() + MY_INFO_WAIT_S
+        while getattr(iface, 'myInfo', None) is None and time.time() < deadline:
+            time.sleep(0.1)
+        if DEBUG: print(f"[try_connect_internal] POST-WAIT: Done waiting for {port_path}.")
 
         if iface and hasattr(iface, 'myInfo') and iface.myInfo is not None:
             if DEBUG: print(f"[try_connect_internal] SUCCESS: myInfo for {port_path}.")
@@ -89,11 +124,83 @@ def try_connect_meshtastic_device_internal(port_path):
         except: pass # Ignore errors during close in exception handler
     return None
 
+def load_port_cache():
+    """The last device that connected, as saved by save_port_cache(), or None."""
+    try:
+        with open(PORT_CACHE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def save_port_cache(port_info):
+    entry = {'vid': port_info.vid, 'pid': port_info.pid, 'serial_number': port_info.serial_number,
+             'device': port_info.device, 'description': port_info.description,
+             'saved': datetime.datetime.now().isoformat(timespec='seconds')}
+    try:
+        os.makedirs(os.path.dirname(PORT_CACHE_FILE), exist_ok=True)
+        with open(PORT_CACHE_FILE, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+    except OSError as e:
+        print(f"    [WARNING] Could not save Meshtastic device cache: {e}")
+
+def port_matches_cache(port_info, cache):
+    """Same USB device as the cached one: VID/PID plus serial number, or plus device path if it has no serial number."""
+    if not cache or port_info.vid != cache.get('vid') or port_info.pid != cache.get('pid'):
+        return False
+    if cache.get('serial_number'):
+        return port_info.serial_number == cache['serial_number']
+    return port_info.device == cache.get('device')
+
+def probe_ports_concurrently(candidates, timeout=PROBE_TIMEOUT_S):
+    """Tries every candidate port at once and returns (iface, port_info) for the first that answers.
+
+    Interfaces that connect after a winner was chosen, or after the timeout, are closed.
+    Returns (None, None) if no candidate connects within `timeout` seconds.
+    """
+    if not candidates:
+        return None, None
+    winner = []  # Set once; probes finishing later close their interface
+    lock = threading.Lock()
+
+    def probe(port_info):
+        iface = try_connect_meshtastic_device_internal(port_info.device)
+        if iface is None:
+            return None
+        with lock:
+            if not winner:
+                winner.append((iface, port_info))
+                return iface
+        if DEBUG: print(f"    Closing extra Meshtastic interface on {port_info.device}.")
+        try: iface.close()
+        except Exception: pass
+        return None
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="MeshtasticProbe")
+    futures = [executor.submit(probe, port_info) for port_info in candidates]
+    deadline = time.time() + timeout
+    try:
+        pending = set(futures)
+        while pending and not winner:
+            done, pending = concurrent.futures.wait(pending, timeout=max(0, deadline - time.time()),
+                                                    return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done: # Timed out
+                break
+        with lock:
+            if winner:
+                return winner[0]
+            winner.append((None, None)) # Stragglers that connect from now on close themselves
+        print(f"    No candidate port answered within {timeout}s.")
+        return None, None
+    finally:
+        executor.shutdown(wait=False) # Do not wait for probes stuck in SerialInterface()
+
 def find_and_select_meshtastic_port(cli_port=None):
-    """Attempts to find and select the Meshtastic port through multiple stages."""
+    """Attempts to find and select the Meshtastic port through multiple stages.
+
+    A CLI port is tried first, then the cached last-known-good device, then every port that
+    matches by VID/PID or keywords, probed in parallel. The device that connects is cached.
+    """
     print("\nMeshtastic Device Detection:")
-    iface = None
-    connected_port_path = None
     tried_ports = set()
 
     # Common Meshtastic device identifiers
@@ -113,93 +220,139 @@ def find_and_select_meshtastic_port(cli_port=None):
         iface = try_connect_meshtastic_device_internal(cli_port)
         tried_ports.add(cli_port)
         if iface:
-            connected_port_path = cli_port
-            return iface, connected_port_path
+            return iface, cli_port
         print(f"    Failed on specified port {cli_port}.")
 
-    # Stage 2: Try auto-detection using VID/PID and then keywords
-    print("  Stage 2: Trying auto-detection (VID/PID & keywords)...")
-    all_ports = list(serial.tools.list_ports.comports())
-
-    # Attempt 2a: Match by VID/PID (prioritizing the specific Meshtastic device)
-    if not iface:
-        if DEBUG: print("    Stage 2a: Checking by VID/PID...")
-        # First, look for the exact target Meshtastic: /dev/ttyACM0, VID 1A86, PID 55D4
-        for port_info in all_ports:
-            if port_info.device == '/dev/ttyACM0' and port_info.vid == 0x1A86 and port_info.pid == 0x55D4 and "USB Single Serial" in port_info.description:
-                if port_info.device not in tried_ports:
-                    print(f"    [PRIORITY] Found target Meshtastic device: {port_info.device} ({port_info.description})")
-                    iface = try_connect_meshtastic_device_internal(port_info.device)
-                    tried_ports.add(port_info.device)
-                    if iface:
-                        connected_port_path = port_info.device
-                        return iface, connected_port_path
-        
-        # If not found, try other known Meshtastic VID/PIDs
-        if not iface:
-            for port_info in all_ports:
-                if port_info.device in tried_ports: continue
-                if port_info.vid and port_info.pid:
-                    for vid, pid_match, name_check in meshtastic_vid_pids:
-                        if port_info.vid == vid and (pid_match is None or port_info.pid == pid_match):
-                            if name_check is None or name_check.lower() in port_info.description.lower():
-                                print(f"    Trying VID/PID matched port: {port_info.device} ({port_info.description})")
-                                iface = try_connect_meshtastic_device_internal(port_info.device)
-                                tried_ports.add(port_info.device)
-                                if iface:
-                                    connected_port_path = port_info.device
-                                    return iface, connected_port_path
-                                break 
-        if not iface and DEBUG: print("    Stage 2a: No conclusive match by VID/PID or connection failed.")
-
-    # Attempt 2b: Match by keywords
-    if not iface:
-        if DEBUG: print("    Stage 2b: Checking by keywords...")
-        for port_info in all_ports:
-            if port_info.device in tried_ports: continue
-            desc_lower = port_info.description.lower()
-            mfc_lower = port_info.manufacturer.lower() if port_info.manufacturer else ""
-            if any(k.lower() in desc_lower for k in meshtastic_keywords) or \
-               any(k.lower() in mfc_lower for k in meshtastic_keywords):
-                print(f"    Trying keyword matched port: {port_info.device} ({port_info.description})")
-                iface = try_connect_meshtastic_device_internal(port_info.device)
-                tried_ports.add(port_info.device)
-                if iface:
-                    connected_port_path = port_info.device
-                    return iface, connected_port_path
-        if not iface and DEBUG: print("    Stage 2b: No conclusive match by keywords or connection failed.")
-
-    if not iface:
-        print("    Auto-detection (VID/PID & keyword) failed or connection unsuccessful.")
-        print("    FATAL: Could not auto-select Meshtastic device. No input prompt in non-interactive mode.")
-        return None, None # No manual selection in headless mode
-
-    # Fallback - Should ideally not be reached if auto-selection is comprehensive
-    # The previous patch for manual input is removed to ensure no prompts
-    # If the script reaches here, it means all auto-detection attempts failed.
-    # print("  Stage 3: Fallback - Manual port selection.") -> This part is removed.
-
-    return None, None # Explicitly return None if no device is found and connected
-
-
-# --- NodeStats Class, haversine, on_receive, make_serializable (Assume these are correctly defined as in your file) ---
+    all_ports = [p for p in serial.tools.list_ports.comports() if p.device not in tried_ports]
+
+    # Stage 2: The device that connected last time, if it is plugged in
+    cache = load_port_cache()
+    for port_info in all_ports:
+        if port_matches_cache(port_info, cache):
+            print(f"  Stage 2: Trying last known Meshtastic device: {port_info.device} ({port_info.description})")
+            iface = try_connect_meshtastic_device_internal(port_info.device)
+            tried_ports.add(port_info.device)
+            if iface:
+                return iface, port_info.device
+            print(f"    Failed on cached device {port_info.device}.")
+            break
+
+    # Stage 3: Probe all ports matching by VID/PID or keywords at once
+    print("  Stage 3: Trying auto-detection (VID/PID & keywords)...")
+    def is_candidate(port_info):
+        if port_info.vid and port_info.pid:
+            for vid, pid_match, name_check in meshtastic_vid_pids:
+                if port_info.vid == vid and (pid_match is None or port_info.pid == pid_match) and \
+                   (name_check is None or name_check.lower() in port_info.description.lower()):
+                    return True
+        desc_lower = port_info.description.lower()
+        mfc_lower = port_info.manufacturer.lower() if port_info.manufacturer else ""
+        return any(k.lower() in desc_lower or k.lower() in mfc_lower for k in meshtastic_keywords)
+
+    candidates = [p for p in all_ports if p.device not in tried_ports and is_candidate(p)]
+    for port_info in candidates:
+        print(f"    Probing {port_info.device} ({port_info.description})")
+    iface, port_info = probe_ports_concurrently(candidates)
+    if iface:
+        print(f"    Connected on {port_info.device}.")
+        save_port_cache(port_info)
+        return iface, port_info.device
+
+    print("    Auto-detection (VID/PID & keyword) failed or connection unsuccessful.")
+    print("    FATAL: Could not auto-select Meshtastic device. No input prompt in non-interactive mode.")
+    return None, None # No manual selection in headless mode
+
+
+# --- NodeStats Class, on_receive ---
 class NodeStats:
-    """Collect metrics and compute 5-minute descriptive statistics, plus position and message history."""
+    """Collect metrics and compute 5-minute descriptive statistics, plus position and message history.
+
+    Sized for meshes with thousands of nodes: slotted, and everything optional is created
+    lazily. The metric window lives in one array('d'): running per-field sums and counts
+    (HISTORY_HEADER values) followed by rows of [ts, value per SUMMARY_FIELDS] (NaN = missing)
+    read from `_head`, so evicting old rows and summarize() cost O(1) amortized. Messages go to
+    a list used as a ring of MESSAGE_HISTORY entries. percentiles() of PERCENTILE_FIELDS over
+    the short windows are read from those same rows; only the 1 h / 24 h windows need extra
+    state, bucketed histograms packed into one RollingPercentiles array.
+    """
+    __slots__ = ('_history', '_head', '_last_seen', '_messages', '_message_next', '_extra_fields', '_percentiles',
+                 'lat', 'lon', 'altitude', 'temp', 'wio_reading')
+
     def __init__(self):
-        self.records = []
+        self._history = None  # array('d'), created on the first telemetry packet
+        self._head = HISTORY_HEADER  # Offset of the oldest live row in _history
+        self._last_seen = None  # Epoch seconds
+        self._messages = None   # Created on the first message
+        self._message_next = 0  # Ring slot the next message overwrites once _messages is full
+        self._extra_fields = ()  # (key, value) pairs
+        self._percentiles = None  # RollingPercentiles with one series per PERCENTILE_FIELDS entry, created on the first value
         self.lat = None
         self.lon = None
         self.altitude = None
         self.temp = None
-        self.last_seen = None
-        self.messages = []
-        self.extra_fields = {}
+        self.wio_reading = None  # Latest compact Wio sensor reading received from this node
+
+    @property
+    def last_seen(self):
+        return datetime.datetime.fromtimestamp(self._last_seen) if self._last_seen is not None else None
+
+    @property
+    def records(self):
+        """Rows in the current window as (epoch ts, values) with None for missing values, oldest first."""
+        if self._history is None:
+            return []
+        h = self._history
+        return [(h[i], tuple(None if v != v else v for v in h[i + 1:i + METRIC_STRIDE]))  # v != v: NaN
+                for i in range(self._head, len(h), METRIC_STRIDE)]
+
+    @property
+    def messages(self):
+        """Up to MESSAGE_HISTORY (ts, from_id, text) tuples, oldest first."""
+        if not self._messages:
+            return []
+        return self._messages[self._message_next:] + self._messages[:self._message_next]
+
+    @property
+    def extra_fields(self):
+        return dict(self._extra_fields)
 
     def add_metrics(self, ts, metrics: dict):
-        self.records.append({'ts': ts, **metrics})
-        self.last_seen = ts
-        cutoff = ts - datetime.timedelta(minutes=5)
-        self.records = [r for r in self.records if r['ts'] >= cutoff]
+        t = ts.timestamp()
+        h = self._history
+        if h is None:
+            h = self._history = array('d', bytes(8 * HISTORY_HEADER))
+        n_fields = len(SUMMARY_FIELDS)
+        values = [metrics.get(f) for f in SUMMARY_FIELDS]
+        h.append(t)
+        h.extend([NAN if value is None else value for value in values])
+        for i, value in enumerate(values):
+            if value is not None:
+                h[i] += value             # Running sum
+                h[n_fields + i] += 1      # Running count
+        self._last_seen = t
+        cutoff = t - STATS_WINDOW_S
+        head = self._head
+        if h[head] < cutoff or len(h) - head > MAX_METRIC_RECORDS * METRIC_STRIDE:
+            while (h[head] < cutoff or len(h) - head > MAX_METRIC_RECORDS * METRIC_STRIDE) and len(h) - head > METRIC_STRIDE:
+                for i in range(n_fields):
+                    value = h[head + 1 + i]
+                    if value == value:  # Not NaN
+                        h[i] -= value
+                        h[n_fields + i] -= 1
+                head += METRIC_STRIDE
+            if (head - HISTORY_HEADER) * 2 >= len(h) - HISTORY_HEADER:  # Compact once the dead rows outnumber the live ones
+                del h[HISTORY_HEADER:head]
+                head = HISTORY_HEADER
+            self._head = head
+            for i in range(n_fields):
+                if not h[n_fields + i]:
+                    h[i] = 0.0  # Drop accumulated float error whenever a field's window empties
+        for i, f in enumerate(PERCENTILE_FIELDS):
+            value = metrics.get(f)
+            if value is not None:
+                if self._percentiles is None:
+                    self._percentiles = RollingPercentiles(PERCENTILE_SKETCH_WINDOWS, series=len(PERCENTILE_FIELDS))
+                self._percentiles.add(t, value, i)
         temp = metrics.get('temperature')
         if temp is not None:
             self.temp = temp
@@ -208,37 +361,182 @@ class NodeStats:
         self.lat, self.lon, self.altitude = lat, lon, altitude
 
     def add_message(self, ts, from_id, text):
-        self.messages.append((ts, from_id, text))
-        if len(self.messages) > 20:
-            self.messages = self.messages[-20:]
+        message = (ts, from_id, text)
+        if self._messages is None:
+            self._messages = [message]
+        elif len(self._messages) < MESSAGE_HISTORY:
+            self._messages.append(message)
+        else:
+            self._messages[self._message_next] = message
+            self._message_next = (self._message_next + 1) % MESSAGE_HISTORY
 
     def set_extra_fields(self, decoded, exclude_keys=None):
         if exclude_keys is None:
             exclude_keys = set()
-        self.extra_fields = {k: v for k, v in decoded.items() if k not in exclude_keys}
+        self._extra_fields = tuple((k, v) for k, v in decoded.items() if k not in exclude_keys)
 
     def summarize(self):
-        fields = ['batteryLevel', 'voltage', 'channelUtilization', 'airUtilTx', 'uptimeSeconds']
-        latest = {f: None for f in fields}
-        mean = {f: None for f in fields}
-        if self.records:
-            latest_record = self.records[-1]
-            for f in fields:
-                latest[f] = latest_record.get(f)
-            for f in fields:
-                vals = [r.get(f) for r in self.records if r.get(f) is not None]
-                if vals:
-                    mean[f] = sum(vals) / len(vals)
+        latest = dict.fromkeys(SUMMARY_FIELDS)
+        mean = dict.fromkeys(SUMMARY_FIELDS)
+        h = self._history
+        if h is not None and len(h) > HISTORY_HEADER:
+            n_fields = len(SUMMARY_FIELDS)
+            last_row = len(h) - METRIC_STRIDE
+            for i, f in enumerate(SUMMARY_FIELDS):
+                value = h[last_row + 1 + i]
+                if value == value:
+                    latest[f] = int(value) if f in SUMMARY_INT_FIELDS else value
+                if h[n_fields + i]:
+                    mean[f] = h[i] / h[n_fields + i]
         return latest, mean
 
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000
-    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    return R * c
+    def percentiles(self, now=None):
+        """{field: {window: {"n", "p50", "p95", "max"}}} for PERCENTILE_FIELDS, e.g. for capacity planning."""
+        if self._percentiles is None:
+            return {}
+        now = now if now is not None else time.time()
+        head = self._head
+        h = self._history[:]  # One C-level copy, consistent even if the receive thread is adding
+        oldest = now - max(length for _, length in PERCENTILE_HISTORY_WINDOWS)
+        rows = []  # (ts, row offset), newest first
+        for row in range(len(h) - METRIC_STRIDE, max(head, HISTORY_HEADER) - 1, -METRIC_STRIDE):
+            if h[row] < oldest:
+                break
+            rows.append((h[row], row))
+        result = {}
+        for i, f in enumerate(PERCENTILE_FIELDS):
+            column = 1 + SUMMARY_FIELDS.index(f)
+            summary = {}
+            for name, length in PERCENTILE_HISTORY_WINDOWS:
+                stats = exact_summary([h[row + column] for ts, row in rows
+                                       if ts >= now - length and h[row + column] == h[row + column]])  # Skip NaN
+                if stats:
+                    summary[name] = stats
+            summary.update(self._percentiles.summary(now, series=i))
+            if summary:
+                result[f] = summary
+        return result
+
+def record_position(from_id, node_stat, lat, lon, altitude):
+    """Stores a node's position and refreshes its row of NODE_DISTANCES and its NODE_INDEX cell."""
+    node_stat.update_position(lat, lon, altitude)
+    if lat is not None and lon is not None and (lat, lon) != (0, 0): # 0,0 is what a missing fix decodes to
+        NODE_DISTANCES.update(from_id, lat, lon)
+        NODE_INDEX.update(from_id, lat, lon)
+
+def resolve_node_id(node):
+    """Accepts a node id ('!5919307a') or a USER_MAP name ('HOME')."""
+    for node_id, name in USER_MAP.items():
+        if name == node:
+            return node_id
+    return node
+
+def nodes_within(node, radius_m):
+    """[(node id, meters), ...] within radius_m of a node, nearest first. Empty if its position is unknown."""
+    node_id = resolve_node_id(node)
+    position = NODE_INDEX.position(node_id)
+    return NODE_INDEX.within(*position, radius_m, exclude=node_id) if position else []
+
+def nearest_nodes(node, k=5):
+    """The k nodes closest to a node as [(node id, meters), ...]. Empty if its position is unknown."""
+    node_id = resolve_node_id(node)
+    position = NODE_INDEX.position(node_id)
+    return NODE_INDEX.nearest(*position, k, exclude=node_id) if position else []
+
+def write_percentile_snapshot(path):
+    """Writes every node's channelUtilization/airUtilTx percentiles to a JSON file (replaced atomically)."""
+    now = time.time()
+    snapshot = {'ts': datetime.datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"), 'nodes': {}}
+    for node_id, node_stat in list(NODE_STATS.items()):
+        percentiles = node_stat.percentiles(now)
+        if percentiles:
+            snapshot['nodes'][node_id] = percentiles
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(snapshot, f, indent=1)
+    os.replace(tmp_path, path)
+
+# --- Packet handlers ---
+ANY_PORTNUM = '*'
+PORTNUM_HANDLERS = {} # (portnum or ANY_PORTNUM, node id or None) -> [handler, ...]
+EXTRA_FIELD_EXCLUDES = frozenset({'text', 'payload', 'portnum', 'position', 'telemetry', 'wioReading'})
+
+def register_handler(portnum, node_id=None):
+    """Decorator that adds a handler(decoded, node_stat, from_id, now_dt, now_str) to on_receive.
+
+    The handler runs for packets with that portnum, only from `node_id` if one is given;
+    ANY_PORTNUM with a node id runs for every packet from that node. on_receive looks
+    handlers up by key, so registering more of them does not slow down other packets.
+    """
+    def decorator(handler):
+        PORTNUM_HANDLERS.setdefault((portnum, node_id), []).append(handler)
+        return handler
+    return decorator
+
+def _position_from(pos):
+    lat = pos.get('latitude') or pos.get('latitudeI', 0)/1e7
+    lon = pos.get('longitude') or pos.get('longitudeI', 0)/1e7
+    return lat, lon, pos.get('altitude')
+
+@register_handler('TELEMETRY_APP')
+def handle_telemetry(decoded, node_stat, from_id, now_dt, now_str):
+    telemetry = decoded.get('telemetry')
+    if telemetry is None:
+        return
+    metrics = telemetry.get('deviceMetrics', {})
+    node_stat.add_metrics(now_dt, metrics)
+    temp = metrics.get('temperature')
+    if temp is not None:
+        node_stat.temp = temp
+
+@register_handler('POSITION_APP')
+def handle_position(decoded, node_stat, from_id, now_dt, now_str):
+    pos = decoded.get('position')
+    if pos is not None:
+        record_position(from_id, node_stat, *_position_from(pos))
+
+@register_handler(COMPACT_PORTNUM_NAME)
+def handle_compact_reading(decoded, node_stat, from_id, now_dt, now_str):
+    if 'payload' not in decoded:
+        return
+    try:
+        station_id, reading = decode_reading(decoded['payload'])
+        wio_data = {'stationId': station_id, **reading.as_mqtt_payload()}
+        decoded['wioReading'] = wio_data # Logged alongside the raw payload
+        node_stat.wio_reading = wio_data
+        if DEBUG: print(f"[{now_str}] Wio reading from {from_id} (station {station_id}): {reading}")
+    except CompactDecodeError as e:
+        if DEBUG: print(f"[{now_str}] Could not decode PRIVATE_APP payload from {from_id}: {e}")
+
+@register_handler(ANY_PORTNUM, node_id='!5919307a')
+def handle_badbite(decoded, node_stat, from_id, now_dt, now_str):
+    """BadBite sends temperature and position outside the usual apps, and plain-text payloads."""
+    for key_temp in ('temperature', 'temp'):
+        if decoded.get(key_temp) is not None:
+            node_stat.temp = decoded[key_temp]
+    if 'position' in decoded and decoded.get('portnum') != 'POSITION_APP': # POSITION_APP already handled
+        record_position(from_id, node_stat, *_position_from(decoded['position']))
+    raw_payload = decoded.get('payload')
+    if raw_payload:
+        try:
+            decoded_text = raw_payload.decode('utf-8', errors='ignore')
+        except AttributeError: # Not bytes
+            decoded_text = str(raw_payload)
+        if decoded_text:
+            node_stat.add_message(now_str, from_id, f"[PayloadDecoded] {decoded_text}")
+
+def format_packet_log_entry(entry):
+    """Turns a queued (ts, from_id, portnum, packet) record into a JSONL line. Runs on the log writer thread.
+
+    The 'raw' protobufs are logged by type only; their fields are already in the packet dict."""
+    now_str, from_id, portnum, packet = entry
+    try:
+        return json.dumps({'ts': now_str, 'packet': make_serializable(without_raw_protobufs(packet))})
+    except Exception as e:
+        print(f"[ERROR] Log write error: {e}")
+        if DEBUG:
+            traceback.print_exc()
+        return json.dumps({'ts': now_str, 'packet_from': from_id, 'packet_type': portnum, 'error': 'serialization_failed'})
 
 def on_receive(packet, interface):
     global DEBUG
@@ -246,18 +544,23 @@ def on_receive(packet, interface):
         now_dt = datetime.datetime.now()
         now_str = now_dt.strftime("%Y-%m-%d %H:%M:%S")
         from_id = packet.get('fromId', 'Unknown')
-        portnum = packet.get('decoded', {}).get('portnum', 'Unknown')
+        if type(from_id) is str:
+            from_id = sys.intern(from_id) # One shared string per node for NODE_STATS keys and message tuples
+        decoded = packet.get('decoded')
+        portnum = decoded.get('portnum', 'Unknown') if decoded is not None else 'Unknown'
 
         if DEBUG:
             # Access USER_MAP which is now guaranteed to be globally defined before this function
             user_display = USER_MAP.get(from_id, from_id) 
-            print(f"[{now_str}] RX: ID={user_display}, Portnum={portnum}, Packet={packet.get('decoded')}")
+            print(f"[{now_str}] RX: ID={user_display}, Portnum={portnum}, Packet={decoded}")
 
         # NODE_STATS is now guaranteed to be globally defined before this function
-        node_stat = NODE_STATS.setdefault(from_id, NodeStats())
+        node_stat = NODE_STATS.get(from_id)
+        if node_stat is None:
+            node_stat = NODE_STATS[from_id] = NodeStats()
         text = None
-        if 'decoded' in packet and 'text' in packet['decoded']:
-            text = packet['decoded']['text']
+        if decoded is not None and 'text' in decoded:
+            text = decoded['text']
         elif 'payload' in packet:
             try:
                 text = packet['payload'].decode('utf-8', errors='ignore')
@@ -267,60 +570,17 @@ def on_receive(packet, interface):
         if text:
             node_stat.add_message(now_str, from_id, text)
 
-        if portnum == 'TELEMETRY_APP' and 'telemetry' in packet['decoded']:
-            metrics = packet['decoded']['telemetry'].get('deviceMetrics', {})
-            node_stat.add_metrics(now_dt, metrics)
-            temp = metrics.get('temperature')
-            if temp is not None:
-                node_stat.temp = temp
-
-        if portnum == 'POSITION_APP' and 'position' in packet['decoded']:
-            pos = packet['decoded']['position']
-            lat = pos.get('latitude') or pos.get('latitudeI', 0)/1e7
-            lon = pos.get('longitude') or pos.get('longitudeI', 0)/1e7
-            alt = pos.get('altitude')
-            node_stat.update_position(lat, lon, alt)
-
-        if from_id == '!5919307a':
-            if 'decoded' in packet:
-                d = packet['decoded']
-                for key_temp in ['temperature', 'temp']:
-                    if key_temp in d and d[key_temp] is not None:
-                        node_stat.temp = d[key_temp]
-                if 'position' in d:
-                    pos_badbite = d['position']
-                    lat_bb = pos_badbite.get('latitude') or pos_badbite.get('latitudeI',0)/1e7
-                    lon_bb = pos_badbite.get('longitude') or pos_badbite.get('longitudeI',0)/1e7
-                    alt_bb = pos_badbite.get('altitude')
-                    node_stat.update_position(lat_bb, lon_bb, alt_bb)
-            if 'payload' in packet.get('decoded', {}):
-                raw_payload = packet['decoded']['payload']
-                try:
-                    decoded_text = bytes.fromhex(raw_payload.hex()).decode('utf-8', errors='ignore')
-                except Exception:
-                    decoded_text = None
-                if decoded_text:
-                    node_stat.add_message(now_str, from_id, f"[PayloadDecoded] {decoded_text}")
-
-        if 'decoded' in packet:
-            exclude_keys = {'text', 'payload', 'portnum', 'position', 'telemetry'}
-            node_stat.set_extra_fields(packet['decoded'], exclude_keys=exclude_keys)
+        if decoded is not None:
+            for key in ((portnum, None), (portnum, from_id), (ANY_PORTNUM, from_id)):
+                handlers = PORTNUM_HANDLERS.get(key)
+                if handlers:
+                    for handler in handlers:
+                        handler(decoded, node_stat, from_id, now_dt, now_str)
+            node_stat.set_extra_fields(decoded, exclude_keys=EXTRA_FIELD_EXCLUDES)
 
-        # LOG_FILE is globally defined
+        # LOG_FILE is globally defined; serialization and the write happen on its worker thread
         if LOG_FILE:
-            try:
-                serializable_packet = make_serializable(packet)
-                LOG_FILE.write(json.dumps({'ts': now_str, 'packet': serializable_packet}) + "\n")
-                LOG_FILE.flush()
-            except Exception as e:
-                print(f"[ERROR] Log write error: {e}")
-                if DEBUG:
-                    traceback.print_exc()
-                try:
-                    LOG_FILE.write(json.dumps({'ts': now_str, 'packet_from': from_id, 'packet_type': portnum, 'error': 'serialization_failed'}) + "\n")
-                    LOG_FILE.flush()
-                except Exception as log_fallback_e:
-                    print(f"[ERROR] Log fallback write error: {log_fallback_e}")
+            LOG_FILE.write_line((now_str, from_id, portnum, packet))
 
     except Exception as e:
         print(f"[ERROR] Unhandled exception in on_receive: {e}")
@@ -362,7 +622,14 @@ def connect_and_listen(cli_port_arg=None): # Renamed from the previous `connect_
     log_name = os.path.join(log_dir, f"meshtastic_log_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.jsonl")
 
     try:
-        LOG_FILE = open(log_name, "a", encoding="utf-8")
+        LOG_FILE = BackgroundLogWriter(
+            open(log_name, "a", encoding="utf-8"),
+            max_queued=LOG_MAX_QUEUED,
+            flush_interval=LOG_FLUSH_INTERVAL_S,
+            flush_size=LOG_FLUSH_SIZE,
+            formatter=format_packet_log_entry,
+            name="PacketLogWriter",
+        )
     except IOError as e:
         print(f"[ERROR] Could not open log file '{log_name}': {e}")
         if interface: interface.close()
@@ -375,11 +642,21 @@ def connect_and_listen(cli_port_arg=None): # Renamed from the previous `connect_
     if DEBUG:
         print("DEBUG mode is ON. Verbose output will be shown for received packets.")
 
+    percentiles_path = os.path.join(log_dir, "node_percentiles.json")
+    last_percentile_snapshot = time.time()
+    reported_drops = 0
     try:
         while True:
             time.sleep(1)
-            if LOG_FILE:
-                LOG_FILE.flush()
+            if LOG_FILE and LOG_FILE.counters["dropped"] > reported_drops:
+                reported_drops = LOG_FILE.counters["dropped"]
+                print(f"[WARNING] Packet log queue full: {reported_drops} packets not logged so far. Stats: {LOG_FILE.stats()}")
+            if time.time() - last_percentile_snapshot >= PERCENTILE_SNAPSHOT_INTERVAL_S:
+                last_percentile_snapshot = time.time()
+                try:
+                    write_percentile_snapshot(percentiles_path)
+                except (OSError, RuntimeError) as e: # RuntimeError: NODE_STATS changed while copying
+                    print(f"[ERROR] Could not write percentile snapshot: {e}")
     except KeyboardInterrupt:
         print("\nExiting program...")
     except Exception as e:
@@ -393,25 +670,8 @@ def connect_and_listen(cli_port_arg=None): # Renamed from the previous `connect_
             print(f"Meshtastic interface on {connected_port} closed.")
         if LOG_FILE:
             LOG_FILE.close()
-            print(f"Log file '{log_name}' closed.")
+            print(f"Log file '{log_name}' closed. Writer stats: {LOG_FILE.stats()}")
         print("Cleanup complete. Exiting.")
 
-def make_serializable(obj):
-    if isinstance(obj, dict):
-        return {k: make_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [make_serializable(item) for item in obj]
-    elif isinstance(obj, tuple):
-        return tuple(make_serializable(item) for item in obj)
-    elif isinstance(obj, bytes):
-        return obj.hex()
-    elif hasattr(obj, '__dict__'):
-        return make_serializable(obj.__dict__)
-    else:
-        try:
-            return str(obj)
-        except:
-            return "UNSERIALIZABLE"
-
 if __name__ == "__main__":
     connect_and_listen()
\ No newline at end of file
@@ -0,0 +1,131 @@
+import math
+import heapq
+import threading
+from distance_calculator import haversine
+
+METERS_PER_DEGREE = 111195.0  # Along a meridian (Earth radius 6371 km)
+
+class GridIndex:
+    """Node positions bucketed in a fixed lat/lon grid for radius and nearest-neighbour queries.
+
+    `cell_deg` (default 0.05 deg, about 5.5 km) sets the cell size. update() moves a node
+    between cells in O(1). within() only visits the cells overlapping the search circle's
+    bounding box, and nearest() searches rings of cells outwards until no closer node can
+    remain, so both touch nearby nodes only instead of the whole node table. Distances are
+    exact haversine meters. Safe to update from the receive thread while other threads query.
+    """
+    def __init__(self, cell_deg=0.05):
+        self.cell_deg = cell_deg
+        self._lon_cells = round(360 / cell_deg)
+        self._lock = threading.Lock()
+        self._cells = {}      # (lat index, lon index) -> {node id: (lat, lon)}
+        self._positions = {}  # node id -> (lat, lon, cell)
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg) % self._lon_cells)
+
+    def update(self, node_id, lat, lon):
+        cell = self._cell(lat, lon)
+        with self._lock:
+            previous = self._positions.get(node_id)
+            if previous is not None and previous[2] != cell:
+                self._drop_from_cell(node_id, previous[2])
+            self._cells.setdefault(cell, {})[node_id] = (lat, lon)
+            self._positions[node_id] = (lat, lon, cell)
+
+    def remove(self, node_id):
+        with self._lock:
+            previous = self._positions.pop(node_id, None)
+            if previous is not None:
+                self._drop_from_cell(node_id, previous[2])
+
+    def _drop_from_cell(self, node_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.pop(node_id, None)
+            if not members:
+                del self._cells[cell]
+
+    def position(self, node_id):
+        entry = self._positions.get(node_id)
+        return entry[:2] if entry else None
+
+    def _ring(self, center, radius):
+        """Cells at Chebyshev distance exactly `radius` from center (lon wraps around)."""
+        lat_i, lon_i = center
+        if radius == 0:
+            yield center
+            return
+        for d_lat in range(-radius, radius + 1):
+            step = 1 if abs(d_lat) == radius else 2 * radius  # Inner rows only contribute their two ends
+            for d_lon in range(-radius, radius + 1, step):
+                yield (lat_i + d_lat, (lon_i + d_lon) % self._lon_cells)
+
+    def _min_cell_size_m(self, lat, rings):
+        """Smallest cell edge (meters) anywhere within `rings` cells of latitude lat."""
+        extreme_lat = min(89.9, abs(lat) + (rings + 1) * self.cell_deg)
+        return self.cell_deg * METERS_PER_DEGREE * math.cos(math.radians(extreme_lat))
+
+    def within(self, lat, lon, radius_m, exclude=None):
+        """[(node id, meters), ...] closer than radius_m to (lat, lon), nearest first."""
+        lat_span = radius_m / METERS_PER_DEGREE
+        lon_span = radius_m / (METERS_PER_DEGREE * max(0.01, math.cos(math.radians(min(89.9, abs(lat) + lat_span)))))
+        lat_lo, lat_hi = math.floor((lat - lat_span) / self.cell_deg), math.floor((lat + lat_span) / self.cell_deg)
+        lon_lo, lon_hi = math.floor((lon - lon_span) / self.cell_deg), math.floor((lon + lon_span) / self.cell_deg)
+        results = []
+        with self._lock:
+            if (lat_hi - lat_lo + 1) * (lon_hi - lon_lo + 1) > len(self._cells):
+                candidates = [members for members in self._cells.values()]  # Box covers more cells than exist
+            else:
+                candidates = [self._cells[cell] for cell in
+                              ((a, b % self._lon_cells) for a in range(lat_lo, lat_hi + 1) for b in range(lon_lo, lon_hi + 1))
+                              if cell in self._cells]
+            for members in candidates:
+                for node_id, (node_lat, node_lon) in members.items():
+                    if node_id == exclude:
+                        continue
+                    d = haversine(lat, lon, node_lat, node_lon)
+                    if d <= radius_m:
+                        results.append((node_id, d))
+        results.sort(key=lambda item: item[1])
+        return results
+
+    def nearest(self, lat, lon, k=5, exclude=None):
+        """The k nodes closest to (lat, lon) as [(node id, meters), ...], nearest first."""
+        best = []  # Max-heap of (-distance, node id) holding the k closest so far
+
+        def consider(members):
+            for node_id, (node_lat, node_lon) in members.items():
+                if node_id == exclude:
+                    continue
+                d = haversine(lat, lon, node_lat, node_lon)
+                if len(best) < wanted:
+                    heapq.heappush(best, (-d, node_id))
+                elif d < -best[0][0]:
+                    heapq.heapreplace(best, (-d, node_id))
+
+        with self._lock:
+            wanted = min(k, len(self._positions) - (1 if exclude in self._positions else 0))
+            if wanted <= 0:
+                return []
+            center = self._cell(lat, lon)
+            radius = 0
+            while True:
+                if (2 * radius + 1) ** 2 > 4 * len(self._cells):
+                    # Sparse, spread-out nodes: scanning every occupied cell is cheaper than more rings
+                    best.clear()
+                    for members in self._cells.values():
+                        consider(members)
+                    break
+                for cell in self._ring(center, radius):
+                    members = self._cells.get(cell)
+                    if members:
+                        consider(members)
+                # Anything outside this ring is at least `radius` whole cells away
+                if len(best) == wanted and radius * self._min_cell_size_m(lat, radius) >= -best[0][0]:
+                    break
+                radius += 1
+        return sorted(((node_id, -neg) for neg, node_id in best), key=lambda item: item[1])
@@ -0,0 +1,132 @@
+import math
+import time
+import datetime
+from array import array
+from wio_frame_parser import FIELDS, FIELD_SPECS, INTEGER_FIELDS
+
+class ChannelStats:
+    """Running min/max/mean/variance/last for one sensor channel (Welford's algorithm, O(1) per value)."""
+    __slots__ = ("count", "mean", "m2", "min", "max", "last")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.last = math.nan
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.last = value
+
+    @property
+    def stddev(self):
+        # Sample standard deviation; 0 for a single value
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+class WindowSummary:
+    """Per-channel aggregates for one closed window.
+
+    Quacks like a WioReading where the sinks need it: `values` holds the window means and
+    `rpi_ts` the window end, so the compact Meshtastic encoder can send a summary as is.
+    """
+    __slots__ = ("window_start", "window_end", "blocks", "channels")
+
+    def __init__(self, window_start, window_end, blocks, channels):
+        self.window_start = window_start
+        self.window_end = window_end
+        self.blocks = blocks
+        self.channels = channels  # key -> (count, min, max, mean, stddev, last)
+
+    def __len__(self):
+        return len(self.channels)
+
+    @property
+    def rpi_ts(self):
+        return self.window_end
+
+    @property
+    def values(self):
+        return array('d', (self.channels[key][3] if key in self.channels else math.nan for key in FIELDS))
+
+    def as_mqtt_payload(self):
+        """Flat latest values (same keys as a single reading) plus a "window" section with the aggregates."""
+        payload = {"rpi_timestamp": datetime.datetime.fromtimestamp(self.window_end).isoformat()}
+        stats = {}
+        for key, (count, vmin, vmax, mean, stddev, last) in self.channels.items():
+            if key in INTEGER_FIELDS:
+                last, vmin, vmax = int(last), int(vmin), int(vmax)
+            payload[key.lower()] = last
+            stats[key.lower()] = {"n": count, "min": vmin, "max": vmax, "mean": round(mean, 4),
+                                  "std": round(stddev, 4), "last": last}
+        payload["window"] = {
+            "start": datetime.datetime.fromtimestamp(self.window_start).isoformat(),
+            "seconds": round(self.window_end - self.window_start, 1),
+            "blocks": self.blocks,
+            "stats": stats,
+        }
+        return payload
+
+    def as_text_lines(self):
+        """One "Label: mean unit (min..max)" line per channel, for Meshtastic text messages."""
+        span = round((self.window_end - self.window_start) / 60, 1)
+        lines = [f"Window: {datetime.datetime.fromtimestamp(self.window_end).isoformat(timespec='seconds')} ({span} min, {self.blocks} readings)"]
+        for key, (count, vmin, vmax, mean, stddev, last) in self.channels.items():
+            label, unit, decimals = FIELD_SPECS[key]
+            unit_text = f" {unit}" if unit else ""
+            lines.append(f"{label}: {mean:.{decimals}f}{unit_text} ({vmin:.{decimals}f}..{vmax:.{decimals}f}, sd {stddev:.{decimals}f})")
+        return lines
+
+class WindowAggregator:
+    """Incremental per-channel aggregates over a tumbling window.
+
+    add() folds each reading in with O(1) work per channel; take_summary() closes the current
+    window, returns its WindowSummary and starts a new one. Each sink keeps its own aggregator
+    so its window matches its send interval.
+    """
+    def __init__(self, fields=FIELDS):
+        self.fields = tuple(fields)
+        self._field_indexes = tuple(FIELDS.index(key) for key in self.fields)
+        self._stats = [ChannelStats() for _ in self.fields]
+        self.window_start = time.time()
+        self.blocks = 0
+
+    def add(self, reading):
+        values = reading.values
+        for stats, idx in zip(self._stats, self._field_indexes):
+            value = values[idx]
+            if not math.isnan(value):
+                stats.add(value)
+        self.blocks += 1
+
+    def summary(self, now=None):
+        now = now if now is not None else time.time()
+        channels = {}
+        for key, stats in zip(self.fields, self._stats):
+            if stats.count:
+                channels[key] = (stats.count, stats.min, stats.max, stats.mean, stats.stddev, stats.last)
+        return WindowSummary(self.window_start, now, self.blocks, channels)
+
+    def reset(self, now=None):
+        for stats in self._stats:
+            stats.reset()
+        self.blocks = 0
+        self.window_start = now if now is not None else time.time()
+
+    def take_summary(self, now=None):
+        """Returns the summary of the current window (None if it saw no readings) and starts a new window."""
+        now = now if now is not None else time.time()
+        summary = self.summary(now) if self.blocks else None
+        self.reset(now)
+        return summary
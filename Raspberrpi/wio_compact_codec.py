@@ -0,0 +1,78 @@
+import struct
+import math
+from wio_frame_parser import WioReading, FIELDS, FIELD_INDEX
+
+# Compact binary layout for one Wio reading, sized to fit a single Meshtastic packet.
+#
+#   header: version (B) | station id (H) | unix time (I) | field presence mask (H)
+#   body:   one fixed-point value per field present in the mask, in FIELDS order
+#
+# All integers are little-endian. A full reading is 37 bytes, versus ~11 text packets.
+# Missing and non-finite (NaN/inf) values are left out of the mask.
+COMPACT_VERSION = 2
+COMPACT_PORTNUM = 256               # meshtastic PortNum.PRIVATE_APP
+COMPACT_PORTNUM_NAME = "PRIVATE_APP"  # How the portnum appears in decoded packets
+HEADER = struct.Struct("<BHIH")
+
+# key -> (struct code, scale). Stored value = round(value * scale), clamped to the code's range.
+FIELD_CODING = {
+    "TEMP": ("h", 100),       # -327.68 .. 327.67 C
+    "HUMIDITY": ("H", 100),   # 0 .. 655.35 %
+    "PRESSURE": ("I", 100),   # mmHg; needs more than 16 bits at 0.01 resolution
+    "UV": ("H", 100),
+    "NO2": ("H", 1000),       # 0 .. 65.535 ppm (GM-102B tops out at 10 ppm)
+    "C2H5OH": ("I", 1000),    # 0 .. 4294967.295 ppm; the GM-302B/502B/702B ranges reach 500-1000 ppm
+    "VOC": ("I", 1000),
+    "CO": ("I", 1000),
+    "CPM": ("H", 1),
+    "USVH": ("H", 100),
+}
+# Version 1 packed every gas field as ("H", 1000); still decoded so older bridges keep working
+_V1_FIELD_CODING = {**FIELD_CODING, "C2H5OH": ("H", 1000), "VOC": ("H", 1000), "CO": ("H", 1000)}
+_RANGES = {"h": (-0x8000, 0x7FFF), "H": (0, 0xFFFF), "I": (0, 0xFFFFFFFF)}
+
+def _coders(coding):
+    return tuple(
+        (FIELD_INDEX[key], struct.Struct("<" + coding[key][0]), coding[key][1], _RANGES[coding[key][0]])
+        for key in FIELDS
+    )
+
+_CODERS = _coders(FIELD_CODING)
+_DECODERS = {COMPACT_VERSION: _CODERS, 1: _coders(_V1_FIELD_CODING)}  # version -> field coders
+
+class CompactDecodeError(ValueError):
+    """Raised when a payload is not a valid compact Wio reading."""
+
+def encode_reading(reading, station_id):
+    """Packs a WioReading into the compact binary format."""
+    mask = 0
+    body = []
+    for bit, (idx, coder, scale, (low, high)) in enumerate(_CODERS):
+        value = reading.values[idx]
+        if not math.isfinite(value):  # NaN (missing) or inf: sent as absent
+            continue
+        mask |= 1 << bit
+        body.append(coder.pack(min(high, max(low, round(value * scale)))))
+    header = HEADER.pack(COMPACT_VERSION, station_id & 0xFFFF, int(reading.rpi_ts) & 0xFFFFFFFF, mask)
+    return header + b"".join(body)
+
+def decode_reading(payload):
+    """Unpacks a compact payload. Returns (station_id, WioReading)."""
+    payload = bytes(payload)
+    if len(payload) < HEADER.size:
+        raise CompactDecodeError(f"payload too short ({len(payload)} bytes)")
+    version, station_id, ts, mask = HEADER.unpack_from(payload, 0)
+    coders = _DECODERS.get(version)
+    if coders is None:
+        raise CompactDecodeError(f"unsupported version {version}")
+    reading = WioReading(rpi_ts=float(ts))
+    offset = HEADER.size
+    for bit, (idx, coder, scale, _range) in enumerate(coders):
+        if not mask & (1 << bit):
+            continue
+        if offset + coder.size > len(payload):
+            raise CompactDecodeError(f"payload truncated at field {FIELDS[idx]}")
+        (raw,) = coder.unpack_from(payload, offset)
+        offset += coder.size
+        reading.values[idx] = raw / scale
+    return station_id, reading
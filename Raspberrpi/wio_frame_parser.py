@@ -0,0 +1,234 @@
+import time
+import datetime
+import math
+from array import array
+
+DEBUG = False  # Set to True for verbose debug output
+
+# Sensor lines emitted by Environmental_box.ino between START_DATA and END_DATA.
+# key -> (display label, default unit, decimals printed by the Wio sketch)
+FIELD_SPECS = {
+    "TEMP": ("Temperature", "C", 2),
+    "HUMIDITY": ("Humidity", "%", 2),
+    "PRESSURE": ("Pressure", "mmHg", 2),
+    "UV": ("UV Intensity", "mW/cm2", 2),
+    "NO2": ("NO2", "ppm", 3),
+    "C2H5OH": ("C2H5OH", "ppm", 3),
+    "VOC": ("VOC", "ppm", 3),
+    "CO": ("CO", "ppm", 3),
+    "CPM": ("CPM", "", 0),
+    "USVH": ("Radiation (uSv/h)", "uSv/h", 2),
+}
+FIELDS = tuple(FIELD_SPECS)
+FIELD_INDEX = {key: i for i, key in enumerate(FIELDS)}
+INTEGER_FIELDS = frozenset({"CPM"})
+DEFAULT_UNITS = tuple(spec[1] for spec in FIELD_SPECS.values())
+
+class WioReading:
+    """One parsed Wio data block. Values live in a float array indexed like FIELDS (NaN = missing)."""
+    __slots__ = ("rpi_ts", "values", "units", "extras", "errors")
+
+    def __init__(self, rpi_ts=None):
+        self.rpi_ts = rpi_ts if rpi_ts is not None else time.time()  # Pi clock when START_DATA arrived
+        self.values = array('d', [math.nan]) * len(FIELDS)
+        self.units = DEFAULT_UNITS   # Replaced by a per-reading tuple only if the Wio reports other units
+        self.extras = None           # Unknown keys, kept as raw text
+        self.errors = None           # Malformed lines seen inside this block
+
+    @property
+    def rpi_timestamp(self):
+        return datetime.datetime.fromtimestamp(self.rpi_ts).isoformat()
+
+    def __len__(self):
+        return sum(1 for v in self.values if not math.isnan(v)) + (len(self.extras) if self.extras else 0)
+
+    def get(self, key, default=None):
+        idx = FIELD_INDEX.get(key)
+        if idx is None:
+            return self.extras.get(key, default) if self.extras else default
+        value = self.values[idx]
+        if math.isnan(value):
+            return default
+        return int(value) if key in INTEGER_FIELDS else value
+
+    def items(self):
+        """Yields (key, value, unit) for every field present in the block."""
+        for idx, key in enumerate(FIELDS):
+            value = self.values[idx]
+            if not math.isnan(value):
+                yield key, (int(value) if key in INTEGER_FIELDS else value), self.units[idx]
+
+    def format_value(self, key, value, unit):
+        decimals = FIELD_SPECS[key][2]
+        text = f"{value:.{decimals}f}"
+        return f"{text} {unit}" if unit else text
+
+    def as_mqtt_payload(self):
+        """Flat dict with lowercase keys, the format published to MQTT_TOPIC."""
+        payload = {"rpi_timestamp": self.rpi_timestamp}
+        for key, value, _unit in self.items():
+            payload[key.lower()] = value
+        if self.extras:
+            for key, text in self.extras.items():
+                payload[key.lower()] = text
+        return payload
+
+    def as_text_lines(self):
+        """Human-readable "Label: value unit" lines, as sent over Meshtastic text messages."""
+        lines = [f"Timestamp: {self.rpi_timestamp}"]
+        for key, value, unit in self.items():
+            lines.append(f"{FIELD_SPECS[key][0]}: {self.format_value(key, value, unit)}")
+        if self.extras:
+            for key, text in self.extras.items():
+                lines.append(f"{key}: {text}")
+        return lines
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={v}" for k, v, _u in self.items())
+        return f"WioReading({self.rpi_timestamp}, {fields})"
+
+class WioFrameParser:
+    """Incremental parser for the START_DATA/END_DATA serial protocol.
+
+    feed() accepts raw bytes in chunks of any size and returns the WioReading objects for
+    every block completed by that chunk. Problems are reported through `on_error(kind, details)`
+    and counted in `stats`: 'malformed_line' (also non-finite values such as "inf", which stay
+    missing), 'truncated_block' (START_DATA before END_DATA), 'orphan_end' (END_DATA without
+    START_DATA), 'empty_block' and 'oversized_line'.
+    """
+    def __init__(self, on_error=None, max_line_length=4096):
+        self.on_error = on_error
+        self.max_line_length = max_line_length
+        self.stats = {"blocks": 0, "malformed_line": 0, "truncated_block": 0, "orphan_end": 0,
+                      "empty_block": 0, "oversized_line": 0, "ignored_lines": 0}
+        self._pending = bytearray()
+        self._current = None
+
+    def _report(self, kind, details):
+        self.stats[kind] += 1
+        if DEBUG: print(f"Wio Parser: {kind} {details}")
+        if self.on_error:
+            self.on_error(kind, details)
+
+    def reset(self):
+        """Drops any partial line or block, e.g. after the serial port was reopened."""
+        self._pending.clear()
+        self._current = None
+
+    def feed(self, data):
+        """Consumes raw serial bytes and returns a list of completed readings."""
+        pending = self._pending
+        pending += data
+        completed = []
+        start = 0
+        while True:
+            end = pending.find(b'\n', start)
+            if end < 0:
+                break
+            line = pending[start:end].decode('utf-8', errors='ignore').strip()
+            start = end + 1
+            if line:
+                reading = self.feed_line(line)
+                if reading is not None:
+                    completed.append(reading)
+        if start:
+            del pending[:start]
+        if len(pending) > self.max_line_length:
+            self._report("oversized_line", {"length": len(pending)})
+            pending.clear()
+        return completed
+
+    def feed_line(self, line):
+        """Processes one already-decoded line; returns a WioReading when it closes a block."""
+        if line == "START_DATA":
+            if self._current is not None:
+                self._report("truncated_block", {"fields_parsed": len(self._current)})
+            self._current = WioReading()
+            return None
+
+        if line == "END_DATA":
+            reading = self._current
+            self._current = None
+            if reading is None:
+                self._report("orphan_end", {})
+                return None
+            if not len(reading):
+                self._report("empty_block", {"errors": reading.errors})
+                return None
+            self.stats["blocks"] += 1
+            return reading
+
+        reading = self._current
+        if reading is None:
+            # Boot messages and calibration output outside a block
+            self.stats["ignored_lines"] += 1
+            return None
+
+        key, sep, rest = line.partition(':')
+        key = key.strip()
+        if not sep or not key:
+            self._add_error(reading, line)
+            return None
+        if key == "TIMESTAMP":
+            # The Wio RTC timestamp is ignored; the Pi clock (rpi_ts) is authoritative
+            return None
+
+        rest = rest.strip()
+        idx = FIELD_INDEX.get(key)
+        if idx is None:
+            if reading.extras is None:
+                reading.extras = {}
+            reading.extras[key] = rest
+            return None
+
+        value_str, _, unit = rest.partition(' ')
+        try:
+            value = float(value_str)
+        except ValueError:
+            self._add_error(reading, line)
+            return None
+        if not math.isfinite(value):  # "inf", "nan", "1e400": would reach JSON and the window stats
+            self._add_error(reading, line)
+            return None
+        reading.values[idx] = value
+        unit = unit.strip()
+        if unit and unit != reading.units[idx]:
+            units = list(reading.units)
+            units[idx] = unit
+            reading.units = tuple(units)
+        return None
+
+    def _add_error(self, reading, line):
+        if reading.errors is None:
+            reading.errors = []
+        reading.errors.append(line)
+        self._report("malformed_line", {"line": line[:150]})
+
+BATCH_FORMATS = ("array", "columnar")
+
+def build_batch_payload(readings, batch_format="array"):
+    """Combines several readings into one MQTT message body.
+
+    "array":    {"format": "array", "count": n, "readings": [<as_mqtt_payload()>, ...]}
+    "columnar": {"format": "columnar", "count": n, "rpi_ts": [epoch, ...], "temp": [...], ...}
+                with one list per field (None where a block lacked the field). Smaller on the
+                wire because keys are not repeated for every reading.
+    """
+    if batch_format == "array":
+        return {"format": "array", "count": len(readings), "readings": [r.as_mqtt_payload() for r in readings]}
+    if batch_format != "columnar":
+        raise ValueError(f"Unknown batch format: {batch_format}")
+    payload = {"format": "columnar", "count": len(readings), "rpi_ts": [round(r.rpi_ts, 3) for r in readings]}
+    for idx, key in enumerate(FIELDS):
+        column = []
+        present = False
+        for r in readings:
+            value = r.values[idx]
+            if math.isnan(value):
+                column.append(None)
+            else:
+                present = True
+                column.append(int(value) if key in INTEGER_FIELDS else value)
+        if present:
+            payload[key.lower()] = column
+    return payload
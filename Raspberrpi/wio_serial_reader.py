@@ -0,0 +1,200 @@
+import time
+import threading
+import queue
+import serial
+from wio_frame_parser import WioFrameParser
+
+DEBUG = False  # Set to True for verbose debug output
+
+class WioSerialReader(threading.Thread):
+    """Background thread that reads the Wio Terminal serial port and queues parsed readings.
+
+    The thread blocks inside the serial driver until bytes arrive (bounded by the port's
+    read timeout), pulls everything that is waiting in one bulk read and hands it to a
+    WioFrameParser. Each completed block is queued once as a WioReading; consumers call
+    `get_frame()` instead of polling `in_waiting`.
+    """
+    def __init__(self, ser, parser=None, max_queued_frames=600):
+        super().__init__(name="WioSerialReader", daemon=True)
+        self.ser = ser
+        self.parser = parser if parser is not None else WioFrameParser()
+        self.frames = queue.Queue(maxsize=max_queued_frames)
+        self.error = None          # Set to the exception that stopped the thread (serial error or unexpected), if any
+        self.dropped_frames = 0    # Readings discarded because the consumer fell behind
+        self.bytes_read = 0
+        self._stop_event = threading.Event()
+
+    def stop(self, timeout=2.0):
+        """Asks the thread to exit and waits for it (the port read timeout bounds the wait)."""
+        self._stop_event.set()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def get_frame(self, timeout=None):
+        """Returns the next WioReading, or None on timeout or when the reader has stopped."""
+        try:
+            return self.frames.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _enqueue(self, frame):
+        try:
+            self.frames.put_nowait(frame)
+        except queue.Full:
+            # Drop the oldest reading so the newest data always gets through
+            try:
+                self.frames.get_nowait()
+            except queue.Empty:
+                pass
+            self.dropped_frames += 1
+            self.frames.put_nowait(frame)
+
+    def run(self):
+        if DEBUG: print(f"Wio Reader: Thread started on {getattr(self.ser, 'port', 'N/A')}.")
+        try:
+            while not self._stop_event.is_set():
+                # read(1) blocks until the first byte or the port timeout, then grab the rest in one go
+                chunk = self.ser.read(max(1, self.ser.in_waiting))
+                if not chunk:
+                    continue
+                self.bytes_read += len(chunk)
+                for reading in self.parser.feed(chunk):
+                    self._enqueue(reading)
+        except (serial.SerialException, OSError, TypeError) as e:
+            # pyserial raises TypeError/OSError when the port is closed underneath a blocking read
+            if not self._stop_event.is_set():
+                self.error = e
+        except Exception as e:
+            # Anything else (ValueError from select() on a closed fd, a parser bug) also ends the
+            # thread; record it so WioLink reconnects instead of reading from a dead reader
+            self.error = e
+            print(f"Wio Reader: Unexpected error, stopping: {e!r}")
+        finally:
+            # Wake up a consumer blocked in get_frame() so it notices the stop/error immediately
+            try:
+                self.frames.put_nowait(None)
+            except queue.Full:
+                pass
+            if DEBUG: print("Wio Reader: Thread stopped.")
+
+class WioLink:
+    """Wio Terminal connection that recovers from serial errors without leaving the caller's loop.
+
+    A small state machine around WioSerialReader: CONNECTED while a reader thread runs;
+    when it dies with a serial error the port is closed and the link goes to RECONNECTING,
+    where `connect()` is retried with exponential backoff and jitter (`backoff`, a
+    ReconnectBackoff). get_frame() keeps the caller's timing in both states, so the
+    Meshtastic/MQTT timers and their sessions carry on while the Wio is away. Readings already
+    queued by a failed reader are still returned, and only the partial block is discarded.
+
+    `connect()` returns an open serial port or None. `port_generation()`, if given, returns a
+    counter that changes when USB devices come or go (PortRegistry.generation); a change cuts
+    the current backoff wait short. `on_event(event_type, details)` receives state changes
+    for logging.
+    """
+    CONNECTED = "connected"
+    RECONNECTING = "reconnecting"
+
+    def __init__(self, ser, connect, backoff, parser=None, port_generation=None, on_event=None, max_queued_frames=600):
+        self.connect = connect
+        self.backoff = backoff
+        self.parser = parser if parser is not None else WioFrameParser()
+        self.port_generation = port_generation
+        self.on_event = on_event
+        self.max_queued_frames = max_queued_frames
+        self.ser = None
+        self.reader = None
+        self.state = self.RECONNECTING
+        self.next_attempt = 0.0
+        self.reconnects = 0
+        self.dropped_frames = 0  # Over all readers, including ones that have failed
+        self._backlog = []       # Readings left in a failed reader's queue
+        self._seen_generation = None
+        self._disconnected_since = None
+        if ser is not None:
+            self._attach(ser)
+
+    def _event(self, event_type, details):
+        if self.on_event:
+            self.on_event(event_type, details)
+
+    def _attach(self, ser):
+        self.ser = ser
+        self.parser.reset()  # A partial block from the previous connection can never complete
+        self.reader = WioSerialReader(ser, self.parser, self.max_queued_frames)
+        self.reader.start()
+        self.state = self.CONNECTED
+        self.backoff.reset()
+
+    def _detach(self, error):
+        reader = self.reader
+        reader.stop()
+        while True:
+            frame = reader.get_frame(timeout=0)
+            if frame is None:
+                if reader.frames.empty():
+                    break
+                continue  # The stop sentinel; more readings may follow it
+            self._backlog.append(frame)
+        self.dropped_frames += reader.dropped_frames
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+        port = getattr(self.ser, 'port', None)
+        self.reader = None
+        self.state = self.RECONNECTING
+        self._disconnected_since = time.time()
+        delay = self.backoff.next_delay()
+        self.next_attempt = self._disconnected_since + delay
+        self._seen_generation = self.port_generation() if self.port_generation else None
+        print(f"Wio Link: Serial error on {port}: {error}. Reconnecting in {delay:.1f}s.")
+        self._event("wio_serial_exception", {"error": str(error), "port": port, "action": "Reconnecting with backoff",
+                                             "retry_in_s": round(delay, 2), "kept_readings": len(self._backlog),
+                                             "dropped_frames": reader.dropped_frames})
+        return port
+
+    def _attempt(self, now):
+        ser = self.connect()
+        failed = self.backoff.attempts - 1  # The first backoff step is the wait after the link failed
+        if ser:
+            self.reconnects += 1
+            outage = now - self._disconnected_since if self._disconnected_since else 0.0
+            print(f"Wio Link: Reconnected on {getattr(ser, 'port', 'N/A')} after {outage:.1f}s ({failed} failed attempts).")
+            self._event("wio_reconnect_success", {"port": getattr(ser, 'port', None), "outage_s": round(outage, 1),
+                                                  "failed_attempts": failed})
+            self._attach(ser)
+            return
+        delay = self.backoff.next_delay()
+        self.next_attempt = time.time() + delay
+        if DEBUG: print(f"Wio Link: Reconnect attempt {failed + 1} failed. Next try in {delay:.1f}s.")
+        self._event("wio_reconnect_failed", {"attempt": failed + 1, "retry_in_s": round(delay, 2)})
+
+    def get_frame(self, timeout):
+        """The next WioReading, or None after at most `timeout` seconds in either state."""
+        if self._backlog:
+            return self._backlog.pop(0)
+        if self.state == self.CONNECTED:
+            frame = self.reader.get_frame(timeout=timeout)
+            if frame is None and (self.reader.error is not None or not self.reader.is_alive()):
+                self._detach(self.reader.error or RuntimeError("reader thread exited"))
+            return frame
+        now = time.time()
+        generation = self.port_generation() if self.port_generation else None
+        if now >= self.next_attempt or generation != self._seen_generation:
+            self._seen_generation = generation
+            self._attempt(now)
+            return None
+        # Nothing to read while disconnected: wait out the caller's timeout, or until the next attempt
+        time.sleep(max(0.0, min(timeout, self.next_attempt - now)))
+        return None
+
+    def close(self):
+        if self.reader:
+            self.reader.stop()
+            self.dropped_frames += self.reader.dropped_frames
+            self.reader = None
+        if self.ser and self.ser.is_open:
+            self.ser.close()
+            return True
+        return False
@@ -12,16 +12,55 @@ from paho import mqtt
 import datetime # Added for logging timestamps
 import base64 # Added for PSK decoding
 import traceback # Moved import traceback to the top
+from wio_serial_reader import WioLink
+from wio_frame_parser import WioFrameParser, build_batch_payload, BATCH_FORMATS
+from wio_compact_codec import encode_reading, COMPACT_PORTNUM
+from mqtt_outbox import MqttPublishPipeline, DurableOutbox
+from wio_aggregates import WindowAggregator
+from sensor_history import SensorHistory
+from log_writer import BackgroundLogWriter, FSYNC_POLICIES
+from serialization import make_serializable
+from port_registry import PortRegistry
+from backoff import ReconnectBackoff
 
 # --- Global Settings ---
 DEBUG = True  # Set to True for verbose debug output
 MQTT_TOPIC = "wio/environmental_station/data"
-LOG_FILE = None # Added for logging
+MESH_ENCODING = "text"  # "text": one sendText per sensor, "compact": whole reading in one PRIVATE_APP packet
+STATION_ID = 1  # Identifies this station in compact Meshtastic packets
+LOG_FILE = None # BackgroundLogWriter for the JSONL activity log
 LOG_FILENAME = None # Added for logging
+LOG_FLUSH_INTERVAL_S = 1.0 # Log writer: write queued entries at least this often
+LOG_FLUSH_SIZE = 200 # Log writer: or as soon as this many entries are queued
+LOG_FSYNC_POLICY = "interval" # Log writer: "never", "interval" or "always" (fsync after every batch)
+LOG_FSYNC_INTERVAL_S = 30.0 # Log writer: fsync period for the "interval" policy
+
+WIO_RECONNECT_BASE_S = 1.0 # First wait after the Wio serial link fails; doubles per failed attempt
+WIO_RECONNECT_MAX_S = 60.0 # Longest wait between Wio reconnect attempts
+WIO_RECONNECT_JITTER = 0.5 # Each wait is shortened by a random share of up to this much
+PORT_REGISTRY = None # PortRegistry: cached serial port list, refreshed when USB devices come and go
+_port_match_cache = {} # find_specific_device_port arguments -> (registry generation, result)
 
 # --- MQTT Client Setup ---
 mqtt_client = None
 mqtt_connected = False
+mqtt_pipeline = None # MqttPublishPipeline; publishes from a worker thread so the main loop never waits on PUBACKs
+MQTT_OUTBOX_MAX_QUEUED = 100 # Messages waiting to be published
+MQTT_MAX_IN_FLIGHT = 20 # Unacknowledged QoS1 messages allowed at once
+MQTT_OUTBOX_OVERFLOW = "drop_oldest" # "drop_oldest" or "block" when the outbox is full
+MQTT_OUTBOX_DB = os.path.join("logs", "mqtt_outbox.sqlite3") # Store-and-forward file for broker outages
+MQTT_OUTBOX_DB_MAX_ROWS = 100000 # Oldest stored messages are discarded beyond this
+MQTT_OUTBOX_DB_RETENTION_S = 7 * 24 * 3600 # Stored messages older than this are discarded
+MQTT_OUTBOX_DRAIN_BATCH = 20 # Stored messages published per drain step after reconnecting
+MQTT_OUTBOX_DRAIN_INTERVAL_S = 1.0 # Seconds between drain steps
+MESHTASTIC_SEND_INTERVAL_S = 300 # Meshtastic broadcast interval (and aggregation window)
+MQTT_SEND_INTERVAL_S = 150 # MQTT publish interval (and aggregation window)
+SEND_WINDOW_SUMMARIES = True # Send min/max/mean/stddev/last per channel for each interval instead of one snapshot block
+MQTT_BATCH_SIZE = 60 # Full-resolution mode: readings per MQTT message
+MQTT_BATCH_MAX_AGE_S = 60 # Full-resolution mode: publish a partial batch once its oldest reading is this old
+MQTT_BATCH_FORMAT = "array" # Full-resolution mode: "array" of readings or "columnar" lists per field
+SENSOR_HISTORY_CAPACITY = 24 * 3600 # Readings kept in memory (24 h at the Wio's 1 Hz); memory is fixed at startup
+sensor_history = None # SensorHistory; every reading, queryable by time range
 # Instead, use specific timers:
 last_meshtastic_sent_time = 0
 last_mqtt_sent_time = 0
@@ -44,6 +83,8 @@ def on_connect(client, userdata, flags, rc, properties=None):
 def on_publish(client, userdata, mid, properties=None):
     if DEBUG: print(f"MQTT: Published message with mid {mid}")
     log_activity("mqtt_published_ack", {"client_id": client._client_id.decode() if client._client_id else "Unknown", "message_id": mid})
+    if mqtt_pipeline:
+        mqtt_pipeline.on_publish(mid)
 
 def on_disconnect(client, userdata, rc, properties=None):
     global mqtt_connected
@@ -92,7 +133,9 @@ def setup_mqtt_client():
         
         if DEBUG: print(f"MQTT: Attempting to connect to broker at {cluster_url}:8883")
         log_activity("mqtt_connect_attempt", {"cluster_url": cluster_url, "port": 8883, "client_id":"wio_to_meshtastic_bridge"})
-        client.connect(cluster_url, 8883)
+        # connect_async + loop_start keeps retrying in the background, so a station that boots
+        # without uplink still gets an MQTT session (and drains its outbox) once the link returns
+        client.connect_async(cluster_url, 8883)
         client.loop_start()
         # Connection status is handled by on_connect callback, which can also log
         return client
@@ -105,61 +148,50 @@ def setup_mqtt_client():
 # --- End MQTT Client Setup ---
 
 # --- Logging Setup ---
-def make_serializable(obj):
-    """Recursively make objects JSON serializable."""
-    if isinstance(obj, dict):
-        return {k: make_serializable(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [make_serializable(item) for item in obj]
-    elif isinstance(obj, tuple):
-        return tuple(make_serializable(item) for item in obj)
-    elif isinstance(obj, bytes):
-        return obj.hex()  # Convert bytes to hex string
-    elif isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
-        return obj.isoformat()
-    elif hasattr(obj, '__dict__'):
-        # Fallback for objects, trying to get their __dict__
-        # Be cautious with this, as it might expose too much or fail for complex objects
-        try:
-            return make_serializable(obj.__dict__)
-        except RecursionError: # Protect against objects that might reference themselves or cause deep recursion
-            return f"UNSERIALIZABLE_OBJECT_RECURSION:{str(type(obj))}"
-        except Exception:
-             return f"UNSERIALIZABLE_OBJECT:{str(type(obj))}"
-    else:
-        try:
-            # For basic types that are already serializable or can be converted to string
-            if isinstance(obj, (str, int, float, bool, type(None))):
-                return obj
-            return str(obj)
-        except Exception:
-            return f"UNSERIALIZABLE_TYPE:{str(type(obj))}"
+def format_log_entry(entry):
+    """Turns a queued (time, event_type, details) record into a JSONL line. Runs on the log writer thread."""
+    ts, event_type, details = entry
+    log_entry = {
+        'timestamp': datetime.datetime.fromtimestamp(ts).isoformat(),
+        'event_type': event_type,
+        'details': make_serializable(details) # Ensure details are serializable
+    }
+    return json.dumps(log_entry)
 
 def log_activity(event_type: str, details: dict):
-    """Logs an activity to the global log file."""
+    """Logs an activity to the global log file.
+
+    Only queues the record; serialization and disk writes happen on the BackgroundLogWriter thread.
+    """
     global LOG_FILE, DEBUG
     if not LOG_FILE:
         if DEBUG: print(f"Log Activity Error: Log file not initialized. Event: {event_type}")
         return
 
-    try:
-        now_dt = datetime.datetime.now()
-        log_entry = {
-            'timestamp': now_dt.isoformat(),
-            'event_type': event_type,
-            'details': make_serializable(details) # Ensure details are serializable
-        }
-        json_log_entry = json.dumps(log_entry)
-        LOG_FILE.write(json_log_entry + "\n")
-        LOG_FILE.flush() # Flush after each write
-    except Exception as e:
-        print(f"[CRITICAL LOG ERROR] Failed to write log entry. Event: {event_type}, Error: {e}")
-        if DEBUG: import traceback; traceback.print_exc()
+    if not LOG_FILE.write_line((time.time(), event_type, details)) and DEBUG:
+        print(f"Log Activity Warning: Log queue full, dropped event {event_type}")
+
+def on_wio_parse_error(kind, details):
+    """WioFrameParser error callback (runs on the Wio reader thread)."""
+    if kind == "truncated_block":
+        print("Warning: START_DATA received before END_DATA. Previous Wio block discarded.")
+    elif kind == "orphan_end":
+        print("Warning: END_DATA received without START_DATA.")
+    log_activity("wio_data_warning", {"warning": kind, **details})
 # --- End Logging Setup ---
 
+def current_serial_ports():
+    """The serial ports from PORT_REGISTRY, or a fresh enumeration before it exists."""
+    return PORT_REGISTRY.ports() if PORT_REGISTRY else list(serial.tools.list_ports.comports())
+
+def on_serial_ports_changed(added, removed):
+    """PortRegistry callback (watcher thread): a USB serial device was plugged in or removed."""
+    print(f"Serial: Ports changed - added {added}, removed {removed}")
+    log_activity("serial_ports_changed", {"added": added, "removed": removed})
+
 def list_available_serial_ports():
     """Lists all available serial ports with their descriptions."""
-    ports = list(serial.tools.list_ports.comports())
+    ports = current_serial_ports()
     if not ports:
         print("Serial: No serial ports detected on this system.")
         return []
@@ -169,10 +201,25 @@ def list_available_serial_ports():
     return ports
 
 def find_specific_device_port(device_name, keywords, vid_pid_pairs=None, exclude_port=None, target_device_path=None, target_description=None):
-    """Finds a specific device port based on keywords, VID/PID, and a specific target path/description."""
+    """Finds a specific device port based on keywords, VID/PID, and a specific target path/description.
+
+    With PORT_REGISTRY running, the answer is reused until the set of serial ports changes.
+    """
     if vid_pid_pairs is None:
         vid_pid_pairs = []
-    ports = list(serial.tools.list_ports.comports())
+    if not PORT_REGISTRY:
+        return _match_device_port(current_serial_ports(), device_name, keywords, vid_pid_pairs, exclude_port, target_device_path, target_description)
+    key = (device_name, tuple(keywords), tuple(vid_pid_pairs), exclude_port, target_device_path, target_description)
+    generation = PORT_REGISTRY.generation
+    cached = _port_match_cache.get(key)
+    if cached and cached[0] == generation:
+        if DEBUG: print(f"Serial: Reusing port match for {device_name}: {cached[1]} (no USB changes since)")
+        return cached[1]
+    result = _match_device_port(PORT_REGISTRY.ports(), device_name, keywords, vid_pid_pairs, exclude_port, target_device_path, target_description)
+    _port_match_cache[key] = (generation, result)
+    return result
+
+def _match_device_port(ports, device_name, keywords, vid_pid_pairs, exclude_port, target_device_path, target_description):
     found_ports = []
 
     # Stage 0: Check for specific target device path and description if provided (highest priority)
@@ -263,6 +310,7 @@ def connect_meshtastic(cli_port=None, wio_port=None):
             try:
                 iface = meshtastic.serial_interface.SerialInterface(devPath=cli_port)
                 print(f"Meshtastic: Successfully connected to node {iface.myInfo.my_node_num} on specified port {cli_port}.")
+                if PORT_REGISTRY: PORT_REGISTRY.remember("Meshtastic Device", cli_port)
                 log_activity("meshtastic_connect_success_cli", {"port": cli_port, "node_num": iface.myInfo.my_node_num, "node_info": make_serializable(iface.myInfo)})
                 return iface
             except Exception as e:
@@ -270,6 +318,18 @@ def connect_meshtastic(cli_port=None, wio_port=None):
                 log_activity("meshtastic_connect_error_cli", {"port": cli_port, "error": str(e)})
                 # Fall through if specified port fails
 
+    # The USB device Meshtastic was on last time, at its current path
+    known_port = PORT_REGISTRY.lookup("Meshtastic Device") if PORT_REGISTRY else None
+    if known_port and known_port != wio_port and known_port != cli_port:
+        try:
+            print(f"Meshtastic: Attempting connection to previously used device at {known_port}")
+            iface = meshtastic.serial_interface.SerialInterface(devPath=known_port)
+            print(f"Meshtastic: Successfully connected to node {iface.myInfo.my_node_num} on {known_port}.")
+            log_activity("meshtastic_connect_success_known", {"port": known_port, "node_num": iface.myInfo.my_node_num})
+            return iface
+        except Exception as e:
+            print(f"Meshtastic Error: Could not connect on previously used device {known_port}: {e}")
+
     # Auto-detection: Pass target path and description to find_specific_device_port
     print(f"Meshtastic: Searching for device (Target: {TARGET_MESH_PATH} - '{TARGET_MESH_DESC}')...")
     log_activity("meshtastic_connect_autodetect_start", {"excluded_port": wio_port, "target_path": TARGET_MESH_PATH, "target_desc": TARGET_MESH_DESC})
@@ -287,6 +347,7 @@ def connect_meshtastic(cli_port=None, wio_port=None):
             print(f"Meshtastic: Attempting connection to auto-detected/targeted port: {auto_detected_port}")
             iface = meshtastic.serial_interface.SerialInterface(devPath=auto_detected_port)
             print(f"Meshtastic: Successfully connected to node {iface.myInfo.my_node_num} on {auto_detected_port}.")
+            if PORT_REGISTRY: PORT_REGISTRY.remember("Meshtastic Device", auto_detected_port)
             log_activity("meshtastic_connect_success_auto", {"port": auto_detected_port, "node_num": iface.myInfo.my_node_num, "node_info": make_serializable(iface.myInfo)})
             return iface
         except Exception as e:
@@ -316,12 +377,25 @@ def connect_wio_terminal(cli_port=None):
         try:
             ser = serial.Serial(cli_port, 115200, timeout=1)
             print(f"Wio Terminal: Successfully connected on specified port {cli_port}.")
+            if PORT_REGISTRY: PORT_REGISTRY.remember("Wio Terminal", cli_port)
             log_activity("wio_connect_success_cli", {"port": cli_port})
             return ser
         except serial.SerialException as e:
             print(f"Wio Terminal Error: Could not connect on specified port {cli_port}: {e}")
             log_activity("wio_connect_error_cli", {"port": cli_port, "error": str(e)})
 
+    # The USB device the Wio Terminal was on last time (e.g. before a reset), at its current path
+    known_port = PORT_REGISTRY.lookup("Wio Terminal") if PORT_REGISTRY else None
+    if known_port and known_port != cli_port:
+        try:
+            print(f"Wio Terminal: Attempting connection to previously used device at {known_port}")
+            ser = serial.Serial(known_port, 115200, timeout=1)
+            print(f"Wio Terminal: Successfully connected on {known_port}.")
+            log_activity("wio_connect_success_known", {"port": known_port})
+            return ser
+        except serial.SerialException as e:
+            print(f"Wio Terminal Error: Could not connect on previously used device {known_port}: {e}")
+
     print(f"Wio Terminal: Searching for device (Target: {TARGET_WIO_PATH} - '{TARGET_WIO_DESC}')...")
     log_activity("wio_connect_autodetect_start", {"target_path": TARGET_WIO_PATH, "target_desc": TARGET_WIO_DESC})
     auto_detected_port = find_specific_device_port(
@@ -337,6 +411,7 @@ def connect_wio_terminal(cli_port=None):
             print(f"Wio Terminal: Attempting connection to auto-detected/targeted port: {auto_detected_port}")
             ser = serial.Serial(auto_detected_port, 115200, timeout=1)
             print(f"Wio Terminal: Successfully connected on {auto_detected_port}.")
+            if PORT_REGISTRY: PORT_REGISTRY.remember("Wio Terminal", auto_detected_port)
             return ser
         except serial.SerialException as e:
             print(f"Wio Terminal Error: Could not connect on auto-detected/targeted port {auto_detected_port}: {e}")
@@ -346,117 +421,126 @@ def connect_wio_terminal(cli_port=None):
     return None
 
 # NEW function to handle only Meshtastic sending
-def send_data_to_meshtastic(data_lines, mesh_interface):
+def send_data_to_meshtastic(reading, mesh_interface):
     if not mesh_interface:
         if DEBUG: print("Meshtastic: Interface not available. Skipping send.")
-        log_activity("meshtastic_send_skipped", {"reason": "Interface not available", "num_data_lines": len(data_lines) if data_lines else 0})
+        log_activity("meshtastic_send_skipped", {"reason": "Interface not available", "num_fields": len(reading) if reading else 0})
         return
 
-    if not data_lines:
-        if DEBUG: print("Meshtastic: No data lines to send.")
-        log_activity("meshtastic_send_skipped", {"reason": "No data lines provided"})
+    if not reading:
+        if DEBUG: print("Meshtastic: No data to send.")
+        log_activity("meshtastic_send_skipped", {"reason": "No reading provided"})
         return
 
-    log_activity("meshtastic_send_batch_start", {"num_data_lines": len(data_lines)})
-    label_map = {
-        "RPI_TIMESTAMP": "Timestamp", # MODIFIED: Use RPI_TIMESTAMP
-        "TEMP": "Temperature", "HUMIDITY": "Humidity",
-        "PRESSURE": "Pressure", "UV": "UV Intensity", "NO2": "NO2",
-        "C2H5OH": "C2H5OH", "VOC": "VOC", "CO": "CO", "CPM": "CPM",
-        "USVH": "Radiation (uSv/h)"
-    }
+    if MESH_ENCODING == "compact":
+        send_compact_reading_to_meshtastic(reading, mesh_interface)
+        return
 
-    for line in data_lines:
-        parts = line.split(':', 1)
-        if len(parts) == 2:
-            key = parts[0].strip()
-            value_and_unit = parts[1].strip()
-            label = label_map.get(key, key)
-            message = f"{label}: {value_and_unit}"
-            try:
-                if DEBUG: print(f"Meshtastic: Sending to channel 1: {message}")
-                mesh_interface.sendText(message, channelIndex=1)
-                log_activity("meshtastic_send_text_success", {"message": message, "channel_index_attempted": 1, "node_id": mesh_interface.myInfo.my_node_num if hasattr(mesh_interface, 'myInfo') else 'Unknown'})
-                time.sleep(0.5) # Keep a small delay between messages
-            except Exception as e:
-                print(f"Meshtastic: Error sending message '{message}': {e}")
-                log_activity("meshtastic_send_text_error", {"message": message, "error": str(e)})
-        else:
-            if DEBUG: print(f"Meshtastic Parser: Could not parse line for Meshtastic: {line}")
-            log_activity("meshtastic_parse_line_error", {"line": line})
+    messages = reading.as_text_lines()
+    log_activity("meshtastic_send_batch_start", {"num_data_lines": len(messages)})
+    for message in messages:
+        try:
+            if DEBUG: print(f"Meshtastic: Sending to channel 1: {message}")
+            mesh_interface.sendText(message, channelIndex=1)
+            log_activity("meshtastic_send_text_success", {"message": message, "channel_index_attempted": 1, "node_id": mesh_interface.myInfo.my_node_num if hasattr(mesh_interface, 'myInfo') else 'Unknown'})
+            time.sleep(0.5) # Keep a small delay between messages
+        except Exception as e:
+            print(f"Meshtastic: Error sending message '{message}': {e}")
+            log_activity("meshtastic_send_text_error", {"message": message, "error": str(e)})
     log_activity("meshtastic_send_batch_complete", {})
 
+def send_compact_reading_to_meshtastic(reading, mesh_interface):
+    """Sends the whole reading as one binary packet on PRIVATE_APP, channel 1."""
+    try:
+        payload = encode_reading(reading, STATION_ID)
+        if DEBUG: print(f"Meshtastic: Sending compact reading ({len(payload)} bytes) to channel 1 on portnum {COMPACT_PORTNUM}")
+        mesh_interface.sendData(payload, portNum=COMPACT_PORTNUM, channelIndex=1)
+        log_activity("meshtastic_send_compact_success", {"payload_hex": payload.hex(), "payload_size": len(payload), "station_id": STATION_ID, "channel_index_attempted": 1})
+    except Exception as e:
+        print(f"Meshtastic: Error sending compact reading: {e}")
+        log_activity("meshtastic_send_compact_error", {"error": str(e), "station_id": STATION_ID})
+
 # NEW function to handle only MQTT publishing
-def publish_data_to_mqtt(data_lines, mqtt_client_instance):
+def publish_data_to_mqtt(reading, mqtt_client_instance):
     global mqtt_connected # Needs to know if client is connected
 
-    if not mqtt_client_instance:
+    if not mqtt_client_instance or not mqtt_pipeline:
         if DEBUG: print("MQTT: Client not initialized. Skipping publish.")
-        log_activity("mqtt_publish_skipped", {"reason": "Client not initialized", "num_data_lines": len(data_lines) if data_lines else 0})
+        log_activity("mqtt_publish_skipped", {"reason": "Client not initialized", "num_fields": len(reading) if reading else 0})
         return
     
-    if not mqtt_connected:
+    if not mqtt_connected and mqtt_pipeline.store is None:
         if DEBUG: print("MQTT: Client not connected. Skipping publish.")
-        log_activity("mqtt_publish_skipped", {"reason": "Client not connected", "num_data_lines": len(data_lines) if data_lines else 0})
+        log_activity("mqtt_publish_skipped", {"reason": "Client not connected", "num_fields": len(reading) if reading else 0})
         return
 
-    if not data_lines:
-        if DEBUG: print("MQTT: No data lines to publish.")
-        log_activity("mqtt_publish_skipped", {"reason": "No data lines provided"})
+    if not reading:
+        if DEBUG: print("MQTT: No data to publish.")
+        log_activity("mqtt_publish_skipped", {"reason": "No reading provided"})
         return
 
-    mqtt_payload = {}
-    for line in data_lines:
-        parts = line.split(':', 1)
-        if len(parts) == 2:
-            key = parts[0].strip().lower() # Ensure lowercase keys for MQTT
-            value_and_unit = parts[1].strip()
-            value_str = value_and_unit.split(' ')[0]
-            try:
-                if '.' in value_str:
-                    mqtt_payload[key] = float(value_str)
-                else:
-                    mqtt_payload[key] = int(value_str)
-            except ValueError:
-                if key == "rpi_timestamp": # MODIFIED: Check for rpi_timestamp for MQTT
-                    mqtt_payload[key] = value_and_unit
-                else: # Other non-numeric values
-                    mqtt_payload[key] = value_and_unit # Store as is
-        else:
-            if DEBUG: print(f"MQTT Parser: Could not parse line for MQTT: {line}")
-            log_activity("mqtt_parse_line_error", {"line": line})
+    queue_mqtt_payload(reading.as_mqtt_payload())
 
-    if mqtt_payload:
-        try:
-            json_payload = json.dumps(mqtt_payload)
-            if DEBUG: print(f"MQTT: Publishing to {MQTT_TOPIC}: {json_payload}")
-            result = mqtt_client_instance.publish(MQTT_TOPIC, json_payload, qos=1)
-            log_activity("mqtt_publish_attempt", {"topic": MQTT_TOPIC, "payload_keys": list(mqtt_payload.keys()), "qos": 1})
-            result.wait_for_publish(timeout=5) # Wait for publish confirmation
-            if result.rc == paho.MQTT_ERR_SUCCESS:
-                 if DEBUG: print(f"MQTT: Successfully published message mid {result.mid}")
-                 # on_publish callback will also log MQTT_ERR_SUCCESS
-            else:
-                print(f"MQTT: Failed to publish message. Result code: {result.rc}")
-                log_activity("mqtt_publish_failed_after_wait", {"topic": MQTT_TOPIC, "result_code": result.rc, "message_id": result.mid})
-        except Exception as e:
-            print(f"MQTT: Error publishing message: {e}")
-            log_activity("mqtt_publish_exception", {"topic": MQTT_TOPIC, "error": str(e), "traceback": traceback.format_exc() if DEBUG else "Set DEBUG for traceback"})
-    else:
-        if DEBUG: print("MQTT: Payload was empty after parsing. Nothing to publish.")
-        log_activity("mqtt_publish_skipped", {"reason": "Empty payload after parsing", "num_data_lines": len(data_lines)})
+def publish_batch_to_mqtt(readings, mqtt_client_instance, batch_format="array"):
+    """Full-resolution mode: publishes several readings as one MQTT message."""
+    if not mqtt_client_instance or not mqtt_pipeline:
+        if DEBUG: print("MQTT: Client not initialized. Skipping batch publish.")
+        log_activity("mqtt_publish_skipped", {"reason": "Client not initialized", "num_readings": len(readings)})
+        return
+
+    if not mqtt_connected and mqtt_pipeline.store is None:
+        if DEBUG: print("MQTT: Client not connected. Skipping batch publish.")
+        log_activity("mqtt_publish_skipped", {"reason": "Client not connected", "num_readings": len(readings)})
+        return
+
+    if not readings:
+        return
+
+    queue_mqtt_payload(build_batch_payload(readings, batch_format))
+
+def queue_mqtt_payload(mqtt_payload):
+    """Serializes a payload and hands it to the MQTT outbox."""
+    try:
+        json_payload = json.dumps(mqtt_payload)
+        if DEBUG: print(f"MQTT: Queueing publish to {MQTT_TOPIC}: {json_payload}")
+        # The pipeline publishes and tracks the PUBACK on its own thread; on_publish logs the ack.
+        # While the broker is unreachable it writes the message to the on-disk outbox instead.
+        queued = mqtt_pipeline.submit(MQTT_TOPIC, json_payload, qos=1)
+        log_activity("mqtt_publish_attempt", {"topic": MQTT_TOPIC, "payload_keys": list(mqtt_payload.keys()), "qos": 1, "queued": queued})
+        if not queued:
+            print("MQTT: Outbox full. Message dropped.")
+    except Exception as e:
+        print(f"MQTT: Error publishing message: {e}")
+        log_activity("mqtt_publish_exception", {"topic": MQTT_TOPIC, "error": str(e), "traceback": traceback.format_exc() if DEBUG else "Set DEBUG for traceback"})
 
 def main():
-    global mqtt_client, LOG_FILE, LOG_FILENAME
+    global mqtt_client, mqtt_pipeline, LOG_FILE, LOG_FILENAME
     global last_meshtastic_sent_time, last_mqtt_sent_time, latest_complete_data_block
     global last_wio_data_block_update_time, last_wio_raw_print_time
     global currently_printing_raw_block # ADDED: Make new flag global
+    global MESH_ENCODING, STATION_ID, sensor_history, PORT_REGISTRY
 
     parser = argparse.ArgumentParser(description="Reads sensor data from Wio Terminal, broadcasts via Meshtastic, and publishes to MQTT.")
     parser.add_argument('--wio_port', help='Specify the Wio Terminal serial port (e.g., COM3 or /dev/ttyACM1)')
     parser.add_argument('--mesh_port', help='Specify the Meshtastic device serial port (e.g., COM4 or /dev/ttyACM0)')
+    parser.add_argument('--mesh_encoding', choices=['text', 'compact'], default=MESH_ENCODING, help='Meshtastic payload format: one text message per sensor, or one compact binary packet per reading')
+    parser.add_argument('--mqtt_overflow', choices=['drop_oldest', 'block'], default=MQTT_OUTBOX_OVERFLOW, help='What to do when the MQTT outbox is full: drop the oldest queued message or block the main loop briefly')
+    parser.add_argument('--outbox_db', default=MQTT_OUTBOX_DB, help='SQLite file that keeps MQTT messages during broker outages (empty string disables it)')
+    parser.add_argument('--mesh_interval', type=float, default=MESHTASTIC_SEND_INTERVAL_S, help='Seconds between Meshtastic broadcasts')
+    parser.add_argument('--mqtt_interval', type=float, default=MQTT_SEND_INTERVAL_S, help='Seconds between MQTT publishes (ignored with --full_resolution)')
+    parser.add_argument('--snapshot_only', action='store_true', help='Send the latest single data block on each timer instead of window summaries')
+    parser.add_argument('--full_resolution', action='store_true', help='Publish every Wio reading to MQTT in batched messages instead of one snapshot every 2.5 minutes')
+    parser.add_argument('--mqtt_batch_size', type=int, default=MQTT_BATCH_SIZE, help='Full-resolution mode: readings per MQTT message')
+    parser.add_argument('--mqtt_batch_age', type=float, default=MQTT_BATCH_MAX_AGE_S, help='Full-resolution mode: maximum seconds a reading waits before its batch is published')
+    parser.add_argument('--mqtt_batch_format', choices=BATCH_FORMATS, default=MQTT_BATCH_FORMAT, help='Full-resolution mode: array of readings or columnar lists per field')
+    parser.add_argument('--log_fsync', choices=FSYNC_POLICIES, default=LOG_FSYNC_POLICY, help='When the activity log is fsynced to disk: never, every LOG_FSYNC_INTERVAL_S seconds, or after every batch')
+    parser.add_argument('--history_capacity', type=int, default=SENSOR_HISTORY_CAPACITY, help='Readings kept in the in-memory sensor history ring (0 disables it)')
+    parser.add_argument('--station_id', type=int, default=STATION_ID, help='Station id (0-65535) embedded in compact Meshtastic packets')
     args = parser.parse_args()
 
+    MESH_ENCODING = args.mesh_encoding
+    STATION_ID = args.station_id
+
     # --- Log File Setup ---
     log_dir = "logs"
     if not os.path.exists(log_dir):
@@ -470,19 +554,32 @@ def main():
     if os.path.exists(log_dir): # Proceed only if log_dir exists or was created
         LOG_FILENAME = os.path.join(log_dir, f"wio_meshtastic_bridge_log_{datetime.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.jsonl")
         try:
-            LOG_FILE = open(LOG_FILENAME, "a", encoding="utf-8")
-            print(f"Logging activity to: {LOG_FILENAME}")
+            LOG_FILE = BackgroundLogWriter(
+                open(LOG_FILENAME, "a", encoding="utf-8"),
+                flush_interval=LOG_FLUSH_INTERVAL_S,
+                flush_size=LOG_FLUSH_SIZE,
+                fsync_policy=args.log_fsync,
+                fsync_interval=LOG_FSYNC_INTERVAL_S,
+                formatter=format_log_entry,
+                name="ActivityLogWriter",
+            )
+            print(f"Logging activity to: {LOG_FILENAME} (fsync policy: {args.log_fsync})")
             log_activity("script_start", {"args": vars(args), "debug_mode": DEBUG})
         except IOError as e:
             print(f"[ERROR] Could not open log file '{LOG_FILENAME}': {e}. File logging disabled.")
             LOG_FILE = None # Ensure LOG_FILE is None if open failed
     # --- End Log File Setup ---
 
+    # Serial port list shared by the connect functions, refreshed on USB hotplug instead of per lookup
+    PORT_REGISTRY = PortRegistry(on_change=on_serial_ports_changed)
+    PORT_REGISTRY.start()
+
     # Enhanced connection logic
     wio_ser = connect_wio_terminal(args.wio_port)
     wio_connected_port = None # Initialize here
     if not wio_ser:
         print("Wio Terminal connection failed. Please check the device and suggestions above. Exiting.")
+        PORT_REGISTRY.stop()
         return
     else:
         wio_connected_port = wio_ser.port # Get port if connection successful
@@ -557,6 +654,27 @@ def main():
 
     mqtt_client = setup_mqtt_client()
     if mqtt_client:
+        outbox_store = None
+        if args.outbox_db:
+            try:
+                outbox_store = DurableOutbox(args.outbox_db, max_rows=MQTT_OUTBOX_DB_MAX_ROWS, retention_seconds=MQTT_OUTBOX_DB_RETENTION_S)
+                print(f"MQTT: Store-and-forward outbox at {args.outbox_db} ({outbox_store.pending_count()} messages waiting).")
+                log_activity("mqtt_outbox_store_opened", {"path": args.outbox_db, "pending": outbox_store.pending_count()})
+            except Exception as e:
+                print(f"MQTT: Could not open outbox store '{args.outbox_db}': {e}. Messages will be dropped during outages.")
+                log_activity("mqtt_outbox_store_error", {"path": args.outbox_db, "error": str(e)})
+        mqtt_pipeline = MqttPublishPipeline(
+            mqtt_client,
+            max_queued=MQTT_OUTBOX_MAX_QUEUED,
+            max_in_flight=MQTT_MAX_IN_FLIGHT,
+            overflow=args.mqtt_overflow,
+            is_connected=lambda: mqtt_connected,
+            on_event=log_activity,
+            store=outbox_store,
+            drain_batch_size=MQTT_OUTBOX_DRAIN_BATCH,
+            drain_interval=MQTT_OUTBOX_DRAIN_INTERVAL_S,
+        )
+        mqtt_pipeline.start()
         print("MQTT: Client setup initiated. Waiting for connection status...")
         time.sleep(3) # Give MQTT time to connect
         if not mqtt_connected:
@@ -568,133 +686,122 @@ def main():
     if not meshtastic_interface: print(" (Meshtastic functionality disabled due to connection failure)")
     if not mqtt_client or not mqtt_connected: print(" (MQTT publishing disabled or connection issue)")
     
-    current_data_block = []
-    in_data_block = False
     last_meshtastic_sent_time = time.time() # Initialize timers
     last_mqtt_sent_time = time.time()
     last_wio_data_block_update_time = time.time() # ADDED: Initialize Wio update timer
     last_wio_raw_print_time = time.time() # ADDED: Initialize Wio Raw print timer
     currently_printing_raw_block = False # ADDED: Flag to control raw printing for an entire block
 
+    mqtt_batch = [] # Full-resolution mode: readings waiting to be published together
+    send_summaries = SEND_WINDOW_SUMMARIES and not args.snapshot_only
+    # One aggregator per sink so each window lines up with that sink's send interval
+    mesh_window = WindowAggregator() if send_summaries else None
+    mqtt_window = WindowAggregator() if send_summaries and not args.full_resolution else None
+    if args.full_resolution:
+        print(f"MQTT: Full-resolution mode - publishing every reading in batches of {args.mqtt_batch_size} (max age {args.mqtt_batch_age}s, {args.mqtt_batch_format} format).")
+
+    if args.history_capacity > 0:
+        sensor_history = SensorHistory(args.history_capacity)
+        log_activity("sensor_history_ready", {"capacity": sensor_history.capacity, "bytes": sensor_history.memory_bytes()})
+
+    wio_parser = WioFrameParser(on_error=on_wio_parse_error)
+    # Reconnects use the CLI port if one was given, otherwise the device found at startup (remembered by PORT_REGISTRY)
+    wio_link = WioLink(
+        wio_ser,
+        connect=lambda: connect_wio_terminal(args.wio_port),
+        backoff=ReconnectBackoff(WIO_RECONNECT_BASE_S, WIO_RECONNECT_MAX_S, jitter=WIO_RECONNECT_JITTER),
+        parser=wio_parser,
+        port_generation=lambda: PORT_REGISTRY.generation,
+        on_event=log_activity,
+    )
+    log_activity("wio_reader_started", {"port": wio_ser.port})
+
     try:
         while True:
+            # Block on the reader queue until a reading arrives or the next timer is due (max 1s)
+            next_timer_due = min(last_meshtastic_sent_time + args.mesh_interval, last_mqtt_sent_time + args.mqtt_interval)
+            if mqtt_batch:
+                next_timer_due = min(next_timer_due, mqtt_batch[0].rpi_ts + args.mqtt_batch_age)
+            wait_timeout = min(1.0, max(0.0, next_timer_due - time.time()))
+            reading = wio_link.get_frame(timeout=wait_timeout) # Also drives reconnects while the Wio is away
             current_time_for_timers = time.time() # Fetch current time once for all timer checks in this iteration
 
-            if wio_ser.in_waiting > 0:
-                try:
-                    line = wio_ser.readline().decode('utf-8', errors='ignore').strip()
-                    if line:
-                        # Raw printing decision is now per-block, flag set on START_DATA
-                        # The actual printing of raw lines happens after START_DATA logic
-                        
-                        if line == "START_DATA":
-                            # Add RPi system timestamp when a new data block starts
-                            current_data_block = [f"RPI_TIMESTAMP:{datetime.datetime.now().isoformat()}"]
-                            in_data_block = True
-                            # if DEBUG: print("Wio: START_DATA detected.") # MOVED: Now conditional below
-                            log_activity("wio_data_event", {"event": "START_DATA"})
-
-                            # Decide if this entire block should be printed raw
-                            if current_time_for_timers - last_wio_raw_print_time >= 60:
-                                currently_printing_raw_block = True
-                                last_wio_raw_print_time = current_time_for_timers # Reset timer
-                                if DEBUG: # ADDED: Condition for these prints
-                                    print("Wio: START_DATA detected.")
-                                    print(f"Wio Raw (Block Start): {line}") 
-                            else:
-                                currently_printing_raw_block = False
-                        
-                        elif line == "END_DATA":
-                            # if DEBUG and currently_printing_raw_block: # MOVED: END_DATA raw print below
-                            #     print(f"Wio Raw (Block End): {line}")
-                            
-                            if in_data_block:
-                                # if DEBUG: print("Wio: END_DATA detected.") # MOVED: Now conditional below
-                                
-                                # Wio data block update logic (remains the same, uses its own timer)
-                                # Its specific DEBUG prints are about storage, not raw Wio reception, so they stay.
-                                if current_time_for_timers - last_wio_data_block_update_time >= 60:
-                                    if current_data_block:
-                                        latest_complete_data_block = list(current_data_block)
-                                        last_wio_data_block_update_time = current_time_for_timers 
-                                        if DEBUG and currently_printing_raw_block: # MODIFIED: Add currently_printing_raw_block condition
-                                            print(f"Wio (Storage): Stored new data block ({len(latest_complete_data_block)} lines) from Wio. Storage interval timer reset.")
-                                        log_activity("wio_data_block_updated", {"block_size": len(latest_complete_data_block)})
-                                    else:
-                                        if DEBUG and currently_printing_raw_block: # MODIFIED: Add currently_printing_raw_block condition
-                                            print("Wio (Storage): END_DATA, 60s storage interval met, but current Wio block was empty.")
-                                        log_activity("wio_data_event", {"event": "END_DATA_EMPTY_BLOCK_ON_STORAGE_INTERVAL"})
-                                else:
-                                    if DEBUG and currently_printing_raw_block: # MODIFIED: Add currently_printing_raw_block condition
-                                        print(f"Wio (Storage): END_DATA, but <60s since last Wio data storage. New Wio data ignored for storage. Time since last: {current_time_for_timers - last_wio_data_block_update_time:.2f}s")
-                                    log_activity("wio_data_block_ignored_storage_interval", {"current_block_size": len(current_data_block) if current_data_block else 0, "time_since_last_storage": current_time_for_timers - last_wio_data_block_update_time})
-                                
-                                # Print END_DATA related messages only if the block was designated for raw printing
-                                if DEBUG and currently_printing_raw_block:
-                                    print(f"Wio Raw (Block End): {line}") # Print END_DATA raw
-                                    print("Wio: END_DATA detected.")      # Print END_DATA event notification
-
-                                current_data_block = [] 
-                                in_data_block = False
-                                # currently_printing_raw_block flag persists until next START_DATA makes a new decision
-                            else:
-                                print("Warning: END_DATA received without START_DATA.")
-                                log_activity("wio_data_warning", {"warning": "END_DATA without START_DATA"})
-                        
-                        elif in_data_block: # This is a data line within a block
-                            if line.startswith("TIMESTAMP:"):
-                                if DEBUG and currently_printing_raw_block: # Still log if we are raw printing the block
-                                    print(f"Wio Raw (Ignored Wio Timestamp): {line}")
-                                log_activity("wio_data_event", {"event": "IGNORED_WIO_TIMESTAMP", "line": line})
-                                # Skip appending this line
-                            else:
-                                current_data_block.append(line)
-                                if DEBUG and currently_printing_raw_block: # Print other data lines raw if block was chosen
-                                    if len(line) < 150: print(f"Wio Raw: {line}")
-                                    else: print(f"Wio Raw: (line too long to print, len={len(line)})")
-                except UnicodeDecodeError:
-                    print("Warning: Could not decode line from Wio Terminal (not UTF-8). Ensure Wio sketch sends UTF-8.")
-                    log_activity("wio_decode_error", {"error": "UnicodeDecodeError"})
-                except serial.SerialException as e:
-                    print(f"Serial error reading from Wio Terminal: {e}. Attempting to reconnect...")
-                    log_activity("wio_serial_exception", {"error": str(e), "action": "Attempting reconnect"})
-                    if wio_ser: wio_ser.close()
-                    time.sleep(5)
-                    # Preserve original CLI arg or last known port for reconnect attempt
-                    reconnect_port_arg = args.wio_port if args.wio_port else (wio_ser.port if wio_ser and hasattr(wio_ser, 'port') else None)
-                    wio_ser = connect_wio_terminal(reconnect_port_arg)
-                    if not wio_ser:
-                        print("Failed to reconnect Wio Terminal. Exiting program.")
-                        log_activity("wio_reconnect_failed", {"port_arg_tried": reconnect_port_arg})
-                        break # Exit main while loop
-                    else:
-                        print("Successfully reconnected to Wio Terminal.")
-                        log_activity("wio_reconnect_success", {"port": wio_ser.port})
-            
-            # Meshtastic timed sending logic (5 minutes = 300 seconds)
-            if current_time_for_timers - last_meshtastic_sent_time >= 300:
-                if latest_complete_data_block:
-                    if DEBUG: print(f"Timer (Meshtastic): 5min interval reached. Sending latest captured data block ({len(latest_complete_data_block)} lines).")
+            if reading is not None:
+                # Print one full block at most every 60s so the console is not flooded at 1 Hz
+                currently_printing_raw_block = current_time_for_timers - last_wio_raw_print_time >= 60
+                if currently_printing_raw_block:
+                    last_wio_raw_print_time = current_time_for_timers # Reset timer
+                    if DEBUG:
+                        print("Wio: Data block received.")
+                        for text_line in reading.as_text_lines(): print(f"Wio Data: {text_line}")
+                log_activity("wio_data_event", {"event": "BLOCK_PARSED", "num_fields": len(reading)})
+                if reading.errors:
+                    log_activity("wio_data_warning", {"warning": "Malformed lines in data block", "lines": reading.errors})
+
+                # Wio data block update logic (uses its own timer)
+                if current_time_for_timers - last_wio_data_block_update_time >= 60:
+                    latest_complete_data_block = reading
+                    last_wio_data_block_update_time = current_time_for_timers
+                    if DEBUG and currently_printing_raw_block:
+                        print(f"Wio (Storage): Stored new data block ({len(latest_complete_data_block)} fields) from Wio. Storage interval timer reset.")
+                    log_activity("wio_data_block_updated", {"block_size": len(latest_complete_data_block)})
+                else:
+                    log_activity("wio_data_block_ignored_storage_interval", {"current_block_size": len(reading), "time_since_last_storage": current_time_for_timers - last_wio_data_block_update_time})
+
+                if sensor_history is not None:
+                    sensor_history.append(reading)
+                if mesh_window:
+                    mesh_window.add(reading)
+                if mqtt_window:
+                    mqtt_window.add(reading)
+                if args.full_resolution:
+                    mqtt_batch.append(reading)
+
+            # Meshtastic timed sending logic (default 5 minutes = 300 seconds)
+            if current_time_for_timers - last_meshtastic_sent_time >= args.mesh_interval:
+                mesh_summary = mesh_window.take_summary(current_time_for_timers) if mesh_window else None
+                if mesh_summary:
+                    if DEBUG: print(f"Timer (Meshtastic): Interval reached. Sending window summary ({mesh_summary.blocks} readings, {len(mesh_summary)} channels).")
+                    log_activity("meshtastic_timed_send_triggered", {"window_blocks": mesh_summary.blocks, "num_channels": len(mesh_summary)})
+                    send_data_to_meshtastic(mesh_summary, meshtastic_interface)
+                elif not mesh_window and latest_complete_data_block:
+                    if DEBUG: print(f"Timer (Meshtastic): Interval reached. Sending latest captured data block ({len(latest_complete_data_block)} fields).")
                     log_activity("meshtastic_timed_send_triggered", {"data_block_size": len(latest_complete_data_block)})
                     send_data_to_meshtastic(latest_complete_data_block, meshtastic_interface)
                     # We don't clear latest_complete_data_block here, MQTT might need it
                 elif DEBUG:
-                    print("Timer (Meshtastic): 5min interval reached, but no complete data block from Wio to send.")
+                    print("Timer (Meshtastic): Interval reached, but no complete data block from Wio to send.")
                     log_activity("meshtastic_timed_send_skipped_no_data", {})
                 last_meshtastic_sent_time = current_time_for_timers
 
-            # MQTT timed sending logic (2.5 minutes = 150 seconds)
-            if current_time_for_timers - last_mqtt_sent_time >= 150:
-                if latest_complete_data_block:
-                    if DEBUG: print(f"Timer (MQTT): 2.5min interval reached. Publishing latest captured data block ({len(latest_complete_data_block)} lines).")
+            # Full-resolution MQTT: publish when the batch is full or its oldest reading is too old
+            if mqtt_batch and (len(mqtt_batch) >= args.mqtt_batch_size or current_time_for_timers - mqtt_batch[0].rpi_ts >= args.mqtt_batch_age):
+                if DEBUG: print(f"MQTT: Publishing batch of {len(mqtt_batch)} readings.")
+                log_activity("mqtt_batch_publish_triggered", {"num_readings": len(mqtt_batch), "format": args.mqtt_batch_format})
+                publish_batch_to_mqtt(mqtt_batch, mqtt_client, args.mqtt_batch_format)
+                mqtt_batch = []
+
+            # MQTT timed sending logic (default 2.5 minutes = 150 seconds)
+            if current_time_for_timers - last_mqtt_sent_time >= args.mqtt_interval:
+                mqtt_summary = mqtt_window.take_summary(current_time_for_timers) if mqtt_window else None
+                if args.full_resolution:
+                    pass # Every reading is already published in batches
+                elif mqtt_summary:
+                    if DEBUG: print(f"Timer (MQTT): Interval reached. Publishing window summary ({mqtt_summary.blocks} readings, {len(mqtt_summary)} channels).")
+                    log_activity("mqtt_timed_publish_triggered", {"window_blocks": mqtt_summary.blocks, "num_channels": len(mqtt_summary)})
+                    publish_data_to_mqtt(mqtt_summary, mqtt_client)
+                elif not mqtt_window and latest_complete_data_block:
+                    if DEBUG: print(f"Timer (MQTT): Interval reached. Publishing latest captured data block ({len(latest_complete_data_block)} fields).")
                     log_activity("mqtt_timed_publish_triggered", {"data_block_size": len(latest_complete_data_block)})
                     publish_data_to_mqtt(latest_complete_data_block, mqtt_client)
                 elif DEBUG:
-                    print("Timer (MQTT): 2.5min interval reached, but no complete data block from Wio to publish.")
+                    print("Timer (MQTT): Interval reached, but no complete data block from Wio to publish.")
                     log_activity("mqtt_timed_publish_skipped_no_data", {})
+                if mqtt_pipeline:
+                    outbox_stats = mqtt_pipeline.stats()
+                    log_activity("mqtt_outbox_stats", outbox_stats)
+                    if DEBUG: print(f"MQTT Outbox: queue={outbox_stats['queue_depth']}/{outbox_stats['max_queued']}, in_flight={outbox_stats['in_flight']}, acked={outbox_stats['acked']}, dropped={outbox_stats['dropped_overflow']}, ack_latency_avg={outbox_stats['ack_latency_avg']}")
                 last_mqtt_sent_time = current_time_for_timers
-            
-            time.sleep(0.1) # Retain sleep to prevent busy-waiting
 
     except KeyboardInterrupt:
         print("\nExiting program (Keyboard Interrupt)...")
@@ -708,10 +815,14 @@ def main():
     finally:
         print("Cleaning up resources...")
         log_activity("script_shutdown", {"reason": "Normal exit or unhandled exception in main try block"})
-        if wio_ser and wio_ser.is_open:
-            wio_ser.close()
+        if PORT_REGISTRY:
+            PORT_REGISTRY.stop()
+        if mqtt_batch:
+            log_activity("mqtt_batch_publish_triggered", {"num_readings": len(mqtt_batch), "format": args.mqtt_batch_format, "reason": "shutdown"})
+            publish_batch_to_mqtt(mqtt_batch, mqtt_client, args.mqtt_batch_format)
+        if wio_link.close():
             print("Wio Terminal serial port closed.")
-            log_activity("wio_serial_closed", {"port": wio_ser.port if hasattr(wio_ser, 'port') else 'N/A'})
+            log_activity("wio_serial_closed", {"port": getattr(wio_link.ser, 'port', 'N/A'), "reconnects": wio_link.reconnects, "dropped_frames": wio_link.dropped_frames})
         if meshtastic_interface:
             meshtastic_interface.close()
             print("Meshtastic interface closed.")
@@ -723,14 +834,19 @@ def main():
             # Ensure traceback is available for logging if DEBUG is true, though less likely needed here
             tb_str_mqtt_disconnect = traceback.format_exc() if DEBUG else "Set DEBUG for traceback"
             log_activity("mqtt_disconnect_start", {"client_id": mqtt_client._client_id.decode() if mqtt_client._client_id else "Unknown"})
+            if mqtt_pipeline:
+                mqtt_pipeline.stop() # Gives queued messages a few seconds to go out, stores the rest
+                log_activity("mqtt_outbox_stats", mqtt_pipeline.stats())
+                if mqtt_pipeline.store is not None:
+                    mqtt_pipeline.store.close()
             mqtt_client.loop_stop()
             mqtt_client.disconnect()
             if DEBUG: print("MQTT: Client disconnected.")
             log_activity("mqtt_disconnected", {"client_id": mqtt_client._client_id.decode() if mqtt_client._client_id else "Unknown"})
 
         if LOG_FILE:
-            print(f"Closing log file: {LOG_FILENAME}")
-            LOG_FILE.close()
+            print(f"Closing log file: {LOG_FILENAME} ({LOG_FILE.stats()['written']} entries written, {LOG_FILE.stats()['dropped']} dropped)")
+            LOG_FILE.close() # Writes out whatever is still queued and fsyncs
             LOG_FILE = None # Set to None after closing
 
         print("Cleanup complete. Application finished.")